@@ -1,12 +1,34 @@
 #!python3
 # -*- coding: cp1252 -*-
+import datetime
+import json
+import os
+import re
+import tempfile
+import time
 from io import StringIO
 
 from sisposbase.sispos import BaseSISPOSSQL
-from sisposbase.get_sql_data import getsqldata, sql_substitute_variables
-
-import copy
-import datetime
+from sisposbase.columnar import (
+    DATA_DDMMAA,
+    INT,
+    STR,
+    Colunas,
+    colunas_de_registros,
+    colunas_de_valores,
+    data_de_ordinal,
+)
+from sisposbase.get_sql_data import (
+    getsqldata_many,
+    iter_sqldata_primeiro,
+    sql_substitute_variables,
+)
+
+try:
+    # NumPy  opcional, veja sisposbase.columnar
+    import numpy
+except ImportError:
+    numpy = None
 
 wkdays = {
     0: "Segunda-Feira",
@@ -19,26 +41,52 @@ wkdays = {
 }
 
 
+# Campos de CRIMES_HH / CRIMES_HM
+crimes_schema = (
+    ("matricula", INT),
+    ("turno", INT),
+    ("data", DATA_DDMMAA),
+    ("htipo", INT),
+    (None, None),  # horas em base 10, usamos os minutos
+    ("minutos", INT),
+)
+
+# Erros encontrados, um por lanamento, para a exportao (--exporta).
+# verificacao: "lancamento" (o lanamento sozinho) ou "dia" (os lanamentos do dia, juntos)
+achados_schema = (
+    ("tipo", STR),
+    ("matricula", INT),
+    ("data", DATA_DDMMAA),
+    ("turno", INT),
+    ("htipo", INT),
+    ("minutos", INT),
+    ("verificacao", STR),
+)
+
+
 def cria_bancodedados(arquivoexterno):
     bd = {}
 
-    # pula a primeira linha pois ela e o cabecalho, no sistema novo.
-    for _linha in arquivoexterno[1:]:
-
-        matr, turno, data, htipo, _ign, minutos = _linha
+    # aceita colunas prontas ou linhas (lista ou iterador, com cabecalho na primeira linha)
+    if isinstance(arquivoexterno, Colunas):
+        cols = arquivoexterno
+    else:
+        cols = colunas_de_registros(arquivoexterno, crimes_schema, cabecalho=True)
 
-        matr = int(matr)
-        turno = int(turno)
-        htipo = int(float(htipo))
-        minutos = int(minutos)
+    # Convert data as obj (uma vez por dia distinto)
+    datas = {}
 
-        # Convert data as obj
-        data_obj = datetime.datetime.strptime(data, r"%d/%m/%y")
+    for matr, turno, data, htipo, minutos in cols.linhas(
+        "matricula", "turno", "data", "htipo", "minutos"
+    ):
+        if data not in datas:
+            datas[data] = data_de_ordinal(data)
+        data_obj = datas[data]
 
         if matr not in bd:
             bd[matr] = {}
 
-        if data_obj not in bd[matr].keys():
+        if data_obj not in bd[matr]:
             bd[matr][data_obj] = []
 
         bd[matr][data_obj].append([turno, htipo, minutos])
@@ -46,14 +94,275 @@ def cria_bancodedados(arquivoexterno):
     return bd
 
 
+# ----------------------------------------------------------------------
+# Regras dos lanamentos
+# ----------------------------------------------------------------------
+
+# Tipos de dia
+DIA_NORMAL = 0  # segunda a sexta
+FERIADO_50 = 1  # sbado ou feriado emendado ("Feriado 50%")
+FERIADO_100 = 2  # domingo ou feriado real ("Feriado 100%")
+
+# Verificao dos minutos de um lanamento
+ERRO = 0  # qualquer lanamento  erro
+EXATO = 1  # os minutos tm que ser exatamente o limite
+MAXIMO = 2  # os minutos no podem passar do limite
+
+QUALQUER = None
+
+# (tipo de dia, turno, htipo) -> (verificao, minutos)
+# A chave  procurada da mais especfica para a mais geral, veja regra_do_lancamento().
+# Combinaes que no esto na tabela no so verificadas.
+limites_hh = {
+    # Se TURNO=4 (21h) Regra especial: s htipo 3, com 1260 minutos = 21 horas, em qualquer dia
+    (QUALQUER, 4, 3): (EXATO, 21 * 60),
+    (QUALQUER, 4, QUALQUER): (ERRO, 0),
+    # Dias
+    (DIA_NORMAL, 1, 0): (EXATO, 8 * 60),  # 8h
+    (DIA_NORMAL, 2, 0): (EXATO, 7 * 60 + 37),  # 7h 37min
+    (DIA_NORMAL, 3, 0): (EXATO, 7 * 60 + 15),  # 7h 15min
+    (DIA_NORMAL, 1, 1): (MAXIMO, 2 * 60),  # 2 horas extras
+    (DIA_NORMAL, 2, 1): (MAXIMO, 2 * 60),
+    (DIA_NORMAL, 3, 1): (MAXIMO, 2 * 60),
+    (DIA_NORMAL, QUALQUER, 2): (ERRO, 0),
+    # Dia de Feriado Emendado ("Feriado 50%")
+    (FERIADO_50, QUALQUER, 0): (ERRO, 0),
+    (FERIADO_50, QUALQUER, 2): (ERRO, 0),
+    (FERIADO_50, 1, 1): (MAXIMO, 8 * 60),
+    (FERIADO_50, 2, 1): (MAXIMO, 7 * 60 + 37),
+    (FERIADO_50, 3, 1): (MAXIMO, 7 * 60 + 15),
+    # Dia de Feriado Real ("Feriado 100%")
+    (FERIADO_100, QUALQUER, 0): (ERRO, 0),
+    (FERIADO_100, QUALQUER, 1): (ERRO, 0),
+    (FERIADO_100, 1, 2): (MAXIMO, 8 * 60),
+    (FERIADO_100, 2, 2): (MAXIMO, 7 * 60 + 37),
+    (FERIADO_100, 3, 2): (MAXIMO, 7 * 60 + 15),
+}
+
+# HM: em dia normal as horas normais podem ser menores que o turno
+limites_hm = {
+    **limites_hh,
+    (DIA_NORMAL, 1, 0): (MAXIMO, 8 * 60),
+    (DIA_NORMAL, 2, 0): (MAXIMO, 7 * 60 + 37),
+    (DIA_NORMAL, 3, 0): (MAXIMO, 7 * 60 + 15),
+}
+
+
+def tipo_do_dia(ordinal, dias_1, dias_2):
+    """Tipo de dia de uma data (ordinal), dias_1/dias_2 so conjuntos de ordinais dos feriados."""
+    if ordinal in dias_2:
+        return FERIADO_100
+    if ordinal in dias_1:
+        return FERIADO_50
+
+    # datetime.fromordinal(1)  uma segunda-feira
+    weekday = (ordinal - 1) % 7
+    if weekday == 5:
+        return FERIADO_50
+    if weekday == 6:
+        return FERIADO_100
+    return DIA_NORMAL
+
+
+def regra_do_lancamento(limites, tipodia, turno, htipo):
+    """Devolve (verificao, minutos) para o lanamento, ou None se no h o que verificar."""
+    for chave in (
+        (QUALQUER, turno, htipo),
+        (QUALQUER, turno, QUALQUER),
+        (tipodia, turno, htipo),
+        (tipodia, QUALQUER, htipo),
+    ):
+        if chave in limites:
+            return limites[chave]
+    return None
+
+
+def julga_lancamentos(cols, limites, dias_1, dias_2):
+    """Julga todos os lanamentos das colunas de uma vez, devolve um bool (erro?) por linha.
+
+    A regra  resolvida uma vez por combinao distinta de (data, turno, htipo),
+    depois s os minutos so comparados.
+    """
+    data, turno, htipo, minutos = (cols[n] for n in ("data", "turno", "htipo", "minutos"))
+
+    if numpy is not None and isinstance(data, numpy.ndarray):
+        if not len(data):
+            return numpy.zeros(0, dtype=bool)
+
+        chaves = numpy.stack([data, turno, htipo], axis=1)
+        distintas, inversa = numpy.unique(chaves, axis=0, return_inverse=True)
+
+        verif = numpy.full(len(distintas), -1, dtype="i1")
+        limite = numpy.zeros(len(distintas), dtype="i8")
+        for i, (d, t, h) in enumerate(distintas.tolist()):
+            regra = regra_do_lancamento(limites, tipo_do_dia(d, dias_1, dias_2), t, h)
+            if regra is not None:
+                verif[i], limite[i] = regra
+
+        verif = verif[inversa.reshape(-1)]
+        limite = limite[inversa.reshape(-1)]
+        return (
+            (verif == ERRO)
+            | ((verif == EXATO) & (minutos != limite))
+            | ((verif == MAXIMO) & (minutos > limite))
+        )
+
+    regras = {}
+    erros = []
+    for chave, m in zip(zip(data, turno, htipo), minutos):
+        if chave in regras:
+            regra = regras[chave]
+        else:
+            d, t, h = chave
+            regra = regras[chave] = regra_do_lancamento(limites, tipo_do_dia(d, dias_1, dias_2), t, h)
+
+        if regra is None:
+            erros.append(False)
+        else:
+            verif, limite = regra
+            erros.append(
+                verif == ERRO or (verif == EXATO and m != limite) or (verif == MAXIMO and m > limite)
+            )
+    return erros
+
+
+def julgalinhas(levents):
+    """Julga os lanamentos de uma matrcula num mesmo dia, juntos (HH)."""
+    if len(levents) == 1:
+        return False
+    elif len(levents) > 3:
+        return True
+
+    adm8h = [1, 0, 8 * 60]
+    pedegalinha_adm2h = [1, 1, 2 * 60]
+    pedegalinha_adm1h = [1, 1, 1 * 60]
+
+    if (
+        (adm8h in levents)
+        and (pedegalinha_adm2h in levents)
+        or (adm8h in levents)
+        and (pedegalinha_adm1h in levents)
+    ):
+        return False
+    else:
+        return True
+
+
+def agrupa_por_matricula_e_dia(cols):
+    """{matricula: {data: [linhas]}}, na ordem em que aparecem."""
+    grupos = {}
+    for i, (matr, data) in enumerate(cols.linhas("matricula", "data")):
+        if matr not in grupos:
+            grupos[matr] = {}
+        if data not in grupos[matr]:
+            grupos[matr][data] = []
+        grupos[matr][data].append(i)
+    return grupos
+
+
+# ----------------------------------------------------------------------
+# Modo incremental (--incremental)
+# ----------------------------------------------------------------------
+#
+# A Apropriacao no tem data de alterao (s dataHoraCriacao, que no pega
+# correes nem excluses), ento o que mudou  descoberto por matrcula: o banco
+# devolve, para cada matrcula, a quantidade de linhas do CRIMES_*, o total de
+# minutos e a soma de um hash (SHA-256) de cada linha (sql_resumo). S as matrculas cujo resumo mudou so buscadas e julgadas
+# de novo; as outras vm da execuo anterior, guardada por perodo em
+# cache/criticas.
+
+CRITICASPATH = os.path.join(os.getcwd(), "cache", "criticas")
+
+# Acima disso busca o perodo inteiro em vez de filtrar "matricula in (...)"
+max_filtro_matriculas = 500
+
+
+def filtro_matriculas(coluna, matriculas=None):
+    """Condio SQL que restringe a consulta s matrculas dadas (None: todas)."""
+    if matriculas is None:
+        return ""
+    return "and %s in (%s)" % (coluna, ", ".join(str(int(m)) for m in sorted(matriculas, key=int)))
+
+
+def sql_resumo(sqlcrimes):
+    """Transforma uma consulta CRIMES_* no resumo por matrcula: quantidade de linhas, minutos e hash delas.
+
+    O hash de cada linha leva turno, data, htipo e minutos, ento horas trocadas entre
+    dias ou tipos de hora mudam o resumo (o checksum_agg/binary_checksum no pegava:
+     um XOR). A soma no depende da ordem das linhas.
+    """
+    corpo = sqlcrimes[: sqlcrimes.lower().rindex("order by")]
+
+    # Declaraes antes, a consulta (primeira linha que comea com select) vira a CTE x,
+    # com as colunas renomeadas como em crimes_schema
+    m = re.search(r"^\s*select\b", corpo, re.MULTILINE | re.IGNORECASE)
+    declaracoes, consulta = corpo[: m.start()], corpo[m.start() :]
+
+    return (
+        f"{declaracoes}\n"
+        f"with x (matricula, turno, data, htipo, horas, minutos) as (\n{consulta}\n)\n"
+        f"select\n"
+        f"    x.matricula matricula,\n"
+        f"    count(*) linhas,\n"
+        f"    sum(x.minutos) minutos,\n"
+        f"    sum(cast(checksum(hashbytes('SHA2_256', "
+        f"concat(x.turno, '|', x.data, '|', x.htipo, '|', x.minutos))) as bigint)) soma\n"
+        f"from x\n"
+        f"group by x.matricula\n"
+        f"order by 1;"
+    )
+
+
+def _caminho_estado(periodoid):
+    return os.path.join(CRITICASPATH, f"{periodoid}.json")
+
+
+def carrega_estado(periodoid):
+    """Estado da ltima execuo incremental do perodo, ou None."""
+    try:
+        with open(_caminho_estado(periodoid), "r", encoding="utf-8") as fe:
+            return json.load(fe)
+    except (OSError, ValueError):
+        return None
+
+
+def grava_estado(periodoid, estado):
+    os.makedirs(CRITICASPATH, exist_ok=True)
+    fd, tmppath = tempfile.mkstemp(dir=CRITICASPATH, suffix=".tmp")
+    try:
+        with open(fd, "w", encoding="utf-8") as fe:
+            json.dump(estado, fe, ensure_ascii=False)
+        os.replace(tmppath, _caminho_estado(periodoid))
+    finally:
+        if os.path.exists(tmppath):
+            os.remove(tmppath)
+
+
+def ordem_das_matriculas(matriculas):
+    """Ordena {matricula: {"registros": ...}} como no relatrio completo: pela primeira
+    linha de cada matrcula (data, turno), como no "order by" das consultas CRIMES_*."""
+    datas = {}
+
+    def chave(m):
+        _, turno, data = matriculas[m]["registros"][0][:3]
+        if data not in datas:
+            datas[data] = datetime.datetime.strptime(data.strip(), "%d/%m/%y")
+        return datas[data], int(turno), int(m)
+
+    return sorted((m for m in matriculas if matriculas[m]["registros"]), key=chave)
+
+
 class Criticas(BaseSISPOSSQL):
     """Busca por Erros na Digitao de HH e HM para correes antes do fechamento."""
 
-    def gera_crimeshh(self):
+    def sql_crimeshh(self, matriculas=None):
 
         f = self.inputfiles
 
-        variables = {"PERIODOID": f["#PERIODOID"]}
+        variables = {
+            "PERIODOID": f["#PERIODOID"],
+            "FILTRO": filtro_matriculas("e.matricula", matriculas),
+        }
 
         sqlcode = f"""
             -- CRIMES_HH
@@ -90,6 +399,7 @@ class Criticas(BaseSISPOSSQL):
 
                 -- selecione o periodo
                 a.fkPeriodo = @PERIODO
+                @@FILTRO@@
             group by 
                 e.matricula, t.codigo, a.dataApropriacao, th.codigo
 
@@ -97,222 +407,111 @@ class Criticas(BaseSISPOSSQL):
                     """
 
         # Substitui variaveis
-        data = getsqldata(sql_substitute_variables(sqlcode, variables))[0]
-        return data
-
-    def process_hh(self, f):
-
-        o1 = StringIO()
-
-        arm = cria_bancodedados(self.gera_crimeshh())
-
-        # Lancamento
-
-        def julga(dateobj, evento):
-
-            # dateobj = datetime.date(int(ano), int(mes), int(dia))
-            weekday = dateobj.weekday()
-
-            erro = False
-
-            # Tipo Hora
-            tipohora = "?"
-            if weekday in (0, 1, 2, 3, 4):
-                tipohora = 0
-            elif weekday in (5,):
-                tipohora = 1
-            elif weekday in (6,):
-                tipohora = 2
-            if _data in dias_1:
-                # print "%self eh dia 1" % (_data,)
-                tipohora = 1
-            if _data in dias_2:
-                tipohora = 2
+        return sql_substitute_variables(sqlcode, variables)
 
-            # Separa informacoes do evento
-            _turno, _htipo, _minutos = evento
-
-            # Se TURNO=4 (21h) Regra especial.
-            # 1260 minutos = 21 horas
-            if _turno == 4 and _htipo == 3 and _minutos != 21 * 60:
-                return True
-
-            if _turno == 4 and _htipo != 3:
-                return True
-
-            # Dias
-            if tipohora in (0,):
-
-                if _htipo == 0 and _turno == 1:
-                    # 8h
-                    if _minutos != 8 * 60:
-                        return True
-
-                if _htipo == 0 and _turno == 2:
-                    # 7h 37min
-                    if _minutos != (7 * 60 + 37):
-                        return True
-
-                if _htipo == 0 and _turno == 3:
-                    # 7h 15min
-                    if _minutos != (7 * 60 + 15):
-                        return True
-
-                if _htipo == 1 and _turno == 1:
-                    # 2 horas extras
-                    if _minutos > 2 * 60:
-                        return True
-
-                if _htipo == 1 and _turno == 2:
-                    # 2 horas extras
-                    if _minutos > 2 * 60:
-                        return True
-
-                if _htipo == 1 and _turno == 3:
-                    # 2 horas extras
-                    if _minutos > 2 * 60:
-                        return True
-
-                if _htipo == 2:
-                    return True
-
-            ## Dia de Feriado Emendado ("Feriado 50%")
-            if tipohora in (1,):
-
-                if _htipo in (0, 2):
-                    return True
-
-                # 8h
-                if _htipo == 1 and _turno == 1 and _minutos > 8 * 60:
-                    return True
+    def gera_crimeshh(self):
+        return iter_sqldata_primeiro(self.sql_crimeshh(), periodo=self.inputfiles["#PERIODOID"])
 
-                # 7h37m
-                if _htipo == 1 and _turno == 2 and _minutos > (7 * 60 + 37):
-                    return True
+    def process_hh(self, f, crimeshh=None, achados=None):
 
-                # 7h15m
-                if _htipo == 1 and _turno == 3 and _minutos > (7 * 60 + 15):
-                    return True
+        if crimeshh is None:
+            crimeshh = self.gera_crimeshh()
 
-            ## Dia de Feriado Real ("Feriado 100%")
-            if tipohora in (2,):
+        return self.escreve_criticas(f, crimeshh, limites_hh, julgalinhas, achados)
 
-                if _htipo in (0, 1):
-                    return True
+    def criticas_por_matricula(self, f, crimes, limites, julga_dia=None, achados=None):
+        """Julga os lanamentos e devolve os erros de cada matrcula, como blocos de texto.
 
-                # 8h
-                if _htipo == 2 and _turno == 1 and _minutos > 8 * 60:
-                    return True
+        {matricula: [blocos]}, na ordem em que as matrculas aparecem (sem erro: lista vazia).
+        julga_dia: julga tambm os lanamentos de cada matrcula/dia juntos (lista de [turno, htipo, minutos]).
+        achados: lista onde tambm so acrescentados os erros como linhas
+        (matricula, data, turno, htipo, minutos, verificacao), ver achados_schema.
+        """
+        # aceita colunas prontas ou linhas (lista ou iterador, com cabecalho na primeira linha)
+        if isinstance(crimes, Colunas):
+            cols = crimes
+        else:
+            cols = colunas_de_registros(crimes, crimes_schema, cabecalho=True)
 
-                # 7h37m
-                if _htipo == 2 and _turno == 2 and _minutos > (7 * 60 + 37):
-                    return True
+        dias_1 = {i.dia.toordinal() for i in f["#DIAS1"]}
+        dias_2 = {i.dia.toordinal() for i in f["#DIAS2"]}
 
-                # 7h15m
-                if _htipo == 2 and _turno == 3 and _minutos > (7 * 60 + 15):
-                    return True
-
-        def julgalinhas(levents):
-
-            leventscopy = copy.deepcopy(levents)
-
-            if len(levents) == 1:
-                return False
-            elif len(levents) > 3:
-                return True
-
-            trabadm = False
+        # Lanamento - todos de uma vez
+        erros = julga_lancamentos(cols, limites, dias_1, dias_2)
+        if numpy is not None and isinstance(erros, numpy.ndarray):
+            erros = erros.tolist()
 
-            adm8h = [1, 0, 8 * 60]
-            pedegalinha_adm2h = [1, 1, 2 * 60]
-            pedegalinha_adm1h = [1, 1, 1 * 60]
+        eventos = list(cols.linhas("turno", "htipo", "minutos"))
 
-            if (
-                (adm8h in leventscopy)
-                and (pedegalinha_adm2h in leventscopy)
-                or (adm8h in leventscopy)
-                and (pedegalinha_adm1h in leventscopy)
-            ):
-                return False
-            else:
-                return True
+        def evento_txt(evento):
+            et, eht, emin = evento
+            ehoras = "{0:02}:{1:02}".format(emin // 60, emin % 60)
+            return "%s%s%s (%s min)\n" % (
+                str(et).ljust(7),
+                str(eht).ljust(7),
+                str(ehoras).ljust(7),
+                emin,
+            )
 
-        dias_1 = [i.dia for i in f["#DIAS1"]]
-        dias_2 = [i.dia for i in f["#DIAS2"]]
+        cabecalho = "%s%s%s\n" % ("turno".ljust(7), "htipo".ljust(7), "hora".ljust(7))
 
         # Processamento2
-        for _matr in arm.keys():
-            for _data in arm[_matr].keys():
-                # Dia da Semana
-                # dia, mes, ano = _data.strip().split(r'/')
-
-                # dateobj = datetime.strptime(_data, r"%d/%m/%Y %H:%M:%S")
-                # dateobj = datetime.date(int(ano), int(mes), int(dia))
+        criticas = {}
+        for _matr, dias in agrupa_por_matricula_e_dia(cols).items():
+            blocos = criticas[_matr] = []
+            for ordinal, linhas in dias.items():
+                _data = data_de_ordinal(ordinal)
 
+                # Dia da Semana
                 weekday = _data.weekday()
+                _datas = "{}/{}/{}".format(_data.day, _data.month, _data.year)
 
-                for evento in arm[_matr][_data]:
-                    # print evento
-                    if julga(_data, evento):
+                for i in linhas:
+                    if erros[i]:
 
                         feriado = ""
-                        if _data in dias_1:
+                        if ordinal in dias_1:
                             feriado = "Feriado 50%"
-                        elif _data in dias_2:
+                        elif ordinal in dias_2:
                             feriado = "Feriado 100%"
 
-                        _datas = "{}/{}/{}".format(_data.day, _data.month, _data.year)
-                        o1.write(
-                            "[%s] [%s] [%s] %s\n"
-                            % (_matr, _datas, wkdays[weekday], feriado)
-                        )
-                        o1.write(
-                            "%s%s%s\n"
-                            % ("turno".ljust(7), "htipo".ljust(7), "hora".ljust(7))
-                        )
-                        entrada = evento
-                        et, eht, emin = evento
-                        ehoras = "{0:02}:{1:02}".format(emin // 60, emin % 60)
-                        o1.write(
-                            "%s%s%s (%s min)\n"
-                            % (
-                                str(et).ljust(7),
-                                str(eht).ljust(7),
-                                str(ehoras).ljust(7),
-                                emin,
-                            )
+                        blocos.append(
+                            "[%s] [%s] [%s] %s\n" % (_matr, _datas, wkdays[weekday], feriado)
+                            + cabecalho
+                            + evento_txt(eventos[i])
+                            + "\n"
                         )
-                        o1.write("\n")
-
-                        # raw_input("ERRO DETECTADO")
-
-                if julgalinhas(arm[_matr][_data]):
-                    _datas = "{}/{}/{}".format(_data.day, _data.month, _data.year)
-                    o1.write("[%s] [%s] [%s]\n" % (_matr, _datas, wkdays[weekday]))
-                    o1.write(
-                        "%s%s%s\n"
-                        % ("turno".ljust(7), "htipo".ljust(7), "hora".ljust(7))
-                    )
-                    for entrada in arm[_matr][_data]:
-                        et, eht, emin = entrada
-                        ehoras = "{0:02}:{1:02}".format(emin // 60, emin % 60)
-                        o1.write(
-                            "%s%s%s (%s min)\n"
-                            % (
-                                str(et).ljust(7),
-                                str(eht).ljust(7),
-                                str(ehoras).ljust(7),
-                                emin,
-                            )
+                        if achados is not None:
+                            achados.append((_matr, ordinal, *eventos[i], "lancamento"))
+
+                if julga_dia is not None:
+                    levents = [list(eventos[i]) for i in linhas]
+                    if julga_dia(levents):
+                        blocos.append(
+                            "[%s] [%s] [%s]\n" % (_matr, _datas, wkdays[weekday])
+                            + cabecalho
+                            + "".join(evento_txt(entrada) for entrada in levents)
+                            + "\n"
                         )
-                    o1.write("\n")
+                        if achados is not None:
+                            achados.extend((_matr, ordinal, *eventos[i], "dia") for i in linhas)
+        return criticas
+
+    def escreve_criticas(self, f, crimes, limites, julga_dia=None, achados=None):
+        """Julga os lanamentos e escreve os erros, por matrcula e dia (ver criticas_por_matricula)."""
+        o1 = StringIO()
+        for blocos in self.criticas_por_matricula(f, crimes, limites, julga_dia, achados).values():
+            o1.write("".join(blocos))
         return o1
 
-    def gera_crimeshm(self):
+    def sql_crimeshm(self, matriculas=None):
 
         f = self.inputfiles
 
-        variables = {"PERIODO": f["#PERIODOID"]}
+        variables = {
+            "PERIODO": f["#PERIODOID"],
+            "FILTRO": filtro_matriculas("m.matricula", matriculas),
+        }
 
         sqlcode = (
             "-- CRIMES_HM\n"
@@ -349,6 +548,7 @@ class Criticas(BaseSISPOSSQL):
             "\n"
             "	-- selecione o periodo\n"
             "	a.fkPeriodo = @PERIODO\n"
+            "	@@FILTRO@@\n"
             "group by \n"
             "	m.matricula, t.codigo, a.dataApropriacao, th.codigo\n"
             "	\n"
@@ -356,182 +556,191 @@ class Criticas(BaseSISPOSSQL):
         )
 
         # Substitui variaveis
-        data = getsqldata(sql_substitute_variables(sqlcode, variables))[0]
-        return data
+        return sql_substitute_variables(sqlcode, variables)
 
-    def process_hm(self, f):
+    def gera_crimeshm(self):
+        return iter_sqldata_primeiro(self.sql_crimeshm(), periodo=self.inputfiles["#PERIODOID"])
 
-        o1 = StringIO()
+    def process_hm(self, f, crimeshm=None, achados=None):
 
         # o1 = self.getoutputfile(
         #    ext="txt", append="HM_%s-%s" % (f["#MES"], f["#ANO"])
         # )
 
-        arm = cria_bancodedados(self.gera_crimeshm())
-
-        # Lancamento
-
-        def julga(dateobj, evento):
-
-            # dateobj = datetime.date(int(ano), int(mes), int(dia))
-            weekday = dateobj.weekday()
-
-            erro = False
-
-            ## Tipo Hora
-            tipohora = "?"
-            if weekday in (0, 1, 2, 3, 4):
-                tipohora = 0
-            elif weekday in (5,):
-                tipohora = 1
-            elif weekday in (6,):
-                tipohora = 2
-            if _data in dias_1:
-                # print "%self eh dia 1" % (_data,)
-                tipohora = 1
-            if _data in dias_2:
-                tipohora = 2
-
-            ## Separa informacoes do evento
-            _turno, _htipo, _minutos = evento
-
-            ## Se TURNO=4 (21h) Regra especial.
-            # 1260 minutos = 21 horas
-            if _turno == 4 and _htipo == 3 and _minutos != 21 * 60:
-                return True
-
-            if _turno == 4 and _htipo != 3:
-                return True
-
-            ## Dias
-            if tipohora in (0,):
-
-                if _htipo == 0 and _turno == 1:
-                    # 8h
-                    if _minutos > (8 * 60):
-                        return True
-
-                if _htipo == 0 and _turno == 2:
-                    # 7h 37min
-                    if _minutos > (7 * 60 + 37):
-                        return True
-
-                if _htipo == 0 and _turno == 3:
-                    # 7h 15min
-                    if _minutos > (7 * 60 + 15):
-                        return True
-
-                if _htipo == 1 and _turno == 1:
-                    # 2 horas extras
-                    if _minutos > (2 * 60):
-                        return True
-
-                if _htipo == 1 and _turno == 2:
-                    # 2 horas extras
-                    if _minutos > (2 * 60):
-                        return True
-
-                if _htipo == 1 and _turno == 3:
-                    # 2 horas extras
-                    if _minutos > (2 * 60):
-                        return True
-
-                if _htipo == 2:
-                    return True
-
-            ## Dia de Feriado Emendado ("Feriado 50%")
-            if tipohora in (1,):
-
-                if _htipo in (0, 2):
-                    return True
-
-                # 8h
-                if _htipo == 1 and _turno == 1 and _minutos > 8 * 60:
-                    return True
-
-                # 7h37m
-                if _htipo == 1 and _turno == 2 and _minutos > (7 * 60 + 37):
-                    return True
-
-                # 7h15m
-                if _htipo == 1 and _turno == 3 and _minutos > (7 * 60 + 15):
-                    return True
-
-            ## Dia de Feriado Real ("Feriado 100%")
-            if tipohora in (2,):
+        if crimeshm is None:
+            crimeshm = self.gera_crimeshm()
 
-                if _htipo in (0, 1):
-                    return True
+        return self.escreve_criticas(f, crimeshm, limites_hm, achados=achados)
 
-                # 8h
-                if _htipo == 2 and _turno == 1 and _minutos > 8 * 60:
-                    return True
+    def exporta_achados(self, f, achados):
+        """Exporta os erros de cada tipo, {"HH": [...], "HM": [...]} (ver criticas_por_matricula)."""
+        linhas = [(nome, *achado) for nome, lista in achados.items() for achado in lista]
+        self.exporta("achados_%s-%s" % (f["#MES"], f["#ANO"]), colunas_de_valores(linhas, achados_schema))
 
-                # 7h37m
-                if _htipo == 2 and _turno == 2 and _minutos > (7 * 60 + 37):
-                    return True
-
-                # 7h15m
-                if _htipo == 2 and _turno == 3 and _minutos > (7 * 60 + 15):
-                    return True
-
-        dias_1 = [i.dia for i in f["#DIAS1"]]
-        dias_2 = [i.dia for i in f["#DIAS2"]]
-
-        # Processamento2
-        for _matr in arm.keys():
-            for _data in arm[_matr].keys():
-                # Dia da Semana
-                # dia, mes, ano = _data.strip().split(r'/')
-
-                # dateobj = datetime.strptime(_data, r"%d/%m/%Y %H:%M:%S")
-                # dateobj = datetime.date(int(ano), int(mes), int(dia))
-
-                weekday = _data.weekday()
-
-                for evento in arm[_matr][_data]:
-                    # print evento
-                    if julga(_data, evento):
-
-                        feriado = ""
-                        if _data in dias_1:
-                            feriado = "Feriado 50%"
-                        elif _data in dias_2:
-                            feriado = "Feriado 100%"
+    def tipos(self):
+        # (nome, consulta, limites, julga_dia)
+        return (
+            ("HH", self.sql_crimeshh, limites_hh, julgalinhas),
+            ("HM", self.sql_crimeshm, limites_hm, None),
+        )
 
-                        _datas = "{}/{}/{}".format(_data.day, _data.month, _data.year)
-                        o1.write(
-                            "[%s] [%s] [%s] %s\n"
-                            % (_matr, _datas, wkdays[weekday], feriado)
-                        )
-                        o1.write(
-                            "%s%s%s\n"
-                            % ("turno".ljust(7), "htipo".ljust(7), "hora".ljust(7))
-                        )
-                        entrada = evento
-                        et, eht, emin = evento
-                        ehoras = "{0:02}:{1:02}".format(emin // 60, emin % 60)
-                        o1.write(
-                            "%s%s%s (%s min)\n"
-                            % (
-                                str(et).ljust(7),
-                                str(eht).ljust(7),
-                                str(ehoras).ljust(7),
-                                emin,
-                            )
-                        )
-                        o1.write("\n")
-        return o1
+    def atualiza_tipo(self, f, nome, resumo, buscados, anterior, rejulga_todas):
+        """Junta os registros buscados agora com os da execuo anterior e julga de novo
+        s as matrculas que mudaram. Devolve (estado atual, matrculas alteradas)."""
+        # matrcula -> registros buscados agora
+        novos = {}
+        for r in buscados[1:]:
+            novos.setdefault(str(int(r[0])), []).append(list(r))
+
+        atual = {}
+        for m, r in resumo.items():
+            a = anterior.get(m)
+            if a is not None and a.get("resumo") == r:
+                atual[m] = dict(a)
+            else:
+                atual[m] = {"resumo": r, "registros": novos.get(m, []), "criticas": None}
+
+        alteradas = {m for m in atual if atual[m]["criticas"] is None} | (set(anterior) - set(atual))
+
+        # Julga s o necessrio (todas se os feriados mudaram)
+        rejulga = [m for m in atual if rejulga_todas or atual[m]["criticas"] is None]
+        registros = [r for m in rejulga for r in atual[m]["registros"]]
+        if registros:
+            _, _, limites, julga_dia = next(t for t in self.tipos() if t[0] == nome)
+            cols = colunas_de_registros(registros, crimes_schema, cabecalho=False)
+            criticas = self.criticas_por_matricula(f, cols, limites, julga_dia)
+        else:
+            criticas = {}
+
+        for m in rejulga:
+            atual[m]["criticas"] = criticas.get(int(m), [])
+            if rejulga_todas and m in anterior and atual[m]["criticas"] != anterior[m]["criticas"]:
+                alteradas.add(m)
+
+        return atual, alteradas
+
+    def process_incremental(self, f):
+        periodoid = f["#PERIODOID"]
+        anterior = carrega_estado(periodoid)
+
+        feriados = sorted([d.dia.strftime("%d/%m/%Y"), d.tipohora] for d in f["#DIAS1"] + f["#DIAS2"])
+        rejulga_todas = anterior is not None and anterior["feriados"] != feriados
+
+        tipos = self.tipos()
+
+        # Resumo por matrcula de HH e HM, sempre direto do banco (nunca do cache)
+        resumos = {}
+        with self.etapa("resumo"):
+            for (nome, _, _, _), data in zip(
+                tipos,
+                getsqldata_many([sql_resumo(t[1]()) for t in tipos], periodo=periodoid, cache=False),
+            ):
+                # matrcula -> [linhas, minutos, soma]
+                resumos[nome] = {str(int(r[0])): [c.strip() for c in r[1:]] for r in data[0][1:]}
+
+        # Busca s as matrculas cujo resumo mudou
+        consultas = []
+        for nome, sql, _, _ in tipos:
+            ant = (anterior or {}).get(nome, {})
+            mudaram = [
+                m for m, r in resumos[nome].items()
+                if m not in ant or ant[m].get("resumo") != r
+            ]
+            print(f"{nome}: {len(mudaram)} de {len(resumos[nome])} matrcula(s) com lanamentos novos ou alterados")
+            if not mudaram:
+                consultas.append(None)
+            elif anterior is None or len(mudaram) > max_filtro_matriculas:
+                consultas.append(sql())
+            else:
+                consultas.append(sql(mudaram))
+
+        with self.etapa("sql"):
+            buscados = iter(
+                getsqldata_many([c for c in consultas if c], periodo=periodoid, cache=False)
+            )
+            buscados = [next(buscados)[0] if c else [] for c in consultas]
+
+        estado = {"criado": time.time(), "feriados": feriados}
+
+        o1 = self.getoutputfile(ext="txt", append="HH_e_HM_%s-%s" % (f["#MES"], f["#ANO"]))
+        o2 = self.getoutputfile(ext="txt", append="HH_e_HM_%s-%s-delta" % (f["#MES"], f["#ANO"]))
+
+        if anterior is None:
+            o2.write("Sem execuo anterior deste perodo: todos os erros so novos.\r\n\r\n")
+        else:
+            quando = datetime.datetime.fromtimestamp(anterior["criado"]).strftime("%d/%m/%Y %H:%M")
+            o2.write(f"Comparado com a execuo de {quando}.\r\n\r\n")
+
+        for (nome, _, _, _), dados in zip(tipos, buscados):
+            ant = (anterior or {}).get(nome, {})
+            atual, alteradas = self.atualiza_tipo(
+                f, nome, resumos[nome], dados, ant, rejulga_todas
+            )
+            estado[nome] = atual
+
+            # Relatrio completo, igual ao da execuo normal
+            o1.write(f"{nome} -------------\r\n")
+            o1.write("".join(b for m in ordem_das_matriculas(atual) for b in atual[m]["criticas"]))
+            o1.write("\r\n")
+
+            # Diferena para a execuo anterior
+            corrigidos = []
+            novos = []
+            for m in sorted(alteradas, key=int):
+                antes = ant.get(m, {}).get("criticas") or []
+                depois = atual.get(m, {}).get("criticas") or []
+                corrigidos += [b for b in antes if b not in depois]
+                novos += [b for b in depois if b not in antes]
+
+            print(f"{nome}: {len(corrigidos)} erro(s) corrigido(s), {len(novos)} erro(s) novo(s)")
+
+            o2.write(f"{nome} - CORRIGIDOS ({len(corrigidos)}) -------------\r\n")
+            o2.write("".join(corrigidos))
+            o2.write("\r\n")
+            o2.write(f"{nome} - NOVOS ({len(novos)}) -------------\r\n")
+            o2.write("".join(novos))
+            o2.write("\r\n")
+
+        # A exportao tem os erros de todas as matrculas, no s das alteradas
+        if self.options.get("exporta"):
+            achados = {}
+            for nome, _, limites, julga_dia in tipos:
+                achados[nome] = []
+                registros = [r for m in ordem_das_matriculas(estado[nome]) for r in estado[nome][m]["registros"]]
+                if registros:
+                    cols = colunas_de_registros(registros, crimes_schema, cabecalho=False)
+                    self.criticas_por_matricula(f, cols, limites, julga_dia, achados[nome])
+            self.exporta_achados(f, achados)
+
+        grava_estado(periodoid, estado)
+        print("")
 
     def process(self, f):
 
+        # S o que mudou desde a ltima execuo do perodo
+        if self.options.get("incremental"):
+            return self.process_incremental(f)
+
         # Pega arquivo de saida
         o1 = self.getoutputfile(
             ext="txt", append="HH_e_HM_%s-%s" % (f["#MES"], f["#ANO"])
         )
 
+        # Busca CRIMES_HH e CRIMES_HM ao mesmo tempo
+        with self.etapa("sql"):
+            crimeshh, crimeshm = [
+                data[0]
+                for data in getsqldata_many(
+                    [self.sql_crimeshh(), self.sql_crimeshm()], periodo=f["#PERIODOID"]
+                )
+            ]
+
+        # Erros de cada tipo, para a exportao
+        achados = {"HH": [], "HM": []}
+
         # HH
-        output_hh = self.process_hh(f)
+        with self.etapa("hh"):
+            output_hh = self.process_hh(f, crimeshh, achados["HH"])
         output_hh.seek(0)
         hhtxt = output_hh.read()
 
@@ -540,7 +749,8 @@ class Criticas(BaseSISPOSSQL):
         o1.write("\r\n")
 
         # HM
-        output_hm = self.process_hm(f)
+        with self.etapa("hm"):
+            output_hm = self.process_hm(f, crimeshm, achados["HM"])
         output_hm.seek(0)
         hmtxt = output_hm.read()
 
@@ -548,6 +758,8 @@ class Criticas(BaseSISPOSSQL):
         o1.write(hmtxt)
         o1.write("\r\n")
 
+        self.exporta_achados(f, achados)
+
 
 if __name__ == "__main__":
     a = Criticas()
@@ -1,33 +1,78 @@
-from sisposbase.sispos import BaseSISPOS
+import importlib
+import importlib.util
+from collections import namedtuple
 
-# Importa todas as análises.
+# Registro de todas as análises.
+#
+# Nada é importado aqui: cada análise só é importada quando for escolhida
+# (Analise.carrega()), assim rodar uma análise não paga o custo de importar as
+# outras (e as dependências delas, como o OpenPYXL).
+#
+# Ao criar uma análise nova, registre aqui o nome da classe, a descrição (a
+# mesma docstring da classe, é o que aparece no menu) e o módulo.
+# tests/test_startup.py confere se o registro bate com as classes.
 
-# SISPRE - Lotes de Relatórios
-from .sispre import Sispre
 
-# IOMO / CAPACIDADE INSTALADA
-from .iomo_capacidadeinstalada import IomoCapac
+class Analise(namedtuple("Analise", "nome doc modulo requer")):
+    def disponivel(self) -> bool:
+        """Diz se as dependências opcionais estão instaladas (sem importá-las)."""
+        return all(importlib.util.find_spec(m) is not None for m in self.requer)
 
-# CRITICAS À APROPRIACAO
-from .Criticas_HH_e_HM import Criticas
+    def carrega(self):
+        """Importa o módulo da análise e devolve a classe."""
+        modulo = importlib.import_module(self.modulo, __name__)
+        return getattr(modulo, self.nome)
 
-# COMPARA RELAÇÃO DE PESSOAL DO I COM EMPREGADOS
-try:
-    # Esta análise utiliza OpenPYXL, se não estiver disponível, pule.
-    from .compara_rpessi_empregados import ComparaRpessiEmpregados
-except ImportError:
-    pass
 
-# ORÇADO X REAL
-# from .hhreal import HHReal
+registro = (
+    # SISPRE - Lotes de Relatórios
+    Analise(
+        "Sispre",
+        "Executa relatórios em Lotes para posterior análise",
+        ".sispre",
+        (),
+    ),
+    # IOMO / CAPACIDADE INSTALADA
+    Analise(
+        "IomoCapac",
+        "Calcula o Índice de Ocupação de Mão de Obra (IOMO) e o Capacidade Instalada",
+        ".iomo_capacidadeinstalada",
+        (),
+    ),
+    # CRITICAS À APROPRIACAO
+    Analise(
+        "Criticas",
+        "Busca por Erros na Digitação de HH e HM para correções antes do fechamento.",
+        ".Criticas_HH_e_HM",
+        (),
+    ),
+    # COMPARA RELAÇÃO DE PESSOAL DO I COM EMPREGADOS
+    # Esta análise utiliza OpenPYXL, se não estiver disponível, fica fora da lista.
+    Analise(
+        "ComparaRpessiEmpregados",
+        "Compara a planilha [Relação de Pessoal do I] com a listagem de Empregados do ControleProducao",
+        ".compara_rpessi_empregados",
+        ("openpyxl",),
+    ),
+    # ORÇADO X REAL
+    Analise(
+        "HHReal",
+        "Orçado x Real: horas-homem apropriadas por OS, separadas por categoria de trabalho",
+        ".hhreal",
+        (),
+    ),
+    # TENDÊNCIAS DE VÁRIOS PERÍODOS
+    Analise(
+        "Tendencias",
+        "Tendências de vários períodos: IOMO, Capacidade Instalada, HH por categoria e horas extras",
+        ".tendencias",
+        (),
+    ),
+)
 
 
-# Gera a lista de análises listadas aqui, para importação no módulo principal.
+# Gera a lista de análises disponíveis, para o menu do módulo principal.
 analysis_list = sorted(
-    [
-        x
-        for x in vars().values()
-        if isinstance(x, type) and issubclass(x, BaseSISPOS) and x != BaseSISPOS
-    ],
-    key=lambda x: x.__name__,
+    [x for x in registro if x.disponivel()],
+    key=lambda x: x.nome,
 )
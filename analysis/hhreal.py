@@ -1,19 +1,17 @@
-#!python2
+#!python3
 # -*- coding: cp1252 -*-
 import os
 import re
 from sisposbase.sispos import BaseSISPOS
-
-from decimal import Decimal, getcontext
-
-#getcontext().prec = |
-
-
-def d(d):
-    digits = Decimal('.01')
-    return d.quantize(digits)
+from sisposbase.agrupamento import agrupa
+from sisposbase.regras import CONTEM, IGUAL, PARTE, Regra, TabelaDeRegras
+from sisposbase.columnar import DECIMAL, STR, colunas_de_valores, le_blocos
+from sisposbase import horas
+from sisposbase.relatorio import TAMANHO_BUFFER, Modelo, Relatorio
 
 class HHReal(BaseSISPOS):
+    """Orado x Real: horas-homem apropriadas por OS, separadas por categoria de trabalho"""
+
     # ----------------------------------
     # Initalization parameters
     # ----------------------------------
@@ -21,6 +19,9 @@ class HHReal(BaseSISPOS):
     findfiles = [('#MES', "Digite o mes atual MM"),
                  ('#ANO', "Digite o ano atual AAAA")]
 
+    # Main file is read line by line from a memory map, never whole
+    inputencoding = 'windows-1252'
+
     def dynfindfiles(self):
         mainfile = (self.__class__.__name__.upper(), self.__class__.__name__.lower())
         self.findfiles.append(mainfile)
@@ -96,11 +97,12 @@ background-color: red;
     # Code
     # ----------------------------------
 
-    # Dict used to store OS judgement data - jdata #1
-    jdata = {}
+    def initstate(self):
+        # Dict used to store OS judgement data - jdata #1
+        self.jdata = {}
 
-    # Dict used to store totals for each activity type - jdata #2
-    jdata2 = {}
+        # Dict used to store totals for each activity type - jdata #2
+        self.jdata2 = {}
 
     def processjdata(self, line):
         # codped || descricao || depto || fa || atividade || tothora || <ignore>
@@ -116,35 +118,34 @@ background-color: red;
         cat, catmotiv = self.judgecat(descricao, depto)
         wts = self.judgewts(fa, atividade)
 
-        if not self.jdata.has_key(codped):
+        if codped not in self.jdata:
             self.jdata[codped] = {}
 
-        if not self.jdata[codped].has_key(cat):
+        if cat not in self.jdata[codped]:
             self.jdata[codped][cat] = {}
 
         for htype in wts:
-            if not self.jdata[codped][cat].has_key(htype):
-                self.jdata[codped][cat][htype] = Decimal('0')
+            if htype not in self.jdata[codped][cat]:
+                self.jdata[codped][cat][htype] = 0
 
-            self.jdata[codped][cat][htype] += Decimal(tothora)
+            self.jdata[codped][cat][htype] += tothora
 
         # ##############################################
         # Jdata #2 --> Generate jdata2 data, total by activity
         # ##############################################
 
-        if not self.jdata2.has_key(codped):
+        if codped not in self.jdata2:
             self.jdata2[codped] = {}
 
-        if not self.jdata2[codped].has_key(atividade):
-            self.jdata2[codped][atividade] = Decimal('0')
+        if atividade not in self.jdata2[codped]:
+            self.jdata2[codped][atividade] = 0
 
-        self.jdata2[codped][atividade] += Decimal(tothora)
+        self.jdata2[codped][atividade] += tothora
 
     def generatejdata2txt(self, f):
         if self.jdata2:
             rv = []
-            oslist = self.jdata2.keys()
-            oslist.sort()
+            oslist = sorted(self.jdata2.keys())
 
             rv.append('## Totais por atividade - %s/%s ##' % (f['#MES'], f['#ANO']))
             rv.append('')
@@ -153,16 +154,32 @@ background-color: red;
                 rv.append('Atividades para OS: "%s"' % (str(os),))
                 rv.append('')
 
-                ativlist = self.jdata2[os].keys()
-                ativlist.sort()
+                ativlist = sorted(self.jdata2[os].keys())
                 for ativ in ativlist:
-                    rv.append('Codigo "{:2}":\t{:12}\thora(s)'.format(ativ, d(self.jdata2[os][ativ])))
+                    rv.append('Codigo "{:2}":\t{:>12}\thora(s)'.format(ativ, horas.formata(self.jdata2[os][ativ])))
 
                 rv.append('')
                 rv.append('')
 
             return '\r\n'.join(rv)
 
+    def exporta_jdata(self, f):
+        # jdata (horas por OS, categoria e tipo) e jdata2 (por OS e atividade), tipados (--exporta)
+        mesano = '%s-%s' % (f['#MES'], f['#ANO'])
+
+        linhas = [(codped, cat, htype, total)
+                  for codped, cats in self.jdata.items()
+                  for cat, htypes in cats.items()
+                  for htype, total in htypes.items()]
+        self.exporta('jdata_' + mesano, colunas_de_valores(
+            linhas, (('os', STR), ('categoria', STR), ('tipo', STR), ('horas', DECIMAL))))
+
+        linhas = [(codped, ativ, total)
+                  for codped, ativs in self.jdata2.items()
+                  for ativ, total in ativs.items()]
+        self.exporta('jdata2_' + mesano, colunas_de_valores(
+            linhas, (('os', STR), ('atividade', STR), ('horas', DECIMAL))))
+
     def generate_outcome_data(self, os):
 
         def gvn(dictvar, dictkey):
@@ -185,30 +202,31 @@ background-color: red;
                 ht, h18, h80, h92 = ('', '', '', '')
                 if dados_categ:
                     ht = dados_categ.get(self.hourTOTAL, '')
-                    if isinstance(ht, Decimal):
-                        ht = '{}'.format(d(ht))
+                    if isinstance(ht, int):
+                        ht = horas.formata(ht)
 
                     h18 = dados_categ.get(self.hour18, '')
-                    if isinstance(h18, Decimal):
-                        h18 = '{}'.format(d(h18))
+                    if isinstance(h18, int):
+                        h18 = horas.formata(h18)
 
                     h80 = dados_categ.get(self.hour80, '')
-                    if isinstance(h80, Decimal):
-                        h80 = '{}'.format(d(h80))
+                    if isinstance(h80, int):
+                        h80 = horas.formata(h80)
 
                     h92 = dados_categ.get(self.hour92, '')
-                    if isinstance(h92, Decimal):
-                        h92 = '{}'.format(d(h92))
+                    if isinstance(h92, int):
+                        h92 = horas.formata(h92)
 
                 rv.append((categ, ht, h80, h18, h92))
 
         return rv
 
-    def generateoutcomecsv(self, os):
+    def generateoutcomecsv(self, os, data=None):
 
         rv = []
 
-        data = self.generate_outcome_data(os)
+        # data: generate_outcome_data(os), when already computed for the chart
+        data = list(data) if data is not None else self.generate_outcome_data(os)
 
         data.insert(1, ('---Categoria---', '||Horas totais||', '||Horas 80||', '||Horas 18||', '||Horas 92-97||'))
 
@@ -222,7 +240,7 @@ background-color: red;
 
         return '\n'.join(rv)
 
-    def generateoutcomechart(self, os):
+    def generateoutcomechart(self, os, data=None):
 
         def gvn(dictvar, dictkey):
             try:
@@ -239,11 +257,10 @@ background-color: red;
             '<tr><td>Categoria</td><td>Horas Totais:</td><td>Horas 80</td><td>Horas 18</td><td>Horas 92</td></tr>\n')
 
 
-        dados_os = self.generate_outcome_data(os)[1:]
+        dados_os = (data if data is not None else self.generate_outcome_data(os))[1:]
 
         for line in dados_os:
-            categ, ht, h80, h18, h92 = line
-            rv.append('<tr><td>%s</td><td>%s</td><td>%s</td><td>%s</td><td>%s</td></tr>\n' % (categ, ht, h80, h18, h92))
+            rv.append(self.modelo_grafico(*line))
 
         rv.append('</table>')
 
@@ -270,165 +287,176 @@ background-color: red;
 
         return list(wts)
 
+    # ----------------------------------
+    # Category rules (cargo x depto)
+    # ----------------------------------
+
+    # Evaluated in order, the first rule that matches wins.
+    # Careful: depto in ("IM") is not a tuple, it's a substring test, thus PARTE.
+    catrules = TabelaDeRegras(
+        ('cargo', 'depto'),
+        (
+            # -------------
+            # -- Ignorar --
+            # -------------
+
+            # Apontador de Produo
+            Regra('Apontador de Producao', catIGN, 'Cargo Ignorado: Tecnico de Planejamento',
+                  (('cargo', CONTEM, 'APONT. PRODUCAO'),)),
+
+            # Tcnico de Planejamento
+            Regra('Tecnico de Planejamento', catIGN, 'Cargo Ignorado: Tecnico de Planejamento',
+                  (('cargo', CONTEM, 'TEC.PLANEJAMENTO'),)),
+
+            # Auxiliar Administrativo
+            Regra('Auxiliar Administrativo', catIGN, 'Cargo Ignorado: Auxiliar Administrativo',
+                  (('cargo', CONTEM, 'AUX.ADMINISTRAT'),)),
+
+            # Arquivista Tcnico
+            Regra('Arquivista Tecnico', catIGN, 'Cargo Ignorado: Arquivista Tecnico',
+                  (('cargo', CONTEM, 'ARQUIVI. TECNICO'),)),
+
+            # Supervisores e Mestres
+            Regra('Supervisores e Mestres', catIGN, 'Cargo Ignorado: Supervisor ou Mestre',
+                  (('cargo', CONTEM, ('SUP', 'MEST')),)),
+
+            # Departamentos ignorados
+            Regra('Departamentos ignorados', catIGN, 'Setor Ignorado: {depto}',
+                  (('depto', IGUAL, ("IMP", "IC", "ICC", "ICP", "IG", "IG-1", "IG-2", "IG-3", "IG-CPR-2",
+                                     "IT", "IT-APRENDIZES",
+                                     "IG-CPR", "IPU", "IPM", "IG-AS", "IPL", "IPC/MC", "IPC", "IPS")),)),
+
+            # -------------------
+            # -- Setor + Cargo --
+            # -------------------
+
+            # IM - Considerar apenas TEC MECANICA --> ITE (Ignorar outras profissoes)
+            Regra('IM + TEC. MECANICA', catITE, '',
+                  (('depto', PARTE, 'IM'), ('cargo', PARTE, 'TEC. MECANICA'))),
+            Regra('IM', catIGN, 'IM Ignorado (Apenas TEC MEC --> ITE)',
+                  (('depto', PARTE, 'IM'),)),
+
+            # IMC - Considerar apenas TEC INDUSTRIAL --> TEC MET PROC (Ignorar outras profissoes)
+            Regra('IMC + TEC. INDUSTRIAL', catTECM, '',
+                  (('depto', PARTE, 'IMC'), ('cargo', PARTE, 'TEC. INDUSTRIAL'))),
+            Regra('IMC', catIGN, 'IMC Ignorado (Apenas TEC IND --> Tec Met Proc)',
+                  (('depto', PARTE, 'IMC'),)),
+
+            # -----------
+            # -- CARGO --
+            # -----------
+
+            # TEC. M. PRO
+            Regra('TEC.M.PRO', catTECM, '', (('cargo', PARTE, 'TEC.M.PRO'),)),
+
+            # -------------
+            # -- Setores --
+            # -------------
+
+            Regra('Tracagem', catTRAC, '', (('depto', PARTE, 'IPC/T'),)),
+            Regra('Corte', catCORT, '', (('depto', PARTE, 'IPC/C'),)),
+            Regra('Calandra', catCALA, '', (('depto', PARTE, 'IPU/C'),)),
+            Regra('Montagem', catMONT, '', (('depto', PARTE, 'IPC/M'),)),
+            Regra('Tecnico Industrial no IPC', catMONT, 'Regra especial: Tecnico Industrial no IPC',
+                  (('depto', PARTE, 'IPC'), ('cargo', CONTEM, 'IND.'))),
+            Regra('Soldagem', catSOLD, '', (('depto', PARTE, 'IPS/S'),)),
+            Regra('Tratamento Termico', catTRAT, '', (('depto', PARTE, 'IPS/TT'),)),
+            Regra('Jato/Pintura', catJATO, '', (('depto', PARTE, 'IPC/JP'),)),
+            Regra('Usinagem/Ferramentaria', catUSIF, '', (('depto', IGUAL, ("IPU/U", "IPU/F")),)),
+
+            # "ITE" (Engenharia Geral)
+            Regra('ITE', catITE, '',
+                  (('depto', IGUAL, ("IE", "IEI", "IEP", "IEE", "IES", "ID", "IDP", "IS-CPS", "IDF")),)),
+
+            # IQ
+            Regra('IQ', catICQ, '', (('depto', IGUAL, ("IQ", "IQI", "IQ-LAB")),)),
+        ),
+        # Else? DESCONHECIDO (Programmer should check it out)
+        padrao=Regra('Nenhuma regra', catUNK, 'Linha no entrou em nenhuma regra! Verificar...', ()),
+    )
+
     def judgecat(self, cargo, depto):
+        """Returns (category, motive) for this cargo/depto, see catrules."""
+        return self.catrules.classifica(cargo, depto)
+
+    def judgecat_rule(self, cargo, depto):
+        """Returns the rule of catrules that categorized this cargo/depto."""
+        return self.catrules.avalia(cargo, depto)
+
+    # Fields of the input file (the first two are ignored):
+    # periodo || ano-mes || OS || OS reduzida || descricao || depto || atividade || fa || tothora || <ignore>
+    data_schema = (
+        (None, None),
+        (None, None),
+        ('os', STR),
+        ('reduzida', STR),
+        ('descricao', STR),
+        ('depto', STR),
+        ('atividade', STR),
+        ('fa', STR),
+        ('tothora', DECIMAL),
+    )
+
+    @classmethod
+    def convert_data_fields(cls, _filedata):
+        # Accepts the whole file (bytes/str) or any iterable of lines (e.g. LinhasMapeadas);
+        # parsed column by column, one block of lines at a time.
+        # tothora is already in fixed point (see sisposbase.horas)
+
+        for cols in le_blocos(_filedata, cls.data_schema):
+            for os, reduzida, descricao, depto, atividade, fa, tothora in cols.linhas():
+                #os = '{}\n({}/{})'.format(r[2], r[1], r[3]) # Com OS gigante, benenr
+                yield ['{} ({})'.format(os, reduzida),  # OS antiga + reduz only
+                       descricao, depto, atividade, fa, int(tothora)]
 
-        categ = self.catUNK  # tracagem, corte, ....
-        motiv = 'Linha no entrou em nenhuma regra! Verificar...'  # motivo em caso de regra especial
-
-        # -------------
-        # -- Ignorar --
-        # -------------
-
-        # Apontador de Produo
-        if cargo.find("APONT. PRODUCAO") >= 0:
-            categ = self.catIGN
-            motiv = 'Cargo Ignorado: Tecnico de Planejamento'
-            return (categ, motiv)
-
-        # Tcnico de Planejamento
-        if cargo.find("TEC.PLANEJAMENTO") >= 0:
-            categ = self.catIGN
-            motiv = 'Cargo Ignorado: Tecnico de Planejamento'
-            return (categ, motiv)
-
-        # Auxiliar Administrativo
-        if cargo.find("AUX.ADMINISTRAT") >= 0:
-            categ = self.catIGN
-            motiv = 'Cargo Ignorado: Auxiliar Administrativo'
-            return (categ, motiv)
-
-        # Arquivista Tcnico
-        if cargo.find("ARQUIVI. TECNICO") >= 0:
-            categ = self.catIGN
-            motiv = 'Cargo Ignorado: Arquivista Tecnico'
-            return (categ, motiv)
-
-        # Supervisores e Mestres
-        if ((cargo.find("SUP") >= 0) or
-                (cargo.find("MEST") >= 0)):
-            categ = self.catIGN
-            motiv = 'Cargo Ignorado: Supervisor ou Mestre'
-            return (categ, motiv)
-
-        # Departamentos ignorados
-        if depto in ("IMP", "IC", "ICC", "ICP", "IG", "IG-1", "IG-2", "IG-3", "IG-CPR-2",
-                     "IT", "IT-APRENDIZES",
-                     "IG-CPR", "IPU", "IPM", "IG-AS", "IPL", "IPC/MC", "IPC", "IPS"):
-            categ = self.catIGN
-            motiv = "Setor Ignorado: %s" % (depto)
-            return (categ, motiv)
-
-        # -------------------
-        # -- Setor + Cargo --
-        # -------------------
-
-        # IM - Considerar apenas TEC MECANICA --> ITE (Ignorar outras profissoes)
-        if depto in ("IM"):
-            if cargo in ("TEC. MECANICA"):
-                categ = self.catITE
-                return (categ, '')
-            else:
-                categ = self.catIGN
-                motiv = "IM Ignorado (Apenas TEC MEC --> ITE)"
-                return (categ, motiv)
-
-        # IMC - Considerar apenas TEC INDUSTRIAL --> TEC MET PROC (Ignorar outras profissoes)
-        if depto in ("IMC"):
-            if cargo in ("TEC. INDUSTRIAL"):
-                categ = self.catTECM
-                return (categ, '')
-            else:
-                categ = self.catIGN
-                motiv = "IMC Ignorado (Apenas TEC IND --> Tec Met Proc)"
-                return (categ, motiv)
-
-        # -----------
-        # -- CARGO --
-        # -----------
-
-        # TEC. M. PRO
-        if cargo in ("TEC.M.PRO"):
-            categ = self.catTECM
-            return (categ, '')
-
-        # -------------
-        # -- Setores --
-        # -------------
-
-        # Tracagem
-        if depto in ("IPC/T"):
-            categ = self.catTRAC
-            return (categ, '')
-
-        # Corte
-        if depto in ("IPC/C"):
-            categ = self.catCORT
-            return (categ, '')
-
-        # Calandra
-        if depto in ("IPU/C"):
-            categ = self.catCALA
-            return (categ, '')
-
-        # Montagem
-        if depto in ("IPC/M"):
-            categ = self.catMONT
-            return (categ, '')
-        elif depto in ("IPC") and (cargo.find('IND.') >= 0):
-            categ = self.catMONT
-            motiv = "Regra especial: Tecnico Industrial no IPC"
-            return (categ, motiv)
-
-        # Soldagem
-        if depto in ("IPS/S"):
-            categ = self.catSOLD
-            return (categ, '')
-
-        # Tratamento Termico
-        if depto in ("IPS/TT"):
-            categ = self.catTRAT
-            return (categ, '')
-
-        # Jato/Pintura
-        if depto in ("IPC/JP"):
-            categ = self.catJATO
-            return (categ, '')
-
-        # Usinagem/Ferramentaria
-        if depto in ("IPU/U", "IPU/F"):
-            categ = self.catUSIF
-            return (categ, '')
-
-        # "ITE" (Engenharia Geral)
-        if depto in ("IE", "IEI", "IEP", "IEE", "IES", "ID", "IDP", "IS-CPS", "IDF"):
-            categ = self.catITE
-            return (categ, '')
-
-        # IQ
-        if depto in ("IQ", "IQI", "IQ-LAB"):
-            categ = self.catICQ
-            return (categ, '')
+    # ----------------------------------
+    # Report templates, compiled once (see sisposbase.relatorio)
+    # ----------------------------------
 
-        # Else? DESCONHECIDO (Programmer should check it out)
-        return (categ, motiv)
-
-    @staticmethod
-    def convert_data_fields(_filedata):
-
-        def processline(line):
-            r = line.split("|")
-            #os = '{}\n({}/{})'.format(r[2], r[1], r[3]) # Com OS gigante, benenr
-            os = '{} ({})'.format(r[2], r[3])  # OS antiga + reduz only
-            r = r[4:-1]
-            r.insert(0, os)
-            # oitavo campo  o total de horas, tem que ser decimal
-            r[5] = Decimal(r[5].replace(',', '.'))
-            return r
-
-        # Generate proper data list for processing
-        filedata = _filedata.strip().replace('\r', '').split('\n')
-        filedatas = [processline(x) for x in filedata[1:]]
-        return filedatas
+    # Header of each OS table
+    html_table_header = (
+        '<table>\n'
+        '<tr>\n'
+        """<th width="200">codped</th>\n
+                    <th width="200">cargo</th>\n
+                    <th width="80">depto</th>\n
+                    <th width="100">fa-ativ</th>\n
+                    <th width="50">horas</th>\n
+                    <th width="150">outcome</th>\n"""
+        '</tr>'
+    )
+
+    # One line of the file
+    modelo_linha = Modelo(
+        '<tr {trclass} {trtitle}>'
+        '<td>{codped}</td>'
+        '<td>{descricao}</td>'
+        '<td>{depto}</td>'
+        '<td {tdtothora} align="center">{fa} {atividade}</td>'
+        '<td align="center">{tothora}</td>'
+        '<td align="right">{cat}</td>'
+        '</tr>'
+    )
+
+    # Total hours of a profession / of an OS (totals as float, like '%.2f' always did)
+    modelo_total_grupo = Modelo(
+        '<tr class="totalcargo">'
+        '<td colspan="4" align="center">Total de HH de {grupo}</td>'
+        '<td colspan="2">{total:.2f}</td>'
+        '</tr>'
+        '<tr><td>&nbsp;</td></tr>'
+    )
+    modelo_total_os = Modelo(
+        '<tr>'
+        '<td colspan="4" align="center" class="totalos">Total de HH da OS {os}</td>'
+        '<td colspan="2" class="totalos">{total:.2f}</td>'
+        '<td>&nbsp;</td>'
+        '</tr>'
+        '<tr><td>&nbsp;</td></tr>'
+    )
+
+    # One category line of the outcome chart
+    modelo_grafico = Modelo('<tr><td>{categ}</td><td>{ht}</td><td>{h80}</td><td>{h18}</td><td>{h92}</td></tr>\n')
 
     def process(self, f):
         # ########
@@ -436,12 +464,13 @@ background-color: red;
         # ########
 
         # Get processed and treated main data
+        # (a generator: the lines go straight from the file into agrupa() below)
         fs = self.convert_data_fields(f[self.__class__.__name__.upper()])
 
         # Get output file for HTML
-        o1 = self.getoutputfile(ext='html', append='%s-%s' % (f['#MES'], f['#ANO']))
+        o1 = self.getoutputfile(ext='html', append='%s-%s' % (f['#MES'], f['#ANO']), buffering=TAMANHO_BUFFER)
         # Get output file for CSV
-        o2 = self.getoutputfile(ext='csv', append='%s-%s-excel' % (f['#MES'], f['#ANO']))
+        o2 = self.getoutputfile(ext='csv', append='%s-%s-excel' % (f['#MES'], f['#ANO']), buffering=TAMANHO_BUFFER)
 
         # Get output variable file for UNKNOWN profession x dept mappings.
         unknownhours = []
@@ -455,113 +484,99 @@ background-color: red;
         o1.write('<body>\n')
         o1.write('<h1>%s</h1>\n' % (self.__class__.__name__.upper()))
 
-        # Get OS list
-        oses = list(set([x[0] for x in fs]))
-        oses.sort()
-        for os in oses:
-            # Open HTML TABLE
-            o1.write('<table>\n')
-            o1.write('<tr>\n')
-            o1.write("""<th width="200">codped</th>\n
-                    <th width="200">cargo</th>\n
-                    <th width="80">depto</th>\n
-                    <th width="100">fa-ativ</th>\n
-                    <th width="50">horas</th>\n
-                    <th width="150">outcome</th>\n""")
-            o1.write('</tr>')
-
-            # In this OS, get distinct PROFESSIONS
-            professions = list(set([x[1] for x in fs if x[0] == os]))
-            professions.sort()
-            for profession in professions:
-                # List and process hours for this profession
-                lines = [x for x in fs if x[0] == os and x[1] == profession]
-
-                for line in lines:
-                    ## MAIN LOOP HERE!
-
-                    ## Process OS statistics
-                    self.processjdata(line)
-
-                    ## Split line
-                    codped, descricao, depto, atividade, fa, _tothora = line
-                    tothora = d(_tothora)
-
-                    ## Generate additional vars
-                    cat, catmotiv = self.judgecat(descricao, depto)
-                    wts = self.judgewts(fa, atividade)
-
-                    # Alter formatting from outcome (cat/catmotiv/wts)
-                    trclass = ''
-                    trtitle = ''
-                    tdtothora = ''
-                    if cat == self.catIGN:  # Ignored hours
-                        trclass = 'class="ignoredhour"'
-                        trtitle = 'title="%s"' % (catmotiv)
-                    elif cat == self.catUNK:  # Unknown hours (Programmer should check these so highlight!)
-                        trclass = 'class="unknownhour"'
-
-                        # Append unknown hours to list of unknown hours.
-                        unknownhours.append("DESCONHECIDO\t%s\t%s" % (depto, descricao))
-
-                    else:
-                        trclass = 'class="normalhour"'  # Normal hours
-                        if ('h18' in wts) or ('h80' in wts) or ('h92' in wts):
-                            tdtothora = 'class="hiliteativ"'
-
-                    # Write it out
-                    o1.write('<tr %s %s>' % (trclass, trtitle))
-                    o1.write('<td>%s</td>' % (codped))
-                    o1.write('<td>%s</td>' % (descricao))
-                    o1.write('<td>%s</td>' % (depto))
-                    o1.write('<td %s align="center">%s %s</td>' % (tdtothora, fa, atividade))
-                    o1.write('<td align="center">%s</td>' % (tothora))
-                    o1.write('<td align="right">%s</td>' % (cat))
-                    o1.write('</tr>')
-
-                # Total hours for this profession:
-                sumhp = sum([Decimal(x[5]) for x in fs if x[0] == os and x[1] == profession])
-                # print "\t total de HH de %s --> %.2f" % (profession, sumhp) #debug
-                o1.write('<tr class="totalcargo">')
-                o1.write('<td colspan="4" align="center">Total de HH de %s</td>' % (profession))
-                o1.write('<td colspan="2">%.2f</td>' % (sumhp))
-                o1.write('</tr>')
-                o1.write('<tr>')
-                o1.write('<td>&nbsp;</td>')
-                o1.write('</tr>')
-
-            # Total hours for this OS
-            sumhos = sum([Decimal(x[5]) for x in fs if x[0] == os])
-            # print "total de HH da OS %s --> %.2f" % (os, sumhos) #debug
-            o1.write('<tr>')
-            o1.write('<td colspan="4" align="center" class="totalos">Total de HH da OS %s</td>' % (os))
-            o1.write('<td colspan="2" class="totalos">%.2f</td>' % (sumhos))
-            o1.write('<td>&nbsp;</td>')
-            o1.write('</tr>')
-            o1.write('<tr>')
-            o1.write('<td>&nbsp;</td>')
-            o1.write('</tr>')
-
-            # Write CSV outcome for this OS
-            o2.write(self.generateoutcomecsv(os))
-
-            # Close HTML Table
-            o1.write('</table>')
-
-            # Generate outcome chart (Result)
-            o1.write(self.generateoutcomechart(os))
-
-            o1.write('<hr />')
-
-        # Close HTML document
-        o1.write('</body></html>')
+        # Group lines by OS -> profession in a single pass, summing the hours (x[5]) on each level
+        with self.etapa('leitura'):
+            arvore = agrupa(fs, chaves=(0, 1), valor=5)
+
+        # Process OS statistics and categories (jdata/jdata2) of every line
+        with self.etapa('categorias'):
+            for grupo_os in arvore:
+                for grupo_profession in grupo_os:
+                    for line in grupo_profession.linhas:
+                        self.processjdata(line)
+
+        # HTML and CSV are rendered in the same pass, one OS at a time
+        rel = Relatorio(html=o1, csv=o2)
+
+        with self.etapa('html'):
+            for grupo_os in arvore:
+                os = grupo_os.chave
+                partes = rel.grupo()
+                html = partes['html']
+
+                # Open HTML TABLE
+                html.append(self.html_table_header)
+
+                # In this OS, PROFESSIONS are already sorted
+                for grupo_profession in grupo_os:
+
+                    # Process hours for this profession, in file order
+                    for line in grupo_profession.linhas:
+                        ## MAIN LOOP HERE!
+
+                        ## Split line
+                        codped, descricao, depto, atividade, fa, _tothora = line
+                        tothora = horas.formata(_tothora)
+
+                        ## Generate additional vars
+                        cat, catmotiv = self.judgecat(descricao, depto)
+                        wts = self.judgewts(fa, atividade)
+
+                        # Alter formatting from outcome (cat/catmotiv/wts)
+                        trclass = ''
+                        trtitle = ''
+                        tdtothora = ''
+                        if cat == self.catIGN:  # Ignored hours
+                            trclass = 'class="ignoredhour"'
+                            trtitle = 'title="%s"' % (catmotiv)
+                        elif cat == self.catUNK:  # Unknown hours (Programmer should check these so highlight!)
+                            trclass = 'class="unknownhour"'
+
+                            # Append unknown hours to list of unknown hours.
+                            unknownhours.append("DESCONHECIDO\t%s\t%s" % (depto, descricao))
+
+                        else:
+                            trclass = 'class="normalhour"'  # Normal hours
+                            if ('h18' in wts) or ('h80' in wts) or ('h92' in wts):
+                                tdtothora = 'class="hiliteativ"'
+
+                        # Write it out
+                        html.append(self.modelo_linha(trclass, trtitle, codped, descricao, depto, tdtothora, fa,
+                                                      atividade, tothora, cat))
+
+                    # Total hours for this profession:
+                    html.append(self.modelo_total_grupo(grupo_profession.chave, horas.para_float(grupo_profession.total)))
+
+                # Total hours for this OS
+                html.append(self.modelo_total_os(os, horas.para_float(grupo_os.total)))
+
+                # Outcome of this OS, computed once for the CSV and the chart
+                dados = self.generate_outcome_data(os)
+
+                # CSV outcome for this OS
+                partes['csv'].append(self.generateoutcomecsv(os, dados))
+
+                # Close HTML Table
+                html.append('</table>')
+
+                # Generate outcome chart (Result)
+                chart = self.generateoutcomechart(os, dados)
+                html.append(chart)
+
+                html.append('<hr />')
+
+                rel.escreve(partes)
+
+            # Close HTML document
+            o1.write('</body></html>')
 
         # ########
         # Jdata2
         # ########
 
-        o3 = self.getoutputfile(ext='txt', append='%s-%s-totativ' % (f['#MES'], f['#ANO']))
-        o3.write(self.generatejdata2txt(f))
+        with self.etapa('totativ'):
+            o3 = self.getoutputfile(ext='txt', append='%s-%s-totativ' % (f['#MES'], f['#ANO']))
+            o3.write(self.generatejdata2txt(f))
 
         # ###############
         # Unknown Hours
@@ -579,6 +594,12 @@ background-color: red;
             o3 = self.getoutputfile(ext='txt', append='%s-%s-desconhecido' % (f['#MES'], f['#ANO']))
             o3.write("\n".join(unk_nodup))
 
+        # ###############
+        # Exportao (--exporta)
+        # ###############
+
+        self.exporta_jdata(f)
+
         return self.jdata
 
 
@@ -1,17 +1,13 @@
-#!python2
+#!python3
 # -*- coding: cp1252 -*-
 import os
 import re
+from decimal import Decimal
 from sisposbase.sispos import BaseSISPOS
-
-from decimal import Decimal, getcontext
-
-#getcontext().prec = |
-
-
-def d(d):
-    digits = Decimal('.01')
-    return d.quantize(digits)
+from sisposbase.agrupamento import agrupa
+from sisposbase.columnar import DECIMAL, STR, colunas_de_valores, le_blocos
+from sisposbase import horas
+from sisposbase.relatorio import TAMANHO_BUFFER, Modelo, Relatorio
 
 class HM_POR_OS(BaseSISPOS):
     # ----------------------------------
@@ -21,6 +17,9 @@ class HM_POR_OS(BaseSISPOS):
     findfiles = [('#MES', "Digite o mes atual MM"),
                  ('#ANO', "Digite o ano atual AAAA")]
 
+    # Main file is read line by line from a memory map, never whole
+    inputencoding = 'windows-1252'
+
     def dynfindfiles(self):
         mainfile = (self.__class__.__name__.upper(), self.__class__.__name__.lower())
         self.findfiles.append(mainfile)
@@ -82,17 +81,18 @@ background-color: red;
     # Code
     # ----------------------------------
 
-    # Dict used to store OS judgement data - jdata #1
-    jdata = {}
+    def initstate(self):
+        # Dict used to store OS judgement data - jdata #1
+        self.jdata = {}
 
-    # Dict used to store totals for each activity type - jdata #2
-    jdata2 = {}
+        # Dict used to store totals for each activity type - jdata #2
+        self.jdata2 = {}
 
     def processjdata(self, line):
-        # codped || matr_maquina || nome_maquina || fa || atividade || tothora || <ignore>
+        # codped || matr_maquina || nome_maquina || fa || atividade || tothora || tothora as text
 
         # Get main variables
-        codped, matr_maquina, nome_maquina, atividade, fa, tothora = line
+        codped, matr_maquina, nome_maquina, atividade, fa, tothora, _ = line
 
         # ##############################################
         # Jdata #1 --> Generate main report data
@@ -102,35 +102,34 @@ background-color: red;
         cat, catmotiv = self.judgecat(matr_maquina, nome_maquina)
         wts = self.judgewts(fa, atividade)
 
-        if not self.jdata.has_key(codped):
+        if codped not in self.jdata:
             self.jdata[codped] = {}
 
-        if not self.jdata[codped].has_key(cat):
+        if cat not in self.jdata[codped]:
             self.jdata[codped][cat] = {}
 
         for htype in wts:
-            if not self.jdata[codped][cat].has_key(htype):
-                self.jdata[codped][cat][htype] = Decimal('0')
+            if htype not in self.jdata[codped][cat]:
+                self.jdata[codped][cat][htype] = 0
 
-            self.jdata[codped][cat][htype] += Decimal(tothora)
+            self.jdata[codped][cat][htype] += tothora
 
         # ##############################################
         # Jdata #2 --> Generate jdata2 data, total by activity
         # ##############################################
 
-        if not self.jdata2.has_key(codped):
+        if codped not in self.jdata2:
             self.jdata2[codped] = {}
 
-        if not self.jdata2[codped].has_key(atividade):
-            self.jdata2[codped][atividade] = Decimal('0')
+        if atividade not in self.jdata2[codped]:
+            self.jdata2[codped][atividade] = 0
 
-        self.jdata2[codped][atividade] += Decimal(tothora)
+        self.jdata2[codped][atividade] += tothora
 
     def generatejdata2txt(self, f):
         if self.jdata2:
             rv = []
-            oslist = self.jdata2.keys()
-            oslist.sort()
+            oslist = sorted(self.jdata2.keys())
 
             rv.append('## Totais por atividade - %s/%s ##' % (f['#MES'], f['#ANO']))
             rv.append('')
@@ -139,16 +138,32 @@ background-color: red;
                 rv.append('Atividades para OS: "%s"' % (str(os),))
                 rv.append('')
 
-                ativlist = self.jdata2[os].keys()
-                ativlist.sort()
+                ativlist = sorted(self.jdata2[os].keys())
                 for ativ in ativlist:
-                    rv.append('Codigo "{:2}":\t{:12}\thora(s)'.format(ativ, d(self.jdata2[os][ativ])))
+                    rv.append('Codigo "{:2}":\t{:>12}\thora(s)'.format(ativ, horas.formata(self.jdata2[os][ativ])))
 
                 rv.append('')
                 rv.append('')
 
             return '\r\n'.join(rv)
 
+    def exporta_jdata(self, f):
+        # jdata (horas por OS, categoria e tipo) e jdata2 (por OS e atividade), tipados (--exporta)
+        mesano = '%s-%s' % (f['#MES'], f['#ANO'])
+
+        linhas = [(codped, cat, htype, total)
+                  for codped, cats in self.jdata.items()
+                  for cat, htypes in cats.items()
+                  for htype, total in htypes.items()]
+        self.exporta('jdata_' + mesano, colunas_de_valores(
+            linhas, (('os', STR), ('categoria', STR), ('tipo', STR), ('horas', DECIMAL))))
+
+        linhas = [(codped, ativ, total)
+                  for codped, ativs in self.jdata2.items()
+                  for ativ, total in ativs.items()]
+        self.exporta('jdata2_' + mesano, colunas_de_valores(
+            linhas, (('os', STR), ('atividade', STR), ('horas', DECIMAL))))
+
     def generate_outcome_data(self, os):
 
         def gvn(dictvar, dictkey):
@@ -171,30 +186,31 @@ background-color: red;
                 ht, h18, h80, h92 = ('', '', '', '')
                 if dados_categ:
                     ht = dados_categ.get(self.hourTOTAL, '')
-                    if isinstance(ht, Decimal):
-                        ht = '{}'.format(d(ht))
+                    if isinstance(ht, int):
+                        ht = horas.formata(ht)
 
                     h18 = dados_categ.get(self.hour18, '')
-                    if isinstance(h18, Decimal):
-                        h18 = '{}'.format(d(h18))
+                    if isinstance(h18, int):
+                        h18 = horas.formata(h18)
 
                     h80 = dados_categ.get(self.hour80, '')
-                    if isinstance(h80, Decimal):
-                        h80 = '{}'.format(d(h80))
+                    if isinstance(h80, int):
+                        h80 = horas.formata(h80)
 
                     h92 = dados_categ.get(self.hour92, '')
-                    if isinstance(h92, Decimal):
-                        h92 = '{}'.format(d(h92))
+                    if isinstance(h92, int):
+                        h92 = horas.formata(h92)
 
                 rv.append((matr_maquina, ht, h80, h18, h92))
 
         return rv
 
-    def generateoutcomecsv(self, os):
+    def generateoutcomecsv(self, os, data=None):
 
         rv = []
 
-        data = self.generate_outcome_data(os)
+        # data: generate_outcome_data(os), when already computed for the chart
+        data = list(data) if data is not None else self.generate_outcome_data(os)
 
         data.insert(1, ('---Categoria---', '||Horas totais||', '||Horas 80||', '||Horas 18||', '||Horas 92-97||'))
 
@@ -206,7 +222,7 @@ background-color: red;
 
         return '\n'.join(rv)
 
-    def generateoutcomechart(self, os):
+    def generateoutcomechart(self, os, data=None):
 
         def gvn(dictvar, dictkey):
             try:
@@ -223,11 +239,10 @@ background-color: red;
             '<tr><td>Categoria</td><td>Horas Totais:</td><td>Horas 80</td><td>Horas 18</td><td>Horas 92</td></tr>\n')
 
 
-        dados_os = self.generate_outcome_data(os)[1:]
+        dados_os = (data if data is not None else self.generate_outcome_data(os))[1:]
 
         for line in dados_os:
-            categ, ht, h80, h18, h92 = line
-            rv.append('<tr><td>%s</td><td>%s</td><td>%s</td><td>%s</td><td>%s</td></tr>\n' % (categ, ht, h80, h18, h92))
+            rv.append(self.modelo_grafico(*line))
 
         rv.append('</table>')
 
@@ -264,27 +279,40 @@ background-color: red;
 
         return (categ, motiv)
 
-    @staticmethod
-    def convert_data_fields(_filedata):
-
-        def processline(line):
-            r = line.split("|")
-            #os = '{}\n({}/{})'.format(r[2], r[1], r[3]) # Com OS gigante, benenr
-            os = '{} ({})'.format(r[2], r[3])  # OS antiga + reduz only
-            r = r[4:-1]
-            r.insert(0, os)
-            # oitavo campo  o total de horas, tem que ser decimal
-            r[5] = Decimal(r[5].replace(',', '.'))
-            return r
-
-        # Generate proper data list for processing
-        filedata = _filedata.strip().replace('\r', '').split('\n')
-        filedatas = [processline(x) for x in filedata[1:]]
-        return filedatas
+    # Fields of the input file (the first two are ignored):
+    # periodo || ano-mes || OS || OS reduzida || matr_maquina || nome_maquina || atividade || fa || tothora || <ignore>
+    data_schema = (
+        (None, None),
+        (None, None),
+        ('os', STR),
+        ('reduzida', STR),
+        ('matr_maquina', STR),
+        ('nome_maquina', STR),
+        ('atividade', STR),
+        ('fa', STR),
+        ('tothora', STR),
+    )
+
+    @classmethod
+    def convert_data_fields(cls, _filedata):
+        # Accepts the whole file (bytes/str) or any iterable of lines (e.g. LinhasMapeadas);
+        # parsed column by column, one block of lines at a time.
+        # tothora goes in fixed point, for the sums (see sisposbase.horas), and as the text
+        # shown in the line of the report ("9.0" stays "9.0"); each distinct value converted once
+        valores = {}
+
+        for cols in le_blocos(_filedata, cls.data_schema):
+            for os, reduzida, matr_maquina, nome_maquina, atividade, fa, tothora in cols.linhas():
+                if tothora not in valores:
+                    fixo = horas.de_texto(tothora)
+                    texto = str(Decimal(tothora.replace(',', '.'))) if tothora.strip() else '0'
+                    valores[tothora] = (fixo, texto)
+
+                #os = '{}\n({}/{})'.format(r[2], r[1], r[3]) # Com OS gigante, benenr
+                yield ['{} ({})'.format(os, reduzida),  # OS antiga + reduz only
+                       matr_maquina, nome_maquina, atividade, fa, *valores[tothora]]
 
     def write_output_html_header(self, o, mes, ano):
-        assert isinstance(o, file)
-
         o.write('<!DOCTYPE html>\n')
         o.write('<html>\n')
         o.write(
@@ -295,23 +323,73 @@ background-color: red;
         o.write('<body>\n')
         o.write('<h1>%s %s/%s</h1>\n' % (self.__class__.__name__.upper(), mes, ano))
 
+    # ----------------------------------
+    # Report templates, compiled once (see sisposbase.relatorio)
+    # ----------------------------------
+
+    # Header of each OS table
+    html_table_header = (
+        '<table>\n'
+        '<tr>\n'
+        """<th width="200">codped</th>\n
+                    <th width="100">Mquina</th>\n
+                    <th style="min-width:50">Nome da Mquina</th>\n
+                    <th width="100">fa-ativ</th>\n
+                    <th width="50">horas</th>\n
+                    <th width="150">outcome</th>\n"""
+        '</tr>'
+    )
+
+    # One line of the file
+    modelo_linha = Modelo(
+        '<tr {trclass} {trtitle}>'
+        '<td>{codped}</td>'
+        '<td>{matr_maquina}</td>'
+        '<td>{nome_maquina}</td>'
+        '<td {tdtothora} align="center">{fa} {atividade}</td>'
+        '<td align="center">{tothora}</td>'
+        '<td align="right">{cat}</td>'
+        '</tr>'
+    )
+
+    # Total hours of a machine / of an OS (totals as float, like '%.2f' always did)
+    modelo_total_grupo = Modelo(
+        '<tr class="totalcargo">'
+        '<td colspan="4" align="center">Total de HH de {grupo}</td>'
+        '<td colspan="2">{total:.2f}</td>'
+        '</tr>'
+        '<tr><td>&nbsp;</td></tr>'
+    )
+    modelo_total_os = Modelo(
+        '<tr>'
+        '<td colspan="4" align="center" class="totalos">Total de HH da OS {os}</td>'
+        '<td colspan="2" class="totalos">{total:.2f}</td>'
+        '<td>&nbsp;</td>'
+        '</tr>'
+        '<tr><td>&nbsp;</td></tr>'
+    )
+
+    # One category line of the outcome chart
+    modelo_grafico = Modelo('<tr><td>{categ}</td><td>{ht}</td><td>{h80}</td><td>{h18}</td><td>{h92}</td></tr>\n')
+
     def process(self, f):
         # ########
         # Jdata1
         # ########
 
         # Get processed and treated main data
-        #fs[x] = ['2400000509 (4108-4)', '5114301', 'FRESADORA VERTICAL HELLER', '18', 'FA', Decimal('4.000000')]
+        #fs[x] = ['2400000509 (4108-4)', '5114301', 'FRESADORA VERTICAL HELLER', '18', 'FA', 4000000, '4.000000']
+        # (a generator: the lines go straight from the file into agrupa() below)
         fs = self.convert_data_fields(f[self.__class__.__name__.upper()])
 
         # Get output file for HTML
-        o1 = self.getoutputfile(ext='html', append='%s-%s' % (f['#MES'], f['#ANO']))
+        o1 = self.getoutputfile(ext='html', append='%s-%s' % (f['#MES'], f['#ANO']), buffering=TAMANHO_BUFFER)
 
         # Get output file for HTML - print version
-        o1p = self.getoutputfile(ext='html', append='%s-%s-print' % (f['#MES'], f['#ANO']))
+        o1p = self.getoutputfile(ext='html', append='%s-%s-print' % (f['#MES'], f['#ANO']), buffering=TAMANHO_BUFFER)
 
         # Get output file for CSV
-        o2 = self.getoutputfile(ext='csv', append='%s-%s-excel' % (f['#MES'], f['#ANO']))
+        o2 = self.getoutputfile(ext='csv', append='%s-%s-excel' % (f['#MES'], f['#ANO']), buffering=TAMANHO_BUFFER)
 
         # Get output variable file for UNKNOWN matr_maquina x dept mappings.
         unknownhours = []
@@ -320,123 +398,108 @@ background-color: red;
         self.write_output_html_header(o1, f['#MES'], f['#ANO'])
         self.write_output_html_header(o1p, f['#MES'], f['#ANO'])
 
-        # Get OS list
-        oses = list(set([x[0] for x in fs]))
-        oses.sort()
-        for os in oses:
-            # Open HTML TABLE
-            o1.write('<table>\n')
-            o1.write('<tr>\n')
-            o1.write("""<th width="200">codped</th>\n
-                    <th width="100">Mquina</th>\n
-                    <th style="min-width:50">Nome da Mquina</th>\n
-                    <th width="100">fa-ativ</th>\n
-                    <th width="50">horas</th>\n
-                    <th width="150">outcome</th>\n""")
-            o1.write('</tr>')
-
-            # In this OS, get distinct PROFESSIONS
-            matr_maquinas = list(set([x[1] for x in fs if x[0] == os]))
-            matr_maquinas.sort()
-            for matr_maquina in matr_maquinas:
-                # List and process hours for this matr_maquina
-                lines = [x for x in fs if x[0] == os and x[1] == matr_maquina]
-
-                for line in lines:
-                    ## MAIN LOOP HERE!
-
-                    ## Process OS statistics
-                    self.processjdata(line)
-
-                    ## Split line
-                    codped, matr_maquina, nome_maquina, atividade, fa, tothora = line
-
-
-                    ## Generate additional vars
-                    cat, catmotiv = self.judgecat(matr_maquina, nome_maquina)
-                    wts = self.judgewts(fa, atividade)
-
-                    # Alter formatting from outcome (cat/catmotiv/wts)
-                    trclass = ''
-                    trtitle = ''
-                    tdtothora = ''
-                    if cat == self.catIGN:  # Ignored hours
-                        trclass = 'class="ignoredhour"'
-                        trtitle = 'title="%s"' % (catmotiv)
-                    elif cat == self.catUNK:  # Unknown hours (Programmer should check these so highlight!)
-                        trclass = 'class="unknownhour"'
-
-                        # Append unknown hours to list of unknown hours.
-                        unknownhours.append("DESCONHECIDO\t%s\t%s" % (nome_maquina, matr_maquina))
-
-                    else:
-                        trclass = 'class="normalhour"'  # Normal hours
-                        if ('h18' in wts) or ('h80' in wts) or ('h92' in wts):
-                            tdtothora = 'class="hiliteativ"'
-
-                    # Write it out
-                    o1.write('<tr %s %s>' % (trclass, trtitle))
-                    o1.write('<td>%s</td>' % (codped))
-                    o1.write('<td>%s</td>' % (matr_maquina))
-                    o1.write('<td>%s</td>' % (nome_maquina))
-                    o1.write('<td %s align="center">%s %s</td>' % (tdtothora, fa, atividade))
-                    o1.write('<td align="center">%s</td>' % (tothora))
-                    o1.write('<td align="right">%s</td>' % (cat))
-                    o1.write('</tr>')
-
-                # Total hours for this matr_maquina:
-                sumhp = sum([Decimal(x[5]) for x in fs if x[0] == os and x[1] == matr_maquina])
-                # print "\t total de HH de %s --> %.2f" % (matr_maquina, sumhp) #debug
-                o1.write('<tr class="totalcargo">')
-                o1.write('<td colspan="4" align="center">Total de HH de %s</td>' % (matr_maquina))
-                o1.write('<td colspan="2">%.2f</td>' % (sumhp))
-                o1.write('</tr>')
-                o1.write('<tr>')
-                o1.write('<td>&nbsp;</td>')
-                o1.write('</tr>')
-
-            # Total hours for this OS
-            sumhos = sum([Decimal(x[5]) for x in fs if x[0] == os])
-            # print "total de HH da OS %s --> %.2f" % (os, sumhos) #debug
-            o1.write('<tr>')
-            o1.write('<td colspan="4" align="center" class="totalos">Total de HH da OS %s</td>' % (os))
-            o1.write('<td colspan="2" class="totalos">%.2f</td>' % (sumhos))
-            o1.write('<td>&nbsp;</td>')
-            o1.write('</tr>')
-            o1.write('<tr>')
-            o1.write('<td>&nbsp;</td>')
-            o1.write('</tr>')
-
-            # Write CSV outcome for this OS
-            o2.write(self.generateoutcomecsv(os))
-
-            # Close HTML Table
-            o1.write('</table>')
-
-            # Generate outcome chart (Result)
-            o1.write(self.generateoutcomechart(os))
-            o1p.write(self.generateoutcomechart(os))
-
-            o1.write('<hr />')
-            o1p.write('<br /><br />')
-
-        # Close HTML document
-        o1.write('</body></html>')
-        o1p.write('</body></html>')
+        # Group lines by OS -> machine in a single pass, summing the hours (x[5]) on each level
+        with self.etapa('leitura'):
+            arvore = agrupa(fs, chaves=(0, 1), valor=5)
+
+        # Process OS statistics and categories (jdata/jdata2) of every line
+        with self.etapa('categorias'):
+            for grupo_os in arvore:
+                for grupo_maquina in grupo_os:
+                    for line in grupo_maquina.linhas:
+                        self.processjdata(line)
+
+        # HTML, print HTML and CSV are rendered in the same pass, one OS at a time
+        rel = Relatorio(html=o1, impressao=o1p, csv=o2)
+
+        with self.etapa('html'):
+            for grupo_os in arvore:
+                os = grupo_os.chave
+                partes = rel.grupo()
+                html = partes['html']
+
+                # Open HTML TABLE
+                html.append(self.html_table_header)
+
+                # In this OS, machines are already sorted
+                for grupo_maquina in grupo_os:
+
+                    # Process hours for this matr_maquina, in file order
+                    for line in grupo_maquina.linhas:
+                        ## MAIN LOOP HERE!
+
+                        ## Split line
+                        codped, matr_maquina, nome_maquina, atividade, fa, _, tothora = line
+
+                        ## Generate additional vars
+                        cat, catmotiv = self.judgecat(matr_maquina, nome_maquina)
+                        wts = self.judgewts(fa, atividade)
+
+                        # Alter formatting from outcome (cat/catmotiv/wts)
+                        trclass = ''
+                        trtitle = ''
+                        tdtothora = ''
+                        if cat == self.catIGN:  # Ignored hours
+                            trclass = 'class="ignoredhour"'
+                            trtitle = 'title="%s"' % (catmotiv)
+                        elif cat == self.catUNK:  # Unknown hours (Programmer should check these so highlight!)
+                            trclass = 'class="unknownhour"'
+
+                            # Append unknown hours to list of unknown hours.
+                            unknownhours.append("DESCONHECIDO\t%s\t%s" % (nome_maquina, matr_maquina))
+
+                        else:
+                            trclass = 'class="normalhour"'  # Normal hours
+                            if ('h18' in wts) or ('h80' in wts) or ('h92' in wts):
+                                tdtothora = 'class="hiliteativ"'
+
+                        # Write it out
+                        html.append(self.modelo_linha(trclass, trtitle, codped, matr_maquina, nome_maquina, tdtothora, fa,
+                                                      atividade, tothora, cat))
+
+                    # Total hours for this matr_maquina:
+                    html.append(self.modelo_total_grupo(grupo_maquina.chave, horas.para_float(grupo_maquina.total)))
+
+                # Total hours for this OS
+                html.append(self.modelo_total_os(os, horas.para_float(grupo_os.total)))
+
+                # Outcome of this OS, computed once for the CSV and the chart
+                dados = self.generate_outcome_data(os)
+
+                # CSV outcome for this OS
+                partes['csv'].append(self.generateoutcomecsv(os, dados))
+
+                # Close HTML Table
+                html.append('</table>')
+
+                # Generate outcome chart (Result)
+                chart = self.generateoutcomechart(os, dados)
+                html.append(chart)
+                partes['impressao'].append(chart)
+
+                html.append('<hr />')
+                partes['impressao'].append('<br /><br />')
+
+                rel.escreve(partes)
+
+            # Close HTML document
+            o1.write('</body></html>')
+            o1p.write('</body></html>')
 
         # ########
         # Jdata2
         # ########
 
-        o3 = self.getoutputfile(ext='txt', append='%s-%s-totativ' % (f['#MES'], f['#ANO']))
-        o3.write(self.generatejdata2txt(f))
+        with self.etapa('totativ'):
+            o3 = self.getoutputfile(ext='txt', append='%s-%s-totativ' % (f['#MES'], f['#ANO']))
+            o3.write(self.generatejdata2txt(f))
 
         # ###############
         # Unknown Hours
         # ###############
 
         if unknownhours:
-            print "\n****\nAviso: Horas DESCONHECIDAS encontradas, Verificar!\n****"
+            print("\n****\nAviso: Horas DESCONHECIDAS encontradas, Verificar!\n****")
 
             unk_nodup = list(set(unknownhours))
 
@@ -447,6 +510,12 @@ background-color: red;
             o3 = self.getoutputfile(ext='txt', append='%s-%s-desconhecido' % (f['#MES'], f['#ANO']))
             o3.write("\n".join(unk_nodup))
 
+        # ###############
+        # Exportao (--exporta)
+        # ###############
+
+        self.exporta_jdata(f)
+
         return self.jdata
 
 
@@ -2,6 +2,7 @@
 import os
 import re
 from sisposbase.sispos import BaseSISPOS
+from sisposbase.columnar import FLOAT, STR, colunas_de_valores, le_blocos
 
 class HTipo0GXX(BaseSISPOS):
     # ----------------------------------
@@ -11,6 +12,9 @@ class HTipo0GXX(BaseSISPOS):
     findfiles = [ ('#MES', "Digite o mes atual MM"),
                   ('#ANO', "Digite o ano atual AAAA") ]
 
+    # Main file is read line by line from a memory map, never whole
+    inputencoding = 'windows-1252'
+
     def dynfindfiles(self):
         mainfile = ( self.__class__.__name__.upper(), self.__class__.__name__.lower() )
         self.findfiles.append(mainfile)
@@ -202,12 +206,34 @@ color: blue;
         
         }
 
+    # --------------------------------------------------------------
+    # Flat indexes, built once at class load
+    # --------------------------------------------------------------
+
+    # cargo string -> category (the first key tuple that has the cargo wins)
+    cargocatmap = {}
+    for _key, _cat in strcargomap.items():
+        for _kvalue in _key:
+            cargocatmap.setdefault(_kvalue, _cat)
+
+    # (cliente, codped) -> new client name (the first entry of renclientdata wins)
+    renclientmap = {}
+    # new client name -> text listing its OS's
+    renclientoslist = {}
+    for _newname, _cliente, _codpeds in renclientdata:
+        for _codped in _codpeds:
+            renclientmap.setdefault((_cliente, _codped), _newname)
+        renclientoslist.setdefault(_newname, ' '.join(_codpeds))
+
+    del _key, _cat, _kvalue, _newname, _cliente, _codpeds, _codped
+
     # ----------------------------------
     # Code
     # ----------------------------------
 
-    # Dict used to store OS judgement data
-    jdata = {}
+    def initstate(self):
+        # Dict used to store OS judgement data
+        self.jdata = {}
 
     
     def judgecliente(self, line):
@@ -215,13 +241,8 @@ color: blue;
         # Get main variables
         codped, cliente, cargo, htipo, tothora, ign = line
         
-        # Try to fetch a line from self.renclientdata
-        newnamecand = [x[0] for x in self.renclientdata if x[1] == cliente and codped in x[2]]
-        
-        if newnamecand:
-            return newnamecand[0]
-        else:
-            return cliente
+        # Try to fetch a new name from renclientdata
+        return self.renclientmap.get((cliente, codped), cliente)
             
     def judgecargo(self, line):
         ## fields: codped || cliente || cargo || htipo || tothora || <ignored>
@@ -230,15 +251,9 @@ color: blue;
         codped, cliente, cargo, htipo, tothora, ign = line
         
         
-        # Return a 'cargo' category if found
-        for key in self.strcargomap.keys():
-            for kvalue in key:
-                if cargo == kvalue: # must be identical, cannot use 'cargo in key'
-                    return self.strcargomap[key]
-
-
+        # Return a 'cargo' category if found, must be identical, cannot use 'cargo in key'
         # Return catUNK if not found, signalling that rules should be revised.
-        return self.catUNK
+        return self.cargocatmap.get(cargo, self.catUNK)
         
 
     def processjdata(self, line):
@@ -249,10 +264,10 @@ color: blue;
         aliasedcliente = self.judgecliente(line)
         cargocat = self.judgecargo(line)
         
-        if not self.jdata.has_key(aliasedcliente):
+        if aliasedcliente not in self.jdata:
             self.jdata[aliasedcliente] = {}
             
-        if not self.jdata[aliasedcliente].has_key(cargocat):
+        if cargocat not in self.jdata[aliasedcliente]:
             self.jdata[aliasedcliente][cargocat] = 0
             
         #sum tothora to the appropriate category inside its client    
@@ -260,15 +275,24 @@ color: blue;
         
         # Round to 2 decimal places
         self.jdata[aliasedcliente][cargocat] = round(self.jdata[aliasedcliente][cargocat], 2)
+
+        return aliasedcliente, cargocat
         
-    def process (self, f):
-        # strip carriage returns
-        f[self.__class__.__name__.upper()] = f[self.__class__.__name__.upper()].strip()
-        f[self.__class__.__name__.upper()] = f[self.__class__.__name__.upper()].replace('\r','')
+    # fields: codped || cliente || cargo || htipo || tothora || <ignored>
+    # (the file has no header line)
+    data_schema = (
+        ('codped', STR),
+        ('cliente', STR),
+        ('cargo', STR),
+        ('htipo', STR),
+        ('tothora', FLOAT),
+    )
 
-        # split lines and split each line to a tuple
+    def process (self, f):
+        # parse the file column by column, one block of lines at a time; each line becomes a tuple
         # fields: codped || cliente || cargo || htipo || tothora || <ignored>
-        fs = [x.split('|') for x in f[self.__class__.__name__.upper()].split('\n')]
+        blocos = le_blocos(f[self.__class__.__name__.upper()], self.data_schema, cabecalho=False)
+        fs = (l + ('',) for cols in blocos for l in cols.linhas())
 
         
         # Get output file for HTML
@@ -296,99 +320,105 @@ color: blue;
                 <th width="250">Cliente considerado:</th>""")
         o1.write('</tr>')
         
-        for l in fs:
-            # split values       
-            codped, cliente, cargo, htipo, tothora, ign = l
+        # category -> category without XXX_
+        catstrip = {}
+
+        # lines are read, judged and written in the same pass
+        with self.etapa('linhas'):
+            for l in fs:
+                # split values       
+                codped, cliente, cargo, htipo, tothora, ign = l
         
-            # Process line and build statistics.
-            self.processjdata(l)
-            
-            # HTML
-            jcl = self.judgecliente(l)
-            jca = self.judgecargo(l)
-            # Strip XXX_ from cargo
-            jca_strip = re.sub(r'^.*?_','',jca)
+                # Process line and build statistics, reuse its client/cargo judgement for the HTML
+                jcl, jca = self.processjdata(l)
+
+                # Strip XXX_ from cargo
+                if jca not in catstrip:
+                    catstrip[jca] = re.sub(r'^.*?_','',jca)
+                jca_strip = catstrip[jca]
             
             
-            # Alter formatting from outcome (cat/catmotiv/wts)
-            if jca == self.catUNK:
-                trclass = 'unknownhour'
-                trtitle = "verificar se faltam regras ou se regras com erro!"
-            else:
-                # If 'judgeclient' is different from cliente, then it's a grouping and should be highlighted
-                if jcl != cliente:
-                    trclass = "groupedhour"
+                # Alter formatting from outcome (cat/catmotiv/wts)
+                if jca == self.catUNK:
+                    trclass = 'unknownhour'
+                    trtitle = "verificar se faltam regras ou se regras com erro!"
                 else:
-                    trclass = "normalhour"
-                trtitle = ""
+                    # If 'judgeclient' is different from cliente, then it's a grouping and should be highlighted
+                    if jcl != cliente:
+                        trclass = "groupedhour"
+                    else:
+                        trclass = "normalhour"
+                    trtitle = ""
                 
-                # if the client is modified by renclientdata, explain and show what OS's are inside this group
-                renclientoslist = [x[2] for x in self.renclientdata if x[0] == jcl]
-                if renclientoslist:
-                    oslisttxt = ' '.join(renclientoslist[0])
-                    trtitle = "(Grupo %s) --> OS %s" % (jcl, oslisttxt)
-
-            # Write it out
-            o1.write('<tr class="%s" title="%s">' % (trclass, trtitle))
-            o1.write('<td>%s</td>' % (codped))
-            o1.write('<td>%s</td>' % (cliente))
-            o1.write('<td>%s</td>' % (cargo))
-            o1.write('<td align="center">%s</td>' % (htipo))
-            o1.write('<td align="left">%s</td>' % (tothora))
-            o1.write('<td align="left">%s</td>' % (jca_strip,))
-            o1.write('<td align="left">%s</td>' % (jcl,))
-            o1.write('</tr>')
-            
+                    # if the client is modified by renclientdata, explain and show what OS's are inside this group
+                    if jcl in self.renclientoslist:
+                        oslisttxt = self.renclientoslist[jcl]
+                        trtitle = "(Grupo %s) --> OS %s" % (jcl, oslisttxt)
+
+                # Write it out
+                o1.write('<tr class="%s" title="%s">' % (trclass, trtitle))
+                o1.write('<td>%s</td>' % (codped))
+                o1.write('<td>%s</td>' % (cliente))
+                o1.write('<td>%s</td>' % (cargo))
+                o1.write('<td align="center">%s</td>' % (htipo))
+                o1.write('<td align="left">%s</td>' % (tothora))
+                o1.write('<td align="left">%s</td>' % (jca_strip,))
+                o1.write('<td align="left">%s</td>' % (jcl,))
+                o1.write('</tr>')
+
         # Close HTML Table
         o1.write('</table>')
         
         o1.write('<hr />')
         
         # Print outcome tables in HTML and CSV
-        totclientes = self.jdata.keys()
-        totclientes.sort()
-        for clnome in totclientes:
-            clespecs = self.jdata[clnome].keys()
-            clespecs.sort()
-            totclhora = 0
+        with self.etapa('totais'):
+            totclientes = sorted(self.jdata.keys())
+            for clnome in totclientes:
+                clespecs = sorted(self.jdata[clnome].keys())
+                totclhora = 0
         
-            gclientoslist = ""
-            # if the client is modified by renclientdata, explain and show what OS's are inside this group
-            renclientoslist = [x[2] for x in self.renclientdata if x[0] == clnome]
-            if renclientoslist:
-                oslisttxt = ' '.join(renclientoslist[0])
-                gclientoslist = "[ %s ]" % (oslisttxt)
-
-            #CSV
-            o2.write('%s\t\t%s\r\n' % (clnome, gclientoslist))
+                gclientoslist = ""
+                # if the client is modified by renclientdata, explain and show what OS's are inside this group
+                if clnome in self.renclientoslist:
+                    oslisttxt = self.renclientoslist[clnome]
+                    gclientoslist = "[ %s ]" % (oslisttxt)
+
+                #CSV
+                o2.write('%s\t\t%s\r\n' % (clnome, gclientoslist))
             
-            #HTML        
-            o1.write('<table border="1">')
-            o1.write('<tr><td colspan="2"><b>%s</b> <i>%s</i></td></tr>' % (clnome,gclientoslist))
-            o1.write('<tr><td>Especialidade: </td><td>Total de Horas: </td></tr>')
-            for espec in clespecs:
+                #HTML        
+                o1.write('<table border="1">')
+                o1.write('<tr><td colspan="2"><b>%s</b> <i>%s</i></td></tr>' % (clnome,gclientoslist))
+                o1.write('<tr><td>Especialidade: </td><td>Total de Horas: </td></tr>')
+                for espec in clespecs:
                 
-                # remove XXX_ in cargonames
-                espec_strip = re.sub(r'^.*?_','',espec)
+                    # remove XXX_ in cargonames
+                    espec_strip = re.sub(r'^.*?_','',espec)
                 
-                o1.write('<tr><td>%s</td><td>%s</td></tr>' % (espec_strip, self.jdata[clnome][espec]))
-                totclhora += self.jdata[clnome][espec]
+                    o1.write('<tr><td>%s</td><td>%s</td></tr>' % (espec_strip, self.jdata[clnome][espec]))
+                    totclhora += self.jdata[clnome][espec]
                 
-                #CSV
-                o2.write('%s\t%s\r\n' % (espec_strip, str(self.jdata[clnome][espec]).replace('.',',')))
+                    #CSV
+                    o2.write('%s\t%s\r\n' % (espec_strip, str(self.jdata[clnome][espec]).replace('.',',')))
                 
                 
-            #CSV
-            o2.write('\r\n-\r\n-\r\n')
+                #CSV
+                o2.write('\r\n-\r\n-\r\n')
                 
-            #HTML    
-            o1.write('<tr><td colspan="2" align="center">TOTAL: %.2f</td></tr>' % (totclhora))
-            o1.write('</table>')
-            o1.write('<br />')
-        
+                #HTML    
+                o1.write('<tr><td colspan="2" align="center">TOTAL: %.2f</td></tr>' % (totclhora))
+                o1.write('</table>')
+                o1.write('<br />')
+
         # Close HTML document
         o1.write('</body></html>')
 
+        # Totals by client and specialty, typed (--exporta)
+        linhas = [(clnome, espec, self.jdata[clnome][espec]) for clnome in self.jdata for espec in self.jdata[clnome]]
+        self.exporta('%s-%s' % (f['#MES'], f['#ANO']), colunas_de_valores(
+            linhas, (('cliente', STR), ('especialidade', STR), ('horas', FLOAT))))
+
         return self.jdata
 
 if __name__ == "__main__":
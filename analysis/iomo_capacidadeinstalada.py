@@ -6,16 +6,35 @@ from io import TextIOWrapper
 import re
 from sisposbase.sispos import BaseSISPOSSQL
 
-from sisposbase.get_sql_data import getsqldata, sql_substitute_variables
-
-from decimal import Decimal
-
-D = Decimal
+from sisposbase.get_sql_data import getsqldata_many, sql_substitute_variables
+from sisposbase.perfil import etapa
+from sisposbase import horas
+from sisposbase.columnar import DECIMAL, STR, colunas_de_valores
+from sisposbase.historico import historico_padrao
+
+# Lista de Setores que Compem os Totais
+SETORES = {
+    "IPU": ("IPU", "IPU/C", "IPU/F", "IPU/U"),
+    "IPS + IPC": (
+        "IPS",
+        "IPS/S",
+        "IPS/TT",
+        "IPC",
+        "IPC/M",
+        "IPC/T",
+        "IPC/C",
+        "IPC/MC",
+        "IPC/JP",
+        "IPC-IF",
+    ),
+    "IQ": ("IQ", "IQI", "IQ-LAB"),
+}
 
 
 class IomoCapac(BaseSISPOSSQL):
     """Calcula o ndice de Ocupao de Mo de Obra (IOMO) e o Capacidade Instalada"""
 
+    @etapa("sql")
     def get_data(self, f):
 
         variables = {
@@ -24,50 +43,34 @@ class IomoCapac(BaseSISPOSSQL):
             "ANONUM": f["#ANO"],
         }
 
-        hdisp_sql = getsqldata(
-            sql_substitute_variables(
-                self.getdatafile("iomo_horasdisponiveis.sql"), variables
-            )
-        )
-        hefet_sql = getsqldata(
-            sql_substitute_variables(
-                self.getdatafile("iomo_horasefetivas.sql"), variables
-            )
-        )
-        htot_sql = getsqldata(
-            sql_substitute_variables(
-                self.getdatafile("iomo_horastotais.sql"), variables
-            )
+        # As trs consultas so independentes, rode em paralelo.
+        hdisp_sql, hefet_sql, htot_sql = getsqldata_many(
+            [
+                sql_substitute_variables(self.getdatafile(sqlfile), variables)
+                for sqlfile in (
+                    "iomo_horasdisponiveis.sql",
+                    "iomo_horasefetivas.sql",
+                    "iomo_horastotais.sql",
+                )
+            ],
+            periodo=f["#PERIODOID"],
         )
 
+        # Perodo fechado: guarda no histrico, para as tendncias (ver sisposbase.historico)
+        historico = historico_padrao()
+        for serie, resultado in zip(("iomo_hdisp", "iomo_hefet", "iomo_htot"), (hdisp_sql, hefet_sql, htot_sql)):
+            historico.grava_registros(f["#PERIODOID"], serie, resultado[0])
+
+        # Horas em ponto fixo (ver sisposbase.horas)
         def fixdata(table):
-            return [table[0]] + [
-                (i[0], i[1], D(i[2].replace(",", "."))) for i in table[1:]
-            ]
+            return [table[0]] + [(i[0], i[1], horas.de_texto(i[2])) for i in table[1:]]
 
         return fixdata(hdisp_sql[0]), fixdata(hefet_sql[0]), fixdata(htot_sql[0])
 
     def process(self, f):
 
         hdisp, hefet, htot = self.get_data(f)
-
-        # Lista de Setores que Compem os Totais
-        setores = {
-            "IPU": ("IPU", "IPU/C", "IPU/F", "IPU/U"),
-            "IPS + IPC": (
-                "IPS",
-                "IPS/S",
-                "IPS/TT",
-                "IPC",
-                "IPC/M",
-                "IPC/T",
-                "IPC/C",
-                "IPC/MC",
-                "IPC/JP",
-                "IPC-IF",
-            ),
-            "IQ": ("IQ", "IQI", "IQ-LAB"),
-        }
+        setores = SETORES
 
         def depto_index(table, value: str):
             deptotable = [i[1] for i in table]
@@ -82,21 +85,22 @@ class IomoCapac(BaseSISPOSSQL):
                 for setor in setores[grupo]:
                     i = depto_index(table, setor)
                     if i:
-                        _, _, horas = table.pop(i)
+                        _, _, hora = table.pop(i)
                         if grupo not in soma:
                             soma[grupo] = {}
 
                         if setor not in soma[grupo]:
-                            soma[grupo][setor] = D("0")
+                            soma[grupo][setor] = 0
 
-                        soma[grupo][setor] += horas
+                        soma[grupo][setor] += hora
 
             return soma
 
         # Totais Calculados
-        hdisp_totais = gera_totais_por_setor(hdisp)
-        hefet_totais = gera_totais_por_setor(hefet)
-        htot_totais = gera_totais_por_setor(htot)
+        with self.etapa("totais"):
+            hdisp_totais = gera_totais_por_setor(hdisp)
+            hefet_totais = gera_totais_por_setor(hefet)
+            htot_totais = gera_totais_por_setor(htot)
 
         #########################
         # Comea a escrita dos arquivos.
@@ -119,20 +123,20 @@ class IomoCapac(BaseSISPOSSQL):
             o.write(f"{title}:\n")
             o.write(f"-------------------------------------\n")
 
-            total_geral = D("0")
+            total_geral = 0
 
             for grupo in d:
-                total_grupo = D("0")
+                total_grupo = 0
                 o.write(f"[{grupo}]\n")
 
                 for setor in d[grupo]:
                     total_grupo += d[grupo][setor]
-                    o.write(f"  {setor:21}{d[grupo][setor]:10.2f}\n")
+                    o.write(f"  {setor:21}{horas.formata(d[grupo][setor]):>10}\n")
 
                 total_geral += total_grupo
 
                 o.write("\n")
-            o.write(f"  {'total:':>21}{total_geral:10.2f}\n\n")
+            o.write(f"  {'total:':>21}{horas.formata(total_geral):>10}\n\n")
 
             return total_geral
 
@@ -146,8 +150,8 @@ class IomoCapac(BaseSISPOSSQL):
         soma_htot = print_table_totais("Horas Totais", htot_totais, o1)
 
         # ndices calculados
-        indice_iomo = round((soma_hefet / soma_hdisp) * D("100"), 0)
-        indice_capac = round((soma_hefet / soma_htot) * D("100"), 0)
+        indice_iomo = horas.percentual(soma_hefet, soma_hdisp)
+        indice_capac = horas.percentual(soma_hefet, soma_htot)
 
         o1.write(f"-------------------------------------\n\n")
 
@@ -155,12 +159,12 @@ class IomoCapac(BaseSISPOSSQL):
 
         o1.write(f"IOMO {f['#MES']}/{f['#ANO']}\n\n")
         o1.write(f"   IOMO = {'HORAS EFETIVAS':14} / {'HORAS DISPONIVEIS':17}\n")
-        o1.write(f"   IOMO = {soma_hefet:^14.2f} / {soma_hdisp:^17.2f}\n")
+        o1.write(f"   IOMO = {horas.formata(soma_hefet):^14} / {horas.formata(soma_hdisp):^17}\n")
         o1.write(f"   IOMO = {indice_iomo}%\n\n")
 
         o1.write(f"CAPACIDADE INSTALADA {f['#MES']}/{f['#ANO']}\n\n")
         o1.write(f"   CAPAC = {'HORAS EFETIVAS':14} / {'HORAS TOTAIS':12}\n")
-        o1.write(f"   CAPAC = {soma_hefet:^14.2f} / {soma_htot:^12.2f}\n")
+        o1.write(f"   CAPAC = {horas.formata(soma_hefet):^14} / {horas.formata(soma_htot):^12}\n")
         o1.write(f"   CAPAC = {indice_capac}%\n\n")
 
         o1.write(f"\nEmitido em: {datetime.now().strftime('%d/%m/%Y %H:%M')}\n\n")
@@ -184,7 +188,7 @@ class IomoCapac(BaseSISPOSSQL):
             for item in table[1:]:
                 _, depto, hora = item
 
-                o.write(f"{depto:8} - {hora:9.2f}\n")
+                o.write(f"{depto:8} - {horas.formata(hora):>9}\n")
             o.write("\n\n")
 
         # Horas Efetivas:
@@ -199,4 +203,17 @@ class IomoCapac(BaseSISPOSSQL):
         print_table_totais("Horas Totais", htot_totais, o2)
         print_sobra(htot, o2)
 
+        #####################################
+        # Exporta os totais por setor (--exporta)
+        #####################################
+
+        totais = (("efetivas", hefet_totais), ("disponiveis", hdisp_totais), ("totais", htot_totais))
+        linhas = [(nome, grupo, setor, d[grupo][setor]) for nome, d in totais for grupo in d for setor in d[grupo]]
+        self.exporta(
+            f"setores_{f['#MES']}-{f['#ANO']}",
+            colunas_de_valores(linhas, (("tabela", STR), ("grupo", STR), ("setor", STR), ("horas", DECIMAL))),
+            iomo=indice_iomo,
+            capac=indice_capac,
+        )
+
 
@@ -4,7 +4,12 @@ import os
 import re
 import datetime
 import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
+from sisposbase import sqlcache
+from sisposbase.get_sql_data import grava_sqldata, levanta_erros_sql
+from sisposbase.historico import historico_padrao, serie_do_sql
 from sisposbase.sispos import BaseSISPOSSQL, DATAFILEPATH, TOOLFOLDER
 
 SISPRE_SCRIPTPATH = os.path.join(DATAFILEPATH, "sispre_scripts")
@@ -42,7 +47,7 @@ class Sispre(BaseSISPOSSQL):
         print("")
 
         scriptfolder = SISPRE_SCRIPTPATH
-        chosenscriptname = input("DIGITE O NOME DO LOTE A SER EXECUTADO --> ")
+        chosenscriptname = self.ask("#SCRIPTNAME", "DIGITE O NOME DO LOTE A SER EXECUTADO", " --> ")
         scriptfilename = chosenscriptname + ".json"
         scriptfilename = os.path.join(scriptfolder, scriptfilename)
 
@@ -52,10 +57,10 @@ class Sispre(BaseSISPOSSQL):
                 scriptdata = fh.read()
         else:
             print("Erro: Script nao existe. Saindo...")
-            exit(0)
+            exit(1 if self.batch else 0)
 
         # Convert script data to from json->DICT
-        self.inputfiles["#SCRIPTDATA"] = json.loads(scriptdata, encoding="windows-1252")
+        self.inputfiles["#SCRIPTDATA"] = json.loads(scriptdata)
 
         return chosenscriptname
 
@@ -101,23 +106,29 @@ class Sispre(BaseSISPOSSQL):
         script = f["#SCRIPTDATA"]
         scriptname = f["#SCRIPTNAME"]
 
-        # Get Output Folder.
-        outputfolder = self.getoutputfolder(append=f"{scriptname}_{f['#MES']}-{f['#ANO']}")
+        # --run: executa o lote aqui mesmo, sem gerar o _executa.bat
+        executa = self.options.get("run", False)
 
-        # copy sqlexecutor to outputfolder.
-        sqlexecutorpath = os.path.join(TOOLFOLDER, sqlexecutorname)
-        if not os.path.isfile(sqlexecutorpath):
-            raise Exception(f"Erro Fatal: {sqlexecutorpath} no foi encontrado.")
-        else:
-            shutil.copyfile(
-                sqlexecutorpath, os.path.join(outputfolder, sqlexecutorname)
-            )
+        # Get Output Folder. (No modo --run a pasta  fixa, para aproveitar resultados anteriores)
+        outputfolder = self.getoutputfolder(
+            append=f"{scriptname}_{f['#MES']}-{f['#ANO']}", reutiliza=executa
+        )
+
+        if not executa:
+            # copy sqlexecutor to outputfolder.
+            sqlexecutorpath = os.path.join(TOOLFOLDER, sqlexecutorname)
+            if not os.path.isfile(sqlexecutorpath):
+                raise Exception(f"Erro Fatal: {sqlexecutorpath} no foi encontrado.")
+            else:
+                shutil.copyfile(
+                    sqlexecutorpath, os.path.join(outputfolder, sqlexecutorname)
+                )
 
         def openfile(fn, c="windows-1252"):
             return self.getoutputfile(inside=outputfolder, override_name=fn, encoding=c)
 
-        # Cria arquivo de execuo:
-        rfo = openfile("_executa.bat", c="cp850")
+        # Relatrios a executar no modo --run: (sql, arquivo de saida, codigo sql)
+        lote = []
         # Cria arquivo de execucao
         rf = [
             "@echo off",
@@ -158,6 +169,8 @@ class Sispre(BaseSISPOSSQL):
             reportf = openfile(reportfilename)
             reportf.write(reportfiledata_s)
 
+            lote.append((reportfilename, reportoutputfilename, reportfiledata_s))
+
             # Escreve a linha que executar o relatrio.
             rf.append(
                 f"{sqlexecutorname} {reportfilename} {os.path.join('out', reportoutputfilename)}"
@@ -166,6 +179,11 @@ class Sispre(BaseSISPOSSQL):
             rf.append(f"echo.")
             rf.append(f"echo.")
 
+        if executa:
+            print("")
+            self.executa_lote(lote, os.path.join(outputfolder, "out"))
+            return
+
         # Escreve final do arquivo que executa tudo.
         rf.append("echo.")
         rf.append("echo ------------------------------------------------")
@@ -175,7 +193,95 @@ class Sispre(BaseSISPOSSQL):
         rf.append("echo.")
         rf.append("pause")
 
+        # Cria arquivo de execuo:
+        rfo = openfile("_executa.bat", c="cp850")
+
         # Write runfile out.
         rfo.write("\n".join(rf))
 
-        print("")
\ No newline at end of file
+        print("")
+
+    def executa_lote(self, lote, outfolder):
+        """Executa os relatrios do lote em paralelo, gravando cada resultado em outfolder."""
+        os.makedirs(outfolder, exist_ok=True)
+
+        periodo = self.inputfiles["#PERIODOID"]
+        jobs = max(1, int(self.options.get("jobs", 4)))
+
+        # Manifesto com o hash do SQL que gerou cada sada, para pular o que j est atualizado.
+        manifestpath = os.path.join(outfolder, "_manifesto.json")
+        manifesto = {}
+        if os.path.isfile(manifestpath):
+            with open(manifestpath, "r", encoding="utf-8") as fm:
+                manifesto = json.load(fm)
+
+        def atualizado(outputfilename, sqlcode):
+            outpath = os.path.join(outfolder, outputfilename)
+            entrada = manifesto.get(outputfilename)
+            return (
+                not sqlcache.refresh
+                and entrada is not None
+                and entrada["sql"] == sqlcache.chave(sqlcode)
+                and os.path.isfile(outpath)
+                and sqlcache.esta_valido(os.path.getmtime(outpath), periodo)
+            )
+
+        def roda(reportfilename, outputfilename, sqlcode):
+            inicio = time.perf_counter()
+            # O erro da consulta vem para c, em vez de sair do programa no meio do lote
+            with levanta_erros_sql():
+                linhas = grava_sqldata(sqlcode, os.path.join(outfolder, outputfilename), periodo)
+            return linhas, time.perf_counter() - inicio
+
+        pendentes = []
+        for reportfilename, outputfilename, sqlcode in lote:
+            if atualizado(outputfilename, sqlcode):
+                print(f" [pul] - {outputfilename} j est atualizado")
+            else:
+                pendentes.append((reportfilename, outputfilename, sqlcode))
+
+        print(f"\nExecutando {len(pendentes)} relatrio(s) com {jobs} em paralelo...\n")
+
+        inicio_lote = time.perf_counter()
+        erros = 0
+        executados, falhas = set(), set()
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            futuros = {executor.submit(roda, *item): item for item in pendentes}
+
+            for n, futuro in enumerate(as_completed(futuros), start=1):
+                reportfilename, outputfilename, sqlcode = futuros[futuro]
+                progresso = f"[ {n}/{len(pendentes)} {(n / len(pendentes)) * 100:5.1f}% ]"
+                try:
+                    linhas, segundos = futuro.result()
+                except (Exception, SystemExit) as e:
+                    erros += 1
+                    falhas.add(outputfilename)
+                    # Sem entrada no manifesto: roda de novo na prxima vez
+                    manifesto.pop(outputfilename, None)
+                    print(f"{progresso} [err] {reportfilename}: {e}")
+                    continue
+
+                executados.add(outputfilename)
+                manifesto[outputfilename] = {
+                    "sql": sqlcache.chave(sqlcode),
+                    "linhas": linhas,
+                    "segundos": round(segundos, 3),
+                }
+                print(f"{progresso} [ok ] {reportfilename} --> {outputfilename} ({segundos:.2f}s, {linhas} linhas)")
+
+        with open(manifestpath, "w", encoding="utf-8") as fm:
+            json.dump(manifesto, fm, indent=2)
+
+        # Sadas que so sries do histrico de perodos fechados (ver sisposbase.historico)
+        historico = historico_padrao()
+        for reportfilename, outputfilename, _ in lote:
+            serie = serie_do_sql(os.path.join("sispre_sql", reportfilename))
+            if serie is None or outputfilename not in manifesto or outputfilename in falhas:
+                continue
+            if outputfilename in executados or not historico.tem(periodo, serie.nome):
+                if historico.importa(periodo, serie.nome, os.path.join(outfolder, outputfilename)):
+                    print(f" [his] - {outputfilename} guardado no histrico ({serie.nome})")
+
+        print("")
+        print(f"Lote executado em {time.perf_counter() - inicio_lote:.2f}s, {erros} erro(s).")
+        print(f"Resultados em: {outfolder}")
\ No newline at end of file
@@ -0,0 +1,295 @@
+# -*- coding: windows-1252 -*-
+from datetime import datetime
+
+from sisposbase import horas
+from sisposbase.catalogo import catalogo_padrao
+from sisposbase.columnar import (
+    DECIMAL,
+    FLOAT,
+    INT,
+    STR,
+    colunas_de_registros,
+    colunas_de_valores,
+    concatena,
+    espalha,
+    fatoriza,
+)
+from sisposbase.get_sql_data import getsqldata_many, periodo_fechado, sql_substitute_variables
+from sisposbase.historico import SERIES, historico_padrao
+from sisposbase.sispos import BaseSISPOSSQL
+
+from .hhreal import HHReal
+from .iomo_capacidadeinstalada import SETORES
+from .sispre import mes_abreviado
+
+
+class Tendencias(BaseSISPOSSQL):
+    """Tendncias de vrios perodos: IOMO, Capacidade Instalada, HH por categoria e horas extras"""
+
+    # Categorias do HH (as mesmas do HHReal), na ordem do relatrio
+    categorias = HHReal.catsORD
+
+    def initstate(self):
+        # Uma linha por perodo, ver calcula()
+        self.tendencias = []
+
+    def catalogo(self):
+        cache = self.options.get("cachequente")
+        return cache.catalogo if cache else catalogo_padrao()
+
+    def le_periodo_inicial(self):
+        catalogo = self.catalogo()
+        if self.resposta("#PERIODOINI") is None:
+            print(catalogo.texto())
+            print("")
+        return catalogo.seleciona(
+            self.ask("#PERIODOINI", "ID DO PERIODO INICIAL (ou ultimo-fechado-N...)", " --> ")
+        )
+
+    def le_periodos(self):
+        """Os perodos do inicial ao final, em ordem: [(id, mes, ano, fechado)]."""
+        catalogo = self.catalogo()
+        final = catalogo.seleciona(self.ask("#PERIODO", "ID DO PERIODO FINAL (ou ultimo-fechado...)", " --> "))
+        inicial = self.inputfiles["#PERIODOINI"]
+
+        todos = catalogo.periodos()
+        for perid in (inicial, final):
+            if perid not in todos:
+                raise Exception(f"Perodo {perid} no existe")
+
+        def ordem(perid):
+            mes, ano = todos[perid][:2]
+            return int(ano), int(mes)
+
+        if ordem(inicial) > ordem(final):
+            raise Exception(f"O perodo inicial ({inicial})  depois do final ({final})")
+
+        periodos = [
+            (perid, "{:02}".format(int(mes)), "{:02}".format(int(ano)), periodo_fechado(status))
+            for perid, (mes, ano, status, _, _) in todos.items()
+            if ordem(inicial) <= ordem(perid) <= ordem(final)
+        ]
+        periodos.sort(key=lambda p: ordem(p[0]))
+
+        self.inputfiles["#MES"], self.inputfiles["#ANO"] = periodos[-1][1:3]
+        print(f"\n{len(periodos)} PERODO(S): de {periodos[0][1]}/{periodos[0][2]} a {periodos[-1][1]}/{periodos[-1][2]}")
+        return periodos
+
+    findfiles = (
+        ("#PERIODOINI", le_periodo_inicial),
+        ("#PERIODO", le_periodos),
+    )
+
+    # ----------------------------------
+    # Dados: do histrico ou do banco
+    # ----------------------------------
+
+    def variaveis(self, periodo):
+        perid, mes, ano, _ = periodo
+        _, _, _, dtini, dtfim = self.catalogo().periodo(perid)
+        return {
+            "PERIODO": perid,
+            "MESNUM": mes,
+            "MESABREV": mes_abreviado[int(mes) - 1],
+            "ANONUM": ano,
+            "DTINI": dtini,
+            "DTFIM": dtfim,
+        }
+
+    def carrega_series(self, periodos):
+        """{serie: [Colunas de cada perodo]}: perodos fechados do histrico, o resto do banco."""
+        historico = historico_padrao()
+        dados = {serie: [None] * len(periodos) for serie in SERIES}
+
+        faltando = []
+        with self.etapa("historico"):
+            for i, periodo in enumerate(periodos):
+                fechado = periodo[3]
+                for serie in SERIES:
+                    dados[serie][i] = historico.carrega(periodo[0], serie) if fechado else None
+                    if dados[serie][i] is None:
+                        faltando.append((i, serie))
+
+        do_historico = len(periodos) * len(SERIES) - len(faltando)
+        print(f"{do_historico} srie(s) do histrico, {len(faltando)} consultada(s) no banco.\n")
+
+        with self.etapa("sql"):
+            sqls = {serie: self.getdatafile(s.sql) for serie, s in SERIES.items()}
+            for i, periodo in enumerate(periodos):
+                series = [serie for j, serie in faltando if j == i]
+                if not series:
+                    continue
+
+                # As consultas de um perodo rodam em paralelo
+                variaveis = self.variaveis(periodo)
+                resultados = getsqldata_many(
+                    [sql_substitute_variables(sqls[serie], variaveis) for serie in series],
+                    periodo=periodo[0],
+                )
+                for serie, resultado in zip(series, resultados):
+                    dados[serie][i] = colunas_de_registros(resultado[0], SERIES[serie].schema)
+                    historico.grava(periodo[0], serie, dados[serie][i])
+                print(f"  {periodo[1]}/{periodo[2]}: {', '.join(series)}")
+
+        return dados
+
+    # ----------------------------------
+    # Tendncias: uma passada por indicador, com todos os perodos juntos
+    # ----------------------------------
+
+    @staticmethod
+    def total_dos_setores(partes):
+        """Horas dos setores do IOMO (SETORES) em cada perodo."""
+        n = len(partes)
+        setores = {setor for grupo in SETORES.values() for setor in grupo}
+
+        cols = concatena(partes, indice="periodo")
+        codigos, distintos = fatoriza(cols["periodo"], cols["depto"])
+
+        # Setores fora da lista vo para o cdigo n, descartado
+        destino = [p if depto in setores else n for p, depto in distintos]
+        return horas.soma_por(espalha(codigos, destino), cols["horas"], n + 1)[:n]
+
+    def total_por_categoria(self, partes):
+        """[{categoria: horas}] de cada perodo, com as categorias do HHReal."""
+        n = len(partes)
+        ncat = len(self.categorias)
+        posicao = {cat: k for k, cat in enumerate(self.categorias)}
+
+        cols = concatena(partes, indice="periodo")
+        codigos, distintos = fatoriza(cols["periodo"], cols["cargo"], cols["depto"])
+
+        # Cada cargo/depto  classificado uma vez s
+        categoria = {}
+        destino = []
+        for p, cargo, depto in distintos:
+            if (cargo, depto) not in categoria:
+                categoria[cargo, depto] = posicao[HHReal.catrules.classifica(cargo, depto)[0]]
+            destino.append(p * ncat + categoria[cargo, depto])
+
+        somas = horas.soma_por(espalha(codigos, destino), cols["horas"], n * ncat)
+        return [dict(zip(self.categorias, somas[p * ncat:(p + 1) * ncat])) for p in range(n)]
+
+    def calcula(self, periodos, dados):
+        n = len(periodos)
+        hefet = self.total_dos_setores(dados["iomo_hefet"])
+        hdisp = self.total_dos_setores(dados["iomo_hdisp"])
+        htot = self.total_dos_setores(dados["iomo_htot"])
+
+        he = concatena(dados["he_total"], indice="periodo")
+        he_total = horas.soma_por(he["periodo"], he["horas"], n)
+
+        hh = self.total_por_categoria(dados["hhreal"])
+
+        def indice(parte, total):
+            return horas.percentual(parte, total) if total else None
+
+        for k, (perid, mes, ano, fechado) in enumerate(periodos):
+            self.tendencias.append(
+                {
+                    "periodo": perid,
+                    "mes": mes,
+                    "ano": ano,
+                    "fechado": fechado,
+                    "hefet": hefet[k],
+                    "hdisp": hdisp[k],
+                    "htot": htot[k],
+                    "iomo": indice(hefet[k], hdisp[k]),
+                    "capac": indice(hefet[k], htot[k]),
+                    "he": he_total[k],
+                    "hh": hh[k],
+                }
+            )
+        return self.tendencias
+
+    # ----------------------------------
+    # Relatrios
+    # ----------------------------------
+
+    def process(self, f):
+        periodos = f["#PERIODO"]
+
+        dados = self.carrega_series(periodos)
+
+        with self.etapa("tendencias"):
+            linhas = self.calcula(periodos, dados)
+
+        with self.etapa("relatorio"):
+            intervalo = f"{periodos[0][1]}-{periodos[0][2]}_a_{periodos[-1][1]}-{periodos[-1][2]}"
+            self.escreve_txt(linhas, self.getoutputfile(append=f"Tendncias_{intervalo}"))
+            self.escreve_csv(linhas, self.getoutputfile(append=f"{intervalo}-excel", ext="csv"))
+            self.exporta_tendencias(linhas, intervalo)
+
+        return linhas
+
+    def exporta_tendencias(self, linhas, intervalo):
+        """Uma linha por perodo e o HH por perodo e categoria, tipados (--exporta).
+
+        ndices sem total (None) vo como NaN.
+        """
+        def indice(valor):
+            return float("nan") if valor is None else float(valor)
+
+        self.exporta(
+            f"{intervalo}-periodos",
+            colunas_de_valores(
+                [
+                    (l["periodo"], int(l["mes"]), int(l["ano"]), int(l["fechado"]), l["hefet"], l["hdisp"],
+                     l["htot"], indice(l["iomo"]), indice(l["capac"]), l["he"])
+                    for l in linhas
+                ],
+                (("periodo", INT), ("mes", INT), ("ano", INT), ("fechado", INT), ("hefet", DECIMAL),
+                 ("hdisp", DECIMAL), ("htot", DECIMAL), ("iomo", FLOAT), ("capac", FLOAT), ("he", DECIMAL)),
+            ),
+        )
+        self.exporta(
+            f"{intervalo}-hh",
+            colunas_de_valores(
+                [(l["periodo"], cat, l["hh"][cat]) for l in linhas for cat in self.categorias],
+                (("periodo", INT), ("categoria", STR), ("horas", DECIMAL)),
+            ),
+        )
+
+    @staticmethod
+    def _indice(valor):
+        return "" if valor is None else f"{valor}%"
+
+    def escreve_txt(self, linhas, o):
+        o.write("NUCLEBRAS EQUIPAMENTOS PESADOS S.A. - NUCLEP\n")
+        o.write("Gerncia Geral de Programao e Controle da Produo  IC\n\n")
+        o.write("Tendncias por perodo: IOMO, Capacidade Instalada e Horas Extras\n\n")
+
+        o.write(
+            f"{'PERODO':12}{'H. EFETIVAS':>14}{'H. DISPONIV.':>14}{'H. TOTAIS':>14}"
+            f"{'IOMO':>7}{'CAPAC':>7}{'H. EXTRAS':>14}\n"
+        )
+        for l in linhas:
+            periodo = f"{l['mes']}/{l['ano']}" + ("" if l["fechado"] else " *")
+            o.write(
+                f"{periodo:12}"
+                f"{horas.formata(l['hefet']):>14}{horas.formata(l['hdisp']):>14}{horas.formata(l['htot']):>14}"
+                f"{self._indice(l['iomo']):>7}{self._indice(l['capac']):>7}{horas.formata(l['he']):>14}\n"
+            )
+        o.write("\n* perodo aberto, os valores ainda podem mudar.\n\n")
+
+        o.write("HH por categoria (as mesmas do HHReal):\n\n")
+        for l in linhas:
+            o.write(f"{l['mes']}/{l['ano']}\n")
+            for cat in self.categorias:
+                o.write(f"  {cat:24}{horas.formata(l['hh'][cat]):>14}\n")
+            o.write("\n")
+
+        o.write(f"\nEmitido em: {datetime.now().strftime('%d/%m/%Y %H:%M')}\n\n")
+
+    def escreve_csv(self, linhas, o):
+        cabecalho = ["Periodo", "Mes/Ano", "Situacao", "Horas efetivas", "Horas disponiveis", "Horas totais",
+                     "IOMO %", "CAPAC %", "Horas extras"] + [f"HH {cat}" for cat in self.categorias]
+        rv = ["\t".join(cabecalho)]
+        for l in linhas:
+            campos = [str(l["periodo"]), f"{l['mes']}/{l['ano']}", "fechado" if l["fechado"] else "aberto"]
+            campos += [horas.formata(l[k]).replace(".", ",") for k in ("hefet", "hdisp", "htot")]
+            campos += ["" if l[k] is None else str(l[k]) for k in ("iomo", "capac")]
+            campos.append(horas.formata(l["he"]).replace(".", ","))
+            campos += [horas.formata(l["hh"][cat]).replace(".", ",") for cat in self.categorias]
+            rv.append("\t".join(campos))
+        o.write("\n".join(rv) + "\n")
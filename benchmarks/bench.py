@@ -0,0 +1,343 @@
+"""
+Benchmarks das análises, sobre as amostras de sampledata/ aumentadas (ver gerador.py).
+
+Para cada análise e cada escala (1 = a amostra, 10 = dez vezes maior...) mede
+separadamente as etapas:
+
+  parse   leitura do arquivo / result set e conversão dos campos
+  agrega  montagem dos totais (HHReal/HTipo0GXX: processjdata(), que também
+          classifica cada linha; Criticas: cria_bancodedados())
+  render  escrita dos relatórios (Criticas: escreve_criticas(), que também
+          julga os lançamentos)
+  total   HHReal/HTipo0GXX: process() inteiro, como numa execução normal;
+          como ali as etapas acontecem intercaladas, render = total - parse - agrega
+
+Cada etapa é medida `--repeticoes` vezes e fica o menor tempo. O resultado
+pode ser gravado em JSON (--saida) e comparado com o de outro commit
+(--compara), sempre na mesma máquina: o comando sai com código 1 se alguma
+etapa ficou mais lenta que a tolerância.
+
+Uso, da raiz do repositório:
+  python -m benchmarks.bench                          escalas 1, 10 e 100
+  python -m benchmarks.bench --escalas 10 100 1000    1000x: milhões de linhas, alguns GB de memória
+  python -m benchmarks.bench --analises HHReal Criticas --saida base.json
+  python -m benchmarks.bench --compara base.json --tolerancia 0.2
+
+Os arquivos gerados ficam em benchmarks/dados/ (--dados), para não gerar de
+novo a cada execução.
+"""
+import argparse
+import datetime
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager, redirect_stdout
+
+from benchmarks.gerador import RAIZ, gera
+
+DADOSPATH = os.path.join(RAIZ, "benchmarks", "dados")
+
+ESCALAS = (1, 10, 100)
+
+ETAPAS = ("parse", "agrega", "render", "total")
+
+
+class Cronometro:
+    """Soma o tempo de cada etapa (with cronometro.etapa("parse"): ...)."""
+
+    def __init__(self):
+        self.tempos = {}
+
+    @contextmanager
+    def etapa(self, nome):
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.tempos[nome] = self.tempos.get(nome, 0.0) + time.perf_counter() - inicio
+
+
+def _analise(classe, pastasaida, answers):
+    # Criada fora do cronômetro, sem os prints das perguntas
+    with redirect_stdout(io.StringIO()):
+        return classe(options={"batch": True, "answers": answers, "outputpath": pastasaida})
+
+
+def _roda(analise):
+    with redirect_stdout(io.StringIO()):
+        return analise.run()
+
+
+# ----------------------------------------------------------------------
+# Casos: (pasta dos dados, fator, pasta de saída, cronômetro) -> linhas
+# ----------------------------------------------------------------------
+
+
+def bench_getsqldata(dados, fator, saida, c):
+    """Separação do texto do SingleSQLExecutor.exe em result sets (CRIMES_HH)."""
+    from sisposbase.sqlbackend import itera_sqlexecutor_output
+
+    caminho = gera(dados, "crimeshh", fator)
+    with c.etapa("parse"):
+        # Como o ExecutableBackend lê o arquivo de saída do executável
+        with open(caminho, "r", encoding="windows-1252", newline="\r\n") as f:
+            resultsets = [list(rs) for rs in itera_sqlexecutor_output(f)]
+    c.tempos["total"] = c.tempos["parse"]
+    return len(resultsets[0]) - 1
+
+
+def bench_criticas(dados, fator, saida, c):
+    """CRIMES_HH e CRIMES_HM."""
+    from analysis.Criticas_HH_e_HM import (
+        Criticas,
+        cria_bancodedados,
+        crimes_schema,
+        julgalinhas,
+        limites_hh,
+        limites_hm,
+    )
+    from sisposbase.columnar import le_colunas
+    from sisposbase.filefinder import LinhasMapeadas
+    from sisposbase.get_sql_data import FeriadoTuple
+
+    # Sem __init__: não pergunta o período nem consulta o banco
+    criticas = Criticas.__new__(Criticas)
+    f = {
+        "#DIAS1": [
+            FeriadoTuple(datetime.datetime(2012, 12, 24), "Véspera de Natal", 1),
+            FeriadoTuple(datetime.datetime(2012, 12, 31), "Véspera de Ano Novo", 1),
+        ],
+        "#DIAS2": [
+            FeriadoTuple(datetime.datetime(2012, 12, 25), "Natal", 2),
+            FeriadoTuple(datetime.datetime(2013, 1, 1), "Ano Novo", 2),
+        ],
+    }
+
+    linhas = 0
+    for nome, limites, julga_dia in (
+        ("crimeshh", limites_hh, julgalinhas),
+        ("crimeshm", limites_hm, None),
+    ):
+        caminho = gera(dados, nome, fator)
+        with c.etapa("parse"):
+            cols = le_colunas(LinhasMapeadas(caminho), crimes_schema)
+        with c.etapa("agrega"):
+            cria_bancodedados(cols)
+        with c.etapa("render"):
+            criticas.escreve_criticas(f, cols, limites, julga_dia)
+        linhas += len(cols["matricula"])
+
+    c.tempos["total"] = c.tempos["parse"] + c.tempos["agrega"] + c.tempos["render"]
+    return linhas
+
+
+def bench_hhreal(dados, fator, saida, c):
+    from analysis.hhreal import HHReal
+    from sisposbase.agrupamento import agrupa
+    from sisposbase.filefinder import LinhasMapeadas
+
+    caminho = gera(dados, "hhreal", fator)
+    answers = {"MES": "01", "ANO": "2013", "HHREAL": caminho}
+
+    with c.etapa("parse"):
+        linhas = list(HHReal.convert_data_fields(LinhasMapeadas(caminho)))
+
+    analise = _analise(HHReal, saida, answers)
+    with c.etapa("agrega"):
+        agrupa(linhas, chaves=(0, 1), valor=5)
+        for linha in linhas:
+            analise.processjdata(linha)
+
+    analise = _analise(HHReal, saida, answers)
+    with c.etapa("total"):
+        _roda(analise)
+    return len(linhas)
+
+
+def bench_htipo0gxx(dados, fator, saida, c):
+    from analysis.htipo0gxx import HTipo0GXX
+    from sisposbase.columnar import le_blocos
+    from sisposbase.filefinder import LinhasMapeadas
+
+    caminho = gera(dados, "htipo0gxx", fator)
+    answers = {"MES": "11", "ANO": "2012", "HTIPO0GXX": caminho}
+
+    with c.etapa("parse"):
+        blocos = le_blocos(LinhasMapeadas(caminho), HTipo0GXX.data_schema, cabecalho=False)
+        linhas = [l + ("",) for cols in blocos for l in cols.linhas()]
+
+    analise = _analise(HTipo0GXX, saida, answers)
+    with c.etapa("agrega"):
+        for linha in linhas:
+            analise.processjdata(linha)
+
+    analise = _analise(HTipo0GXX, saida, answers)
+    with c.etapa("total"):
+        _roda(analise)
+    return len(linhas)
+
+
+CASOS = {
+    "getsqldata": bench_getsqldata,
+    "Criticas": bench_criticas,
+    "HHReal": bench_hhreal,
+    "HTipo0GXX": bench_htipo0gxx,
+}
+
+
+def mede(caso, dados, fator, repeticoes=3):
+    """{"linhas": n, etapa: segundos...}, o menor tempo de cada etapa em `repeticoes` execuções."""
+    melhor = {}
+    linhas = 0
+    for _ in range(repeticoes):
+        saida = tempfile.mkdtemp(prefix="bench_")
+        try:
+            c = Cronometro()
+            linhas = CASOS[caso](dados, fator, saida, c)
+        finally:
+            shutil.rmtree(saida, ignore_errors=True)
+
+        if "render" not in c.tempos and "agrega" in c.tempos:
+            c.tempos["render"] = max(
+                0.0, c.tempos["total"] - c.tempos.get("parse", 0.0) - c.tempos.get("agrega", 0.0)
+            )
+        for etapa, segundos in c.tempos.items():
+            melhor[etapa] = min(segundos, melhor.get(etapa, segundos))
+
+    return {"linhas": linhas, **melhor}
+
+
+def _commit():
+    try:
+        r = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=RAIZ, capture_output=True, timeout=30
+        )
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return r.stdout.decode().strip() or None
+
+
+def executa(casos, escalas, dados=DADOSPATH, repeticoes=3):
+    """Roda os casos em todas as escalas, devolve o relatório (o que vai para o JSON)."""
+    try:
+        import numpy
+    except ImportError:
+        numpy = None
+
+    relatorio = {
+        "criado": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": _commit(),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "numpy": numpy is not None,
+        "repeticoes": repeticoes,
+        "resultados": {},
+    }
+    for caso in casos:
+        for fator in escalas:
+            print(f"{caso} {fator}x...", end=" ", flush=True)
+            r = mede(caso, dados, fator, repeticoes)
+            relatorio["resultados"].setdefault(caso, {})[str(fator)] = r
+            print(f'{r["total"]:.3f}s')
+    return relatorio
+
+
+def texto(relatorio) -> str:
+    linhas = [
+        "%-12s %7s %10s %9s %9s %9s %9s %12s"
+        % ("análise", "escala", "linhas", *ETAPAS, "linhas/s")
+    ]
+    for caso, escalas in relatorio["resultados"].items():
+        for fator, r in escalas.items():
+            por_segundo = r["linhas"] / r["total"] if r["total"] else 0
+            tempos = ("%9.3f" % r[e] if e in r else "%9s" % "-" for e in ETAPAS)
+            linhas.append(
+                "%-12s %6sx %10d %s %12.0f" % (caso, fator, r["linhas"], " ".join(tempos), por_segundo)
+            )
+    return "\n".join(linhas)
+
+
+def compara(base, atual, tolerancia=0.25, piso=0.005):
+    """Compara dois relatórios etapa a etapa: [(caso, fator, etapa, antes, depois, mais_lento)].
+
+    Só conta como mais lento o que passou da tolerância (0.25 = 25%) e de `piso`
+    segundos, para medições muito curtas não acusarem ruído.
+    """
+    diferencas = []
+    for caso, escalas in atual["resultados"].items():
+        for fator, r in escalas.items():
+            b = base.get("resultados", {}).get(caso, {}).get(fator)
+            if b is None:
+                continue
+            for etapa in ETAPAS:
+                if etapa not in r or etapa not in b:
+                    continue
+                antes, depois = b[etapa], r[etapa]
+                mais_lento = depois > antes * (1 + tolerancia) and depois - antes > piso
+                diferencas.append((caso, fator, etapa, antes, depois, mais_lento))
+    return diferencas
+
+
+def texto_comparacao(base, diferencas) -> str:
+    linhas = [f'Comparado com {base.get("commit") or "?"} ({base.get("criado", "?")}):']
+    for caso, fator, etapa, antes, depois, mais_lento in diferencas:
+        razao = depois / antes if antes else float("inf")
+        linhas.append(
+            "%-12s %6sx %-7s %9.3f -> %9.3f  %6.2fx%s"
+            % (caso, fator, etapa, antes, depois, razao, "  <-- MAIS LENTO" if mais_lento else "")
+        )
+    return "\n".join(linhas)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks das análises sobre sampledata/ aumentado")
+    parser.add_argument("--analises", nargs="+", choices=list(CASOS), default=list(CASOS))
+    parser.add_argument("--escalas", nargs="+", type=int, default=list(ESCALAS))
+    parser.add_argument("--repeticoes", type=int, default=3)
+    parser.add_argument("--dados", default=DADOSPATH, help="pasta dos arquivos gerados")
+    parser.add_argument("--saida", help="grava o resultado neste JSON")
+    parser.add_argument("--compara", help="JSON de outra execução, para comparar")
+    parser.add_argument("--tolerancia", type=float, default=0.25)
+    args = parser.parse_args(argv)
+
+    base = None
+    if args.compara:
+        with open(args.compara, "r", encoding="utf-8") as f:
+            base = json.load(f)
+
+    # sisposbase cria inputs/, outputs/ e cache/ no diretório atual: roda num temporário
+    dados = os.path.abspath(args.dados)
+    trabalho = tempfile.mkdtemp(prefix="bench_")
+    anterior = os.getcwd()
+    os.chdir(trabalho)
+    try:
+        relatorio = executa(args.analises, args.escalas, dados, args.repeticoes)
+    finally:
+        os.chdir(anterior)
+        shutil.rmtree(trabalho, ignore_errors=True)
+
+    print()
+    print(texto(relatorio))
+
+    if args.saida:
+        with open(args.saida, "w", encoding="utf-8") as f:
+            json.dump(relatorio, f, ensure_ascii=False, indent=1)
+        print(f"\nResultado gravado em {args.saida}")
+
+    if base is not None:
+        diferencas = compara(base, relatorio, args.tolerancia)
+        print()
+        print(texto_comparacao(base, diferencas))
+        if any(d[5] for d in diferencas):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
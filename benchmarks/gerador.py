@@ -0,0 +1,115 @@
+"""
+Gera entradas maiores a partir das amostras de sampledata/, para os benchmarks.
+
+Cada amostra é repetida `fator` vezes. Em cada cópia as chaves que identificam
+as pessoas e os serviços (matrícula, OS) ganham um deslocamento, e o resto da
+linha é mantido: 100x o CRIMESHH tem 100x as matrículas, cada uma com os
+mesmos padrões de turno, htipo e minutos de uma matrícula real, e 100x o
+HHReal tem 100x as OS com os mesmos cargos, deptos e atividades. Assim os
+caches de valores distintos (datas, cargos, horas) se comportam como num
+período de verdade, maior.
+
+Os arquivos saem no formato que as análises leem (windows-1252, CRLF):
+  crimeshh/crimeshm  como o SingleSQLExecutor.exe grava o CRIMES_HH/CRIMES_HM
+                     (cabeçalho, data dd/mm/aa, horas e minutos)
+  hhreal             o arquivo de entrada do HHReal (a partir do hhrealcadu.txt)
+  htipo0gxx          o arquivo de entrada do HTipo0GXX
+"""
+import datetime
+import os
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+AMOSTRAS = os.path.join(RAIZ, "sampledata")
+
+# Deslocamento das chaves em cada cópia (maior que qualquer chave das amostras)
+DESLOCAMENTO_MATRICULA = 10**7
+DESLOCAMENTO_OS = 10**9
+
+
+def _campos(nome):
+    with open(os.path.join(AMOSTRAS, nome), "r", encoding="windows-1252") as f:
+        for linha in f:
+            campos = linha.strip().split("|")
+            if len(campos) > 1 and campos[0].strip():
+                yield campos
+
+
+def _crimes(nome):
+    # matricula|turno|dd/mm/aaaa|htipo|horas| -> (matricula, turno, data, htipo, minutos)
+    for matr, turno, data, htipo, horas, *_ in _campos(nome):
+        yield (
+            int(float(matr)),
+            int(float(turno)),
+            datetime.datetime.strptime(data, "%d/%m/%Y").strftime("%d/%m/%y"),
+            int(float(htipo)),
+            round(float(horas.replace(",", ".")) * 60),
+        )
+
+
+def linhas_crimes(nome, fator):
+    """Linhas do CRIMES_HH/CRIMES_HM (nome da amostra) repetidas `fator` vezes."""
+    amostra = list(_crimes(nome))
+    yield "matricula|turno|Data|htipo|H|M|\r\n"
+    for k in range(fator):
+        for matr, turno, data, htipo, minutos in amostra:
+            yield "%d|%d|%s|%d|%.1f|%d|\r\n" % (
+                matr + k * DESLOCAMENTO_MATRICULA,
+                turno,
+                data,
+                htipo,
+                minutos / 60,
+                minutos,
+            )
+
+
+def linhas_hhreal(fator, periodoid=7, anomes="1301"):
+    """Entrada do HHReal a partir do hhrealcadu.txt (OS|cargo|depto|fa|atividade|horas), `fator` vezes."""
+    amostra = list(_campos("hhrealcadu.txt"))
+    yield "periodo|anomes|os|reduzida|descricao|depto|atividade|fa|tothora|\r\n"
+    for k in range(fator):
+        for os_, descricao, depto, fa, atividade, horas, *_ in amostra:
+            os_ = str(int(os_) + k * DESLOCAMENTO_OS)
+            yield "%s|%s|%s|%s-0|%s|%s|%s|%s|%s|\r\n" % (
+                periodoid,
+                anomes,
+                os_,
+                os_[-4:],
+                descricao,
+                depto,
+                atividade,
+                fa,
+                horas.replace(".", ","),
+            )
+
+
+def linhas_htipo0gxx(fator, nome="HTIPO0GXX1112.TXT"):
+    """Entrada do HTipo0GXX (codped|cliente|cargo|htipo|horas, sem cabeçalho), `fator` vezes."""
+    amostra = list(_campos(nome))
+    for k in range(fator):
+        for codped, cliente, cargo, htipo, horas, *_ in amostra:
+            # A primeira cópia fica com as OS originais (e os agrupamentos de clientes delas)
+            codped = str(int(codped) + k * DESLOCAMENTO_OS)
+            yield "%s|%s|%s|%s|%s|\r\n" % (codped, cliente, cargo, htipo, horas)
+
+
+GERADORES = {
+    "crimeshh": lambda fator: linhas_crimes("CRIMESHH0113.TXT", fator),
+    "crimeshm": lambda fator: linhas_crimes("CRIMESHM0113.TXT", fator),
+    "hhreal": linhas_hhreal,
+    "htipo0gxx": linhas_htipo0gxx,
+}
+
+
+def gera(pasta, nome, fator):
+    """Grava a entrada `nome` (ver GERADORES) `fator` vezes maior em `pasta`, devolve o caminho.
+
+    Se o arquivo já existe ele é reaproveitado (os geradores são determinísticos).
+    """
+    caminho = os.path.join(pasta, "%s_x%d.txt" % (nome, fator))
+    if not os.path.isfile(caminho):
+        os.makedirs(pasta, exist_ok=True)
+        tmppath = caminho + ".tmp"
+        with open(tmppath, "w", encoding="windows-1252", newline="") as f:
+            f.writelines(GERADORES[nome](fator))
+        os.replace(tmppath, caminho)
+    return caminho
@@ -1,20 +1,29 @@
 #!python3
 # -*- coding: utf-8 -*-
 
-from typing import Dict
+from typing import Dict, List
 
+import argparse
+import datetime
+import os
 import sys
-from sisposbase.sispos import BaseSISPOS
+import time
+import traceback
+from contextlib import redirect_stdout
+from sisposbase import exportacao, sqlcache
+from sisposbase.catalogo import eh_seletor
+from sisposbase.sispos import BaseSISPOS, OUTPUTPATH
+from sisposbase.tarefas import ResultadoTarefa, Tarefa, le_tarefas, monta_options
 
-from analysis import analysis_list
+from analysis import Analise, analysis_list
 
 
 class SisposRunner:
     @staticmethod
-    def buildmenu() -> Dict[str, BaseSISPOS]:
+    def buildmenu() -> Dict[str, Analise]:
         r = {}
         for a in analysis_list:
-            r[a.__name__] = a
+            r[a.nome] = a
         return r
 
     def __init__(self):
@@ -29,28 +38,110 @@ class SisposRunner:
             "######################\n"
         )
 
-    def run(self, chosen=""):
+    def run(self, chosen="", options=None):
         self.banner()
 
-        runnable = self.chooseanalysis(chosen)
+        runnable = self.chooseanalysis(chosen, interactive=not (options or {}).get("batch"))
 
         # instantiate and run the analysis
-        analysis = runnable()  # type: BaseSISPOS
+        analysis = runnable(options=options)  # type: BaseSISPOS
         analysis.run()
 
         # print(f"our runnable is {runnable.__name__}")
 
-    def chooseanalysis(self, chosen="") -> BaseSISPOS:
+    def run_many(self, chosen: List[str], periodos: List[int], options=None, max_workers=None):
+        """Roda várias análises, para cada um dos períodos, em paralelo."""
+        periodos = list(periodos) or [None]
+        tarefas = [
+            Tarefa(nome, monta_options({"periodo": periodo}, options))
+            for periodo in periodos
+            for nome in chosen
+        ]
+        return self.run_tarefas(tarefas, max_workers)
+
+    def run_tarefas(self, tarefas: List[Tarefa], max_workers=None) -> List[ResultadoTarefa]:
+        """Roda as tarefas num pool de processos e imprime o resumo.
+
+        Cada tarefa roda num processo novo (estado limpo), em modo não interativo,
+        com a sua própria pasta de saída e o log da execução em _log.txt dentro dela.
+        """
+        self.banner()
+
+        # Confere os nomes antes de começar qualquer coisa
+        desconhecidas = sorted({t.analise for t in tarefas if t.analise not in self.menu})
+        if desconhecidas:
+            raise Exception(f"Não existe análise de nome: {', '.join(desconhecidas)}")
+
+        # Importado só aqui, para não pesar na inicialização de uma análise só
+        from concurrent.futures import ProcessPoolExecutor, as_completed
+
+        lote = datetime.datetime.now().strftime("lote_%Y%m%d-%H%M%S")
+        pastalote = os.path.join(OUTPUTPATH, lote)
+
+        preparadas = []
+        for i, tarefa in enumerate(tarefas, 1):
+            periodo = tarefa.options.get("answers", {}).get("#PERIODO")
+            pasta = f"{i:02}_{tarefa.analise}" + (f"_{periodo}" if periodo is not None else "")
+            options = dict(tarefa.options, batch=True, outputpath=os.path.join(pastalote, pasta))
+            preparadas.append(Tarefa(tarefa.analise, options))
+
+        print(f"Executando {len(preparadas)} tarefa(s) em paralelo...\n")
+
+        # As análises passam a maior parte do tempo esperando o banco, não limite pelos processadores
+        max_workers = max_workers or min(len(preparadas), 4) or 1
+
+        try:
+            # Um processo novo para cada tarefa: nada do estado de uma análise vaza para outra.
+            pool = ProcessPoolExecutor(max_workers=max_workers, max_tasks_per_child=1)
+        except TypeError:
+            # Python < 3.11
+            pool = ProcessPoolExecutor(max_workers=max_workers)
+
+        inicio = time.perf_counter()
+        with pool:
+            futuros = [pool.submit(executa_tarefa, t) for t in preparadas]
+            for futuro in as_completed(futuros):
+                r = futuro.result()
+                situacao = "ok " if r.ok else "err"
+                print(f"  [{situacao}] {r.analise} (período {r.periodo}) em {r.segundos:.1f}s")
+
+        # Na ordem em que as tarefas foram pedidas (futuros está na ordem de submit)
+        resultados = [futuro.result() for futuro in futuros]
+        self.resumo(resultados, time.perf_counter() - inicio, pastalote)
+        return resultados
+
+    @staticmethod
+    def resumo(resultados: List[ResultadoTarefa], segundos: float, pastalote: str):
+        falhas = [r for r in resultados if not r.ok]
+
+        print("\n##############################################################")
+        print(f"{len(resultados) - len(falhas)} de {len(resultados)} tarefa(s) executada(s) com sucesso em {segundos:.1f}s")
+        print("##############################################################\n")
+
+        for r in resultados:
+            situacao = "OK  " if r.ok else "ERRO"
+            print(f"  {situacao} {r.segundos:7.1f}s  {r.analise.ljust(24)} período {r.periodo}")
+            if r.erro:
+                print(f"       {r.erro}")
+        print(f"\nResultados e logs em:\n\n  {pastalote}")
+        print("\n##############################################################")
+
+    def chooseanalysis(self, chosen="", interactive=True) -> BaseSISPOS:
 
         # A name was given
         if chosen:
             if chosen in self.menu:
-                # return runnable
-                return self.menu[chosen]
+                # import and return runnable
+                return self.menu[chosen].carrega()
             else:
                 print(f'Erro: Não existe análise de nome "{chosen}"')
                 exit(1)
 
+        # No name and nobody to ask?
+        if not interactive:
+            print("Erro: No modo não interativo o nome da análise é obrigatório")
+            exit(1)
+
         # No name? Print menu and ask for choice.
         print("Escolha a ferramenta pelo número:\n---------------------------------\n")
 
@@ -63,7 +154,7 @@ class SisposRunner:
             runnables_by_number[i] = self.menu[analysis_name]
 
             opnumero = f"[{i}]".ljust(taman)
-            print(f"{opnumero} \"{analysis_name}\"\n{' '.ljust(len(opnumero))} {self.menu[analysis_name].__doc__}\n")
+            print(f"{opnumero} \"{analysis_name}\"\n{' '.ljust(len(opnumero))} {self.menu[analysis_name].doc}\n")
         print("")
 
         ans = 0
@@ -82,18 +173,190 @@ class SisposRunner:
                 continue
             else:
                 print("")
-                return runnables_by_number[ans]
+                return runnables_by_number[ans].carrega()
+
+
+def executa_tarefa(tarefa: Tarefa) -> ResultadoTarefa:
+    """Roda uma tarefa de SisposRunner.run_tarefas() (dentro do processo do pool)."""
+    pasta = tarefa.options["outputpath"]
+    periodo = tarefa.options.get("answers", {}).get("#PERIODO")
+    os.makedirs(pasta, exist_ok=True)
+
+    if tarefa.options.get("refresh"):
+        sqlcache.refresh = True
+
+    erro = ""
+    inicio = time.perf_counter()
+    with open(os.path.join(pasta, "_log.txt"), "w", encoding="utf-8") as log, redirect_stdout(log):
+        try:
+            SisposRunner().run(tarefa.analise, tarefa.options)
+        except SystemExit as e:
+            erro = f"A análise terminou antes do fim (exit {e.code}), veja o _log.txt"
+        except Exception as e:
+            erro = f"{e.__class__.__name__}: {e}"
+            traceback.print_exc(file=log)
+
+    return ResultadoTarefa(tarefa.analise, periodo, not erro, time.perf_counter() - inicio, pasta, erro)
+
+
+def periodo_arg(texto):
+    if texto.strip().isdigit():
+        return int(texto)
+    if eh_seletor(texto):
+        return texto.strip().lower()
+    raise argparse.ArgumentTypeError(f'período inválido "{texto}"')
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description="SISPOS -- Análises, Ferramentas e Relatórios de Apropriação de Mão de Obra"
+    )
+    parser.add_argument(
+        "analise",
+        nargs="*",
+        default=[],
+        help="nome da análise a executar (várias: rodam em paralelo, em modo não interativo)",
+    )
+    parser.add_argument(
+        "--refresh",
+        action="store_true",
+        help="ignora o cache de consultas SQL e busca tudo de novo no banco",
+    )
+    parser.add_argument(
+        "--run",
+        action="store_true",
+        help="Sispre: executa o lote diretamente em vez de gerar o _executa.bat",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=4,
+        help="Sispre --run: quantidade de relatórios executados em paralelo (padrão: 4)",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Criticas: busca e julga só as matrículas alteradas desde a última execução do período",
+    )
+    parser.add_argument(
+        "--perfil",
+        choices=("cpu", "memoria", "tudo"),
+        help="grava também o cProfile (cpu) e/ou o pico de memória de cada etapa (memoria) "
+        "no _perfil_*.json de tempos da análise",
+    )
+    parser.add_argument(
+        "--exporta",
+        nargs="?",
+        const="auto",
+        choices=exportacao.FORMATOS,
+        help="grava também os dados agregados da análise em arquivos colunares tipados "
+        "(parquet/feather precisam do PyArrow; sem formato: parquet, ou colunar sem o PyArrow)",
+    )
+    parser.add_argument(
+        "--batch",
+        action="store_true",
+        help="modo não interativo: não pergunta nada nem pausa, falta de resposta é erro",
+    )
+    parser.add_argument(
+        "--periodo",
+        type=periodo_arg,
+        nargs="+",
+        default=[],
+        help="ID do período de apropriação, ou ultimo-aberto, ultimo-fechado, ultimo-fechado-1... "
+        "(vários: cada análise roda para cada período)",
+    )
+    parser.add_argument(
+        "--periodo-inicial",
+        type=periodo_arg,
+        help="Tendencias: primeiro período do intervalo (o último é o de --periodo), "
+        "ex.: --periodo ultimo-fechado --periodo-inicial ultimo-fechado-23",
+    )
+    parser.add_argument("--lote", help="Sispre: nome do lote a executar")
+    parser.add_argument(
+        "--set",
+        dest="respostas",
+        action="append",
+        default=[],
+        metavar="CHAVE=VALOR",
+        help="resposta de uma pergunta ou caminho de um arquivo (ex.: --set MES=01 --set HHREAL=inputs/hh.txt)",
+    )
+    parser.add_argument(
+        "--job",
+        help="arquivo de tarefas (.json ou .toml) com as análises e respostas, implica --batch",
+    )
+    parser.add_argument(
+        "--paralelo",
+        type=int,
+        default=None,
+        help="quantidade de análises executadas ao mesmo tempo (padrão: 4)",
+    )
+    parser.add_argument(
+        "--servico",
+        action="store_true",
+        help="modo serviço: servidor HTTP local com as análises e o cache de referência em memória",
+    )
+    parser.add_argument(
+        "--porta",
+        type=int,
+        default=8765,
+        help="--servico: porta do servidor HTTP, só em 127.0.0.1 (padrão: 8765)",
+    )
+    return parser.parse_args(argv)
+
+
+def respostas_da_linha_de_comando(respostas) -> dict:
+    r = {}
+    for item in respostas:
+        chave, sep, valor = item.partition("=")
+        if not sep or not chave.strip():
+            raise Exception(f'Resposta inválida "{item}", use CHAVE=VALOR')
+        r[chave.strip()] = valor
+    return r
 
 
 if __name__ == "__main__":
+    args = parse_args(sys.argv[1:])
+
+    if args.refresh:
+        sqlcache.refresh = True
+
     z = SisposRunner()
 
-    chosen_analysis_name = ""
-    if len(sys.argv) == 2:
-        chosen_analysis_name = sys.argv[1].strip()
+    chosen_analysis_names = [a.strip() for a in args.analise if a.strip()]
 
     try:
-        z.run(chosen_analysis_name)
+        options = monta_options(
+            {
+                "periodo": args.periodo[0] if len(args.periodo) == 1 else None,
+                "periodo_inicial": args.periodo_inicial,
+                "lote": args.lote,
+                "respostas": respostas_da_linha_de_comando(args.respostas),
+                "run": args.run,
+                "jobs": args.jobs,
+                "refresh": args.refresh,
+                "incremental": args.incremental,
+                "perfil": args.perfil,
+                "exporta": args.exporta,
+            },
+            batch=args.batch or bool(args.job),
+        )
+
+        resultados = None
+        if args.servico:
+            # Importado só aqui, para não pesar na inicialização de uma análise só
+            from sisposbase.servico import serve
+
+            serve(z.menu, args.porta, {k: options[k] for k in ("run", "jobs") if k in options})
+        elif args.job:
+            # Roda todas as análises do arquivo de tarefas, em paralelo
+            resultados = z.run_tarefas(le_tarefas(args.job, options), args.paralelo)
+        elif len(chosen_analysis_names) > 1 or len(args.periodo) > 1:
+            resultados = z.run_many(chosen_analysis_names, args.periodo, options, args.paralelo)
+        else:
+            z.run(chosen_analysis_names[0] if chosen_analysis_names else "", options)
+
+        if resultados is not None and not all(r.ok for r in resultados):
+            exit(1)
     except Exception as e:
         print("")
         print(f"Erro Fatal: {e}")
@@ -0,0 +1,85 @@
+# -*- coding: windows-1252 -*-
+"""
+Agrupamento das linhas de um relatrio em uma nica passada.
+
+Monta um ndice em rvore (ex.: OS -> profisso -> linhas) com os totais de
+cada nvel acumulados enquanto as linhas so lidas, em vez de varrer a lista
+inteira de novo para cada OS, cada profisso e cada soma.
+
+Exemplo:
+    arvore = agrupa(fs, chaves=(0, 1), valor=5)
+    for os in arvore:                  # grupos em ordem de chave
+        for profissao in os:
+            profissao.linhas           # linhas na ordem original do arquivo
+            profissao.total            # soma de x[5]
+        os.total
+"""
+
+
+class Grupo:
+    """Um nvel da rvore: subgrupos por chave, linhas (s nas folhas) e total acumulado."""
+
+    __slots__ = ("chave", "filhos", "linhas", "total")
+
+    def __init__(self, chave=None):
+        self.chave = chave
+        self.filhos = {}
+        self.linhas = []
+        self.total = 0
+
+    def __getitem__(self, chave):
+        return self.filhos[chave]
+
+    def __contains__(self, chave):
+        return chave in self.filhos
+
+    def __len__(self):
+        return len(self.filhos)
+
+    def __iter__(self):
+        """Itera os subgrupos ordenados pela chave."""
+        for chave in sorted(self.filhos):
+            yield self.filhos[chave]
+
+    def chaves(self) -> list:
+        return sorted(self.filhos)
+
+    def __repr__(self):
+        return "Grupo({!r}, total={!r}, {} subgrupo(s), {} linha(s))".format(
+            self.chave, self.total, len(self.filhos), len(self.linhas)
+        )
+
+
+def _campo(chave):
+    # Aceita o ndice do campo ou uma funo que recebe a linha.
+    if callable(chave):
+        return chave
+    return lambda linha: linha[chave]
+
+
+def agrupa(linhas, chaves, valor=None) -> Grupo:
+    """Agrupa as linhas pelos campos em `chaves`, na ordem dada, numa s passada.
+
+    chaves: ndices dos campos (ou funes linha -> chave), do nvel mais alto ao mais baixo.
+    valor: ndice (ou funo) do valor somado em todos os nveis; None no soma nada.
+    """
+    funcoes = [_campo(c) for c in chaves]
+    fvalor = _campo(valor) if valor is not None else None
+
+    raiz = Grupo()
+    for linha in linhas:
+        v = fvalor(linha) if fvalor else 0
+
+        grupo = raiz
+        grupo.total += v
+        for f in funcoes:
+            chave = f(linha)
+            filho = grupo.filhos.get(chave)
+            if filho is None:
+                filho = grupo.filhos[chave] = Grupo(chave)
+            grupo = filho
+            grupo.total += v
+
+        grupo.linhas.append(linha)
+
+    return raiz
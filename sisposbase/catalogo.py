@@ -0,0 +1,254 @@
+# -*- coding: windows-1252 -*-
+"""
+Catlogo local dos perodos de apropriao (cache/periodos.json).
+
+Guarda a lista de perodos do ListaPeriodosConsole.exe e os parmetros de cada
+perodo (dias teis e feriados, de get_periodo_additional_data), para no
+rodar o executvel e a consulta a cada anlise:
+
+  - perodos fechados no mudam mais: ficam no catlogo para sempre;
+  - a lista s  buscada de novo se pedirem um perodo desconhecido, ou um
+    perodo aberto com a lista mais velha que SISPOS_CACHE_TTL segundos
+    (um perodo aberto pode ter sido fechado);
+  - os parmetros de um perodo aberto tambm expiram depois desse tempo.
+
+Alm do ID, o perodo pode ser escolhido por seletor (ver seleciona()):
+
+  ultimo-aberto      o perodo aberto mais recente
+  ultimo-fechado     o perodo fechado mais recente (ou "anterior-fechado")
+  ultimo-fechado-1   o fechado antes dele, e assim por diante
+
+Segue o cache de consultas: SISPOS_CACHE=0 no grava nada em disco,
+--refresh busca tudo de novo (uma vez por execuo) e o catlogo gravado
+por outro banco (sqlcache.banco_atual())  descartado.
+"""
+import datetime
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+
+from sisposbase import sqlcache
+from sisposbase.get_sql_data import (
+    FeriadoTuple,
+    get_periodo_additional_data,
+    lista_periodos,
+    periodo_fechado,
+)
+
+CATALOGOPATH = os.path.join(os.getcwd(), "cache", "periodos.json")
+
+# Seletores: nome -> situao procurada (fechado?)
+SELETORES = {
+    "ultimo-aberto": False,
+    "ultimo-fechado": True,
+    "anterior-fechado": True,
+}
+
+
+def eh_seletor(texto) -> bool:
+    return _seletor(texto) is not None
+
+
+def _seletor(texto):
+    m = re.match(r"^([a-z-]+?)(?:-([0-9]+))?$", str(texto).strip().lower())
+    if m is None or m.group(1) not in SELETORES:
+        return None
+    return SELETORES[m.group(1)], int(m.group(2) or 0)
+
+
+class CatalogoDePeriodos:
+    def __init__(self, caminho=CATALOGOPATH, ttl=None, persistente=None):
+        self.caminho = caminho
+        self.ttl = sqlcache.ttl_aberto if ttl is None else ttl
+        self.persistente = sqlcache.ativo if persistente is None else persistente
+        self.banco = sqlcache.banco_atual()
+
+        self._lock = threading.Lock()
+        # Entradas j buscadas de novo nesta execuo (--refresh)
+        self._renovados = set()
+
+        self._dados = self._carrega()
+
+        # Informa ao cache de consultas quais perodos j foram fechados
+        for perid, p in self._dados["periodos"].items():
+            sqlcache.marca_periodo(perid, p["fechado"])
+
+    def _carrega(self) -> dict:
+        vazio = {"listado": 0, "periodos": {}, "parametros": {}, "banco": self.banco}
+        if not self.persistente:
+            return vazio
+        try:
+            with open(self.caminho, "r", encoding="utf-8") as f:
+                dados = json.load(f)
+            # De outro banco (ou de antes de guardarmos o banco): comea de novo
+            if set(vazio) <= set(dados) and dados["banco"] == self.banco:
+                return dados
+        except (OSError, ValueError):
+            pass
+        return vazio
+
+    def _grava(self):
+        if not self.persistente:
+            return
+        pasta = os.path.dirname(self.caminho)
+        os.makedirs(pasta, exist_ok=True)
+        fd, tmppath = tempfile.mkstemp(dir=pasta, suffix=".tmp")
+        try:
+            with open(fd, "w", encoding="utf-8") as f:
+                json.dump(self._dados, f, ensure_ascii=False, indent=1)
+            os.replace(tmppath, self.caminho)
+        finally:
+            if os.path.exists(tmppath):
+                os.remove(tmppath)
+
+    def _expirou(self, chave, criado, fechado=False) -> bool:
+        if sqlcache.refresh and chave not in self._renovados:
+            return True
+        if fechado:
+            return False
+        return (time.time() - criado) > self.ttl
+
+    def atualiza(self, forca=False) -> bool:
+        """Busca a lista de perodos de novo, se estiver vencida (ou se `forca`)."""
+        if not forca and not self._expirou("lista", self._dados["listado"]):
+            return False
+
+        _, dbd = lista_periodos()
+
+        with self._lock:
+            periodos = self._dados["periodos"]
+            for perid, (mes, ano, status, dtini, dtfim) in dbd.items():
+                chave = str(perid)
+                novo = {
+                    "mes": mes,
+                    "ano": ano,
+                    "status": status,
+                    "dtini": dtini,
+                    "dtfim": dtfim,
+                    "fechado": periodo_fechado(status),
+                }
+                antes = periodos.get(chave)
+                if antes is not None and antes["fechado"] != novo["fechado"]:
+                    # Fechou (ou reabriu) desde a ltima vez: parmetros podem ter mudado
+                    self._dados["parametros"].pop(chave, None)
+                periodos[chave] = novo
+
+            self._dados["listado"] = time.time()
+            self._renovados.add("lista")
+            self._grava()
+        return True
+
+    def expira_abertos(self):
+        """Fora buscar de novo a lista e os parmetros dos perodos abertos."""
+        with self._lock:
+            self._dados["listado"] = 0
+            for chave, p in self._dados["periodos"].items():
+                if not p["fechado"]:
+                    self._dados["parametros"].pop(chave, None)
+            self._grava()
+
+    def periodos(self) -> dict:
+        """{id: (mes, ano, status, dtini, dtfim)}, como em lista_periodos()."""
+        self.atualiza()
+        return {
+            int(k): (p["mes"], p["ano"], p["status"], p["dtini"], p["dtfim"])
+            for k, p in self._dados["periodos"].items()
+        }
+
+    def periodo(self, periodoid):
+        """(mes, ano, status, dtini, dtfim) do perodo, ou None se ele no existir.
+
+        S roda o ListaPeriodosConsole.exe para um perodo desconhecido ou aberto.
+        """
+        chave = str(int(periodoid))
+        p = self._dados["periodos"].get(chave)
+        if p is None:
+            self.atualiza(forca=True)
+        elif not p["fechado"]:
+            self.atualiza()
+
+        p = self._dados["periodos"].get(chave)
+        if p is None:
+            return None
+        return p["mes"], p["ano"], p["status"], p["dtini"], p["dtfim"]
+
+    def parametros(self, periodoid):
+        """O mesmo que get_periodo_additional_data(): (dias_uteis, dias_1, dias_2)."""
+        periodoid = int(periodoid)
+        chave = str(periodoid)
+
+        if self.periodo(periodoid) is None:
+            raise Exception(f"Perodo {periodoid} no existe")
+        fechado = self._dados["periodos"][chave]["fechado"]
+
+        e = self._dados["parametros"].get(chave)
+        if e is None or self._expirou("parametros" + chave, e["criado"], fechado):
+            dias_uteis, dias_1, dias_2 = get_periodo_additional_data(periodoid)
+            e = {
+                "criado": time.time(),
+                "dias_uteis": dias_uteis,
+                "feriados": [
+                    [f.dia.strftime("%d/%m/%Y"), f.descricao, f.tipohora] for f in dias_1 + dias_2
+                ],
+            }
+            with self._lock:
+                self._dados["parametros"][chave] = e
+                self._renovados.add("parametros" + chave)
+                self._grava()
+
+        feriados = [
+            FeriadoTuple(datetime.datetime.strptime(dia, "%d/%m/%Y"), descricao, tipohora)
+            for dia, descricao, tipohora in e["feriados"]
+        ]
+        dias_1 = [f for f in feriados if f.tipohora == 1]
+        dias_2 = [f for f in feriados if f.tipohora == 2]
+        return e["dias_uteis"], dias_1, dias_2
+
+    def seleciona(self, seletor) -> int:
+        """ID do perodo: o prprio ID (nmero) ou um seletor ("ultimo-aberto", "ultimo-fechado-1"...)."""
+        texto = str(seletor).strip()
+        if texto.isdigit():
+            return int(texto)
+
+        s = _seletor(texto)
+        if s is None:
+            raise Exception(
+                f'Perodo invlido "{texto}": use o ID ou um de {", ".join(SELETORES)} (ex.: ultimo-fechado-1)'
+            )
+        fechado, anteriores = s
+
+        # Do mais recente para o mais antigo
+        candidatos = sorted(
+            (
+                (int(ano), int(mes), perid)
+                for perid, (mes, ano, status, _, _) in self.periodos().items()
+                if periodo_fechado(status) == fechado
+            ),
+            reverse=True,
+        )
+        if anteriores >= len(candidatos):
+            raise Exception(f'Nenhum perodo para o seletor "{texto}"')
+        return candidatos[anteriores][2]
+
+    def texto(self) -> str:
+        """Lista dos perodos, no formato do ListaPeriodosConsole.exe."""
+        linhas = []
+        for perid, (mes, ano, status, dtini, dtfim) in sorted(self.periodos().items()):
+            linhas.append(f"ID={perid}  [{mes}/{ano}] [{status}] de {dtini} at {dtfim}")
+        return "\n".join(linhas)
+
+
+_padrao = None
+_padrao_lock = threading.Lock()
+
+
+def catalogo_padrao() -> CatalogoDePeriodos:
+    """O catlogo do processo (cache/periodos.json do diretrio atual)."""
+    global _padrao
+    with _padrao_lock:
+        if _padrao is None:
+            _padrao = CatalogoDePeriodos()
+        return _padrao
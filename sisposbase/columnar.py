@@ -0,0 +1,395 @@
+# -*- coding: windows-1252 -*-
+"""
+Leitura colunar e tipada dos arquivos/result sets separados por "|".
+
+Em vez de converter campo a campo em cada linha, as linhas so transpostas em
+colunas e cada coluna  convertida de uma vez: os valores distintos so
+convertidos uma nica vez e o resultado  espalhado para todas as linhas.
+Datas, horas e cdigos se repetem muito, ento isso reduz o trabalho a
+algumas centenas de converses por arquivo.
+
+As colunas numricas so devolvidas como arrays do NumPy, quando disponvel,
+ou como array.array da biblioteca padro.
+
+Exemplo:
+    schema = (("matricula", INT), ("data", DATA_DDMMAA), (None, None), ("horas", DECIMAL))
+    cols = le_colunas(linhas, schema)
+    cols["matricula"], cols["horas"]  # horas em ponto fixo (DECIMAL_ESCALA casas)
+
+Arquivos grandes podem ser lidos em blocos de linhas (le_blocos), assim s um
+bloco de campos em texto existe em memria por vez:
+    for cols in le_blocos(filefinder.LinhasMapeadas(caminho), schema):
+        ...
+
+As colunas podem ser gravadas num arquivo binrio compacto e lidas de volta
+sem converso nenhuma (grava_arquivo/le_arquivo, ver sisposbase.historico e
+sisposbase.exportacao).
+"""
+import datetime
+import json
+import sys
+import zlib
+from array import array
+from decimal import ROUND_HALF_EVEN, Decimal
+from itertools import islice
+
+try:
+    # NumPy  opcional, sem ele usamos array.array
+    import numpy
+except ImportError:
+    numpy = None
+
+# Tipos de coluna
+INT = "int"
+FLOAT = "float"
+DECIMAL = "decimal"  # decimal com vrgula ou ponto, guardado em ponto fixo
+DATA_DDMMAA = "dd/mm/yy"
+DATA_DDMMAAAA = "dd/mm/yyyy"
+STR = "str"
+
+# Casas decimais do ponto fixo das colunas DECIMAL (o SQL Server devolve 6 casas em qtdHoraMin/60.0)
+DECIMAL_ESCALA = 6
+
+# Linhas por bloco em le_blocos()
+TAMANHO_BLOCO = 50000
+
+
+def _int(valor: str) -> int:
+    try:
+        return int(valor)
+    except ValueError:
+        # "1.0", "1,0"
+        return int(float(valor.replace(",", ".")))
+
+
+def _decimal(valor: str) -> int:
+    if not valor.strip():
+        return 0
+    # Mais de DECIMAL_ESCALA casas (ex.: "8,3333333" de uma planilha): arredonda "half even"
+    v = Decimal(valor.replace(",", ".")).scaleb(DECIMAL_ESCALA)
+    return int(v.to_integral_value(rounding=ROUND_HALF_EVEN))
+
+
+def _float(valor: str) -> float:
+    return float(valor.replace(",", "."))
+
+
+def _data(formato):
+    def conv(valor: str) -> int:
+        return datetime.datetime.strptime(valor.strip(), formato).toordinal()
+
+    return conv
+
+
+_conversores = {
+    INT: (_int, "q"),
+    FLOAT: (_float, "d"),
+    DECIMAL: (_decimal, "q"),
+    DATA_DDMMAA: (_data("%d/%m/%y"), "l"),
+    DATA_DDMMAAAA: (_data("%d/%m/%Y"), "l"),
+}
+
+
+def converte_coluna(valores, tipo):
+    """Converte uma sequncia de strings para o tipo dado, convertendo cada valor distinto uma s vez."""
+    if tipo == STR:
+        # Uma s cpia de cada texto repetido (as linhas podem ficar guardadas, ex.: agrupa())
+        memo = {}
+        return [memo.setdefault(v, v) for v in valores]
+
+    conv, typecode = _conversores[tipo]
+
+    if numpy is not None:
+        distintos, indices = numpy.unique(numpy.asarray(valores, dtype=object).astype(str), return_inverse=True)
+        convertidos = numpy.array([conv(v) for v in distintos], dtype="f8" if typecode == "d" else "i8")
+        return convertidos[indices]
+
+    memo = {}
+    for v in valores:
+        if v not in memo:
+            memo[v] = conv(v)
+    return array(typecode, map(memo.__getitem__, valores))
+
+
+def data_de_ordinal(ordinal) -> datetime.datetime:
+    """Converte de volta o valor de uma coluna de data para datetime."""
+    return datetime.datetime.fromordinal(int(ordinal))
+
+
+def decimal_de_fixo(valor) -> Decimal:
+    """Converte de volta o valor de uma coluna DECIMAL para Decimal."""
+    return Decimal(int(valor)).scaleb(-DECIMAL_ESCALA)
+
+
+class Colunas(dict):
+    """Dicionrio nome -> coluna, todas com o mesmo comprimento (tipos: nome -> tipo do schema)."""
+
+    def __init__(self, nomes, colunas, tipos=None):
+        super().__init__(zip(nomes, colunas))
+        self.nomes = list(nomes)
+        self.tipos = dict(zip(self.nomes, tipos or ()))
+        # Metadados de quem gravou (ver grava_arquivo/le_arquivo)
+        self.extra = {}
+
+    def __len__(self):
+        return len(self[self.nomes[0]]) if self.nomes else 0
+
+    def linhas(self, *nomes):
+        """Itera as linhas como tuplas (todas as colunas, ou s as pedidas), com tipos do Python."""
+        colunas = [self[n] for n in (nomes or self.nomes)]
+        if numpy is not None:
+            colunas = [c.tolist() if isinstance(c, numpy.ndarray) else c for c in colunas]
+        return zip(*colunas)
+
+
+def colunas_de_registros(registros, schema, cabecalho=True) -> Colunas:
+    """Monta as colunas tipadas a partir de linhas j separadas em campos.
+
+    schema: sequncia de (nome, tipo), na ordem dos campos; nome None ignora o campo.
+    cabecalho: a primeira linha  o cabealho e  descartada.
+    """
+    registros = iter(registros)
+    if cabecalho:
+        next(registros, None)
+
+    # Transpe linhas -> colunas (descarta campos alm do schema)
+    campos = list(zip(*registros))
+
+    nomes = []
+    colunas = []
+    tipos = []
+    for pos, (nome, tipo) in enumerate(schema):
+        if nome is None:
+            continue
+        valores = campos[pos] if pos < len(campos) else ()
+        nomes.append(nome)
+        colunas.append(converte_coluna(valores, tipo))
+        tipos.append(tipo)
+
+    return Colunas(nomes, colunas, tipos)
+
+
+def colunas_de_valores(linhas, schema) -> Colunas:
+    """Monta as colunas tipadas a partir de linhas com valores j convertidos (no texto).
+
+    Os valores seguem os tipos das colunas: horas em ponto fixo (DECIMAL),
+    datas em ordinal (ver data_de_ordinal), nmeros e textos. Serve para
+    guardar dados calculados, ex.: os totais de uma anlise (sisposbase.exportacao).
+    """
+    campos = list(zip(*linhas))
+
+    nomes = []
+    colunas = []
+    tipos = []
+    for pos, (nome, tipo) in enumerate(schema):
+        if nome is None:
+            continue
+        valores = campos[pos] if pos < len(campos) else ()
+        if tipo == STR:
+            coluna = list(valores)
+        else:
+            typecode = _conversores[tipo][1]
+            if numpy is not None:
+                coluna = numpy.array(valores, dtype="f8" if typecode == "d" else "i8")
+            else:
+                coluna = array(typecode, valores)
+        nomes.append(nome)
+        colunas.append(coluna)
+        tipos.append(tipo)
+
+    return Colunas(nomes, colunas, tipos)
+
+
+def blocos_de_registros(registros, schema, cabecalho=True, tamanho=None):
+    """Como colunas_de_registros(), mas gera um Colunas para cada bloco de at `tamanho` linhas."""
+    registros = iter(registros)
+    if cabecalho:
+        next(registros, None)
+
+    while True:
+        bloco = list(islice(registros, tamanho or TAMANHO_BLOCO))
+        if not bloco:
+            return
+        yield colunas_de_registros(bloco, schema, cabecalho=False)
+
+
+def _registros(linhas, sep):
+    if isinstance(linhas, bytes):
+        linhas = linhas.decode("windows-1252")
+    if isinstance(linhas, str):
+        linhas = linhas.strip().split("\n")
+
+    return (x.rstrip("\r\n").split(sep) for x in linhas if x.strip())
+
+
+def le_colunas(linhas, schema, sep="|", cabecalho=True) -> Colunas:
+    """L linhas de texto separadas por `sep` (str, bytes em windows-1252 ou itervel de linhas)."""
+    return colunas_de_registros(_registros(linhas, sep), schema, cabecalho=cabecalho)
+
+
+def le_blocos(linhas, schema, sep="|", cabecalho=True, tamanho=None):
+    """Como le_colunas(), mas em blocos de at `tamanho` linhas (padro: TAMANHO_BLOCO).
+
+    Com um itervel de linhas (ex.: filefinder.LinhasMapeadas) o arquivo  lido aos poucos.
+    """
+    return blocos_de_registros(_registros(linhas, sep), schema, cabecalho, tamanho)
+
+
+def concatena(lista, indice=None) -> Colunas:
+    """Junta vrios Colunas com as mesmas colunas (ex.: um por perodo) num s.
+
+    indice: nome de uma coluna a mais, com a posio em `lista` de onde veio cada linha.
+    """
+    lista = list(lista)
+    if not lista:
+        return Colunas((indice,) if indice else (), (array("q"),) if indice else (), (INT,))
+
+    primeiro = lista[0]
+    colunas = []
+    for nome in primeiro.nomes:
+        partes = [c[nome] for c in lista]
+        if numpy is not None and isinstance(partes[0], numpy.ndarray):
+            colunas.append(numpy.concatenate(partes))
+        else:
+            junta = partes[0][:0]
+            for p in partes:
+                junta += p
+            colunas.append(junta)
+    retval = Colunas(primeiro.nomes, colunas, [primeiro.tipos.get(n) for n in primeiro.nomes])
+
+    if indice:
+        tamanhos = [len(c) for c in lista]
+        if numpy is not None:
+            retval[indice] = numpy.repeat(numpy.arange(len(lista), dtype="i8"), tamanhos)
+        else:
+            retval[indice] = array("q", [i for i, t in enumerate(tamanhos) for _ in range(t)])
+        retval.nomes.append(indice)
+        retval.tipos[indice] = INT
+    return retval
+
+
+def fatoriza(*colunas):
+    """(cdigos, distintos) das linhas de uma ou mais colunas.
+
+    distintos: as combinaes distintas dos valores (tuplas, ou valores se for uma
+    coluna s); cdigos: para cada linha, o ndice da sua combinao em distintos.
+    Assim uma classificao (ex.: cargo/depto -> categoria)  feita uma vez por
+    valor distinto e espalhada para as linhas pelos cdigos.
+    """
+    n = len(colunas[0]) if colunas else 0
+
+    if numpy is not None and n:
+        valores = [numpy.asarray(c) for c in colunas]
+        codigos = numpy.zeros(n, dtype="i8")
+        for v in valores:
+            # Cdigo da combinao at esta coluna, renumerado para no crescer
+            unicos, indices = numpy.unique(v, return_inverse=True)
+            combinado = codigos * len(unicos) + indices.reshape(-1)
+            _, primeiras, codigos = numpy.unique(combinado, return_index=True, return_inverse=True)
+            codigos = codigos.reshape(-1)
+        distintos = [tuple(v[i].item() for v in valores) for i in primeiras.tolist()]
+    else:
+        memo = {}
+        codigos = array("q", [memo.setdefault(chave, len(memo)) for chave in zip(*colunas)])
+        distintos = list(memo)
+
+    if len(colunas) == 1:
+        distintos = [d[0] for d in distintos]
+    return codigos, distintos
+
+
+def espalha(codigos, valores):
+    """O valor de cada cdigo para as linhas: [valores[c] for c in codigos], como coluna."""
+    if numpy is not None:
+        return numpy.asarray(valores)[numpy.asarray(codigos, dtype="i8")]
+    if all(isinstance(v, int) for v in valores):
+        return array("q", map(valores.__getitem__, codigos))
+    return list(map(valores.__getitem__, codigos))
+
+
+# ----------------------------------------------------------------------
+# Arquivo colunar: uma linha de identificao, uma linha com o cabealho em
+# JSON e depois os dados de cada coluna, comprimidos com zlib. Nmeros em
+# inteiros/doubles de 8 bytes little-endian; textos como ndices (4 bytes)
+# numa lista dos valores distintos, que fica no cabealho.
+# ----------------------------------------------------------------------
+
+ASSINATURA_ARQUIVO = b"SISPOSCOL 1\n"
+
+_formatos = {"q": "<i8", "d": "<f8", "i": "<i4"}
+
+
+def _bytes_da_coluna(coluna, typecode):
+    if numpy is not None:
+        return numpy.ascontiguousarray(coluna, dtype=_formatos[typecode]).tobytes()
+    a = array(typecode, coluna)
+    if sys.byteorder == "big":
+        a.byteswap()
+    return a.tobytes()
+
+
+def _coluna_dos_bytes(dados, typecode, typecode_final):
+    if numpy is not None:
+        return numpy.frombuffer(dados, dtype=_formatos[typecode]).astype("f8" if typecode == "d" else "i8")
+    a = array(typecode)
+    a.frombytes(dados)
+    if sys.byteorder == "big":
+        a.byteswap()
+    return a if typecode == typecode_final else array(typecode_final, a)
+
+
+def grava_arquivo(destino, colunas: Colunas, extra=None):
+    """Grava as colunas (com os tipos do schema) no arquivo colunar; extra: dicionrio que vai no cabealho.
+
+    destino: caminho ou arquivo binrio j aberto (que continua aberto).
+    """
+    cabecalho = {"linhas": len(colunas), "extra": extra or {}, "colunas": []}
+    blocos = []
+    for nome in colunas.nomes:
+        tipo = colunas.tipos.get(nome) or STR
+        if tipo == STR:
+            codigos, distintos = fatoriza(colunas[nome])
+            dados = _bytes_da_coluna(codigos, "i")
+            cabecalho["colunas"].append({"nome": nome, "tipo": tipo, "valores": distintos})
+        else:
+            dados = _bytes_da_coluna(colunas[nome], "d" if tipo == FLOAT else "q")
+            cabecalho["colunas"].append({"nome": nome, "tipo": tipo})
+        dados = zlib.compress(dados, 1)
+        cabecalho["colunas"][-1]["bytes"] = len(dados)
+        blocos.append(dados)
+
+    if not hasattr(destino, "write"):
+        with open(destino, "wb") as f:
+            return grava_arquivo(f, colunas, extra)
+
+    destino.write(ASSINATURA_ARQUIVO)
+    destino.write(json.dumps(cabecalho, ensure_ascii=False).encode("utf-8") + b"\n")
+    for dados in blocos:
+        destino.write(dados)
+
+
+def le_arquivo(caminho) -> Colunas:
+    """L o arquivo gravado por grava_arquivo(), com o "extra" do cabealho em Colunas.extra."""
+    with open(caminho, "rb") as f:
+        if f.readline() != ASSINATURA_ARQUIVO:
+            raise ValueError(f"{caminho} no  um arquivo colunar do SISPOS")
+        cabecalho = json.loads(f.readline().decode("utf-8"))
+
+        nomes, colunas, tipos = [], [], []
+        for c in cabecalho["colunas"]:
+            dados = zlib.decompress(f.read(c["bytes"]))
+            tipo = c["tipo"]
+            if tipo == STR:
+                valores = c["valores"]
+                coluna = [valores[i] for i in _coluna_dos_bytes(dados, "i", "i").tolist()]
+            elif tipo == FLOAT:
+                coluna = _coluna_dos_bytes(dados, "d", "d")
+            else:
+                coluna = _coluna_dos_bytes(dados, "q", _conversores[tipo][1])
+            nomes.append(c["nome"])
+            colunas.append(coluna)
+            tipos.append(tipo)
+
+    retval = Colunas(nomes, colunas, tipos)
+    retval.extra = cabecalho.get("extra", {})
+    return retval
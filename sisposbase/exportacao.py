@@ -0,0 +1,103 @@
+# -*- coding: windows-1252 -*-
+"""
+Exportao dos dados agregados das anlises em arquivos colunares tipados (--exporta).
+
+Os relatrios (txt, csv com vrgula decimal, html) so para ler; para outros
+programas cada anlise grava tambm os dados que agregou (ex.: jdata/jdata2 do
+HHReal, totais por setor do IOMO, erros das Crticas) em colunas tipadas, que
+so lidas sem converter texto nenhum:
+
+  parquet  Apache Parquet (precisa do PyArrow)
+  feather  Arrow IPC / Feather v2 (precisa do PyArrow)
+  colunar  o arquivo colunar do SISPOS, sem dependncias (columnar.le_arquivo)
+  auto     parquet se o PyArrow estiver instalado, seno colunar
+
+No Parquet/Feather: INT em int64, FLOAT em float64, DECIMAL (horas em ponto
+fixo) em decimal128(18, 6), datas em date32 e textos em string. Os metadados
+(anlise, perodo...) vo nos metadados do schema, em JSON na chave "sispos";
+no colunar, em Colunas.extra.
+
+Exemplo (pandas):
+    pandas.read_parquet("outputs/HHReal_jdata_01-2013_5.parquet")
+"""
+import datetime
+import importlib.util
+import json
+
+from sisposbase import horas
+from sisposbase.columnar import DATA_DDMMAA, DATA_DDMMAAAA, DECIMAL, DECIMAL_ESCALA, FLOAT, STR, grava_arquivo
+
+FORMATOS = ("auto", "parquet", "feather", "colunar")
+
+# Extenso dos arquivos de cada formato
+EXTENSOES = {"parquet": "parquet", "feather": "feather", "colunar": "col"}
+
+# Formatos pedidos sem o PyArrow, j avisados
+_avisados = set()
+
+
+def tem_pyarrow() -> bool:
+    """Diz se o PyArrow (opcional) est instalado, sem import-lo: ele s  importado
+    na hora de gravar, para no pesar na inicializao."""
+    return importlib.util.find_spec("pyarrow") is not None
+
+
+def formato_disponivel(pedido: str) -> str:
+    """O formato que ser gravado para o `pedido` (um de FORMATOS), conforme o PyArrow esteja instalado."""
+    if pedido not in FORMATOS:
+        raise Exception(f"Formato de exportao desconhecido: {pedido} (use {', '.join(FORMATOS)})")
+
+    if pedido == "auto":
+        return "parquet" if tem_pyarrow() else "colunar"
+
+    if pedido != "colunar" and not tem_pyarrow():
+        if pedido not in _avisados:
+            _avisados.add(pedido)
+            print(f"Aviso: PyArrow no est instalado, exportando no formato colunar do SISPOS em vez de {pedido}.")
+        return "colunar"
+
+    return pedido
+
+
+def _array_arrow(coluna, tipo):
+    import pyarrow
+
+    if tipo == STR:
+        return pyarrow.array(list(coluna), type=pyarrow.string())
+    if tipo == DECIMAL:
+        return pyarrow.array(
+            [horas.para_decimal(v) for v in coluna], type=pyarrow.decimal128(18, DECIMAL_ESCALA)
+        )
+    if tipo in (DATA_DDMMAA, DATA_DDMMAAAA):
+        return pyarrow.array(
+            [datetime.date.fromordinal(int(v)) for v in coluna], type=pyarrow.date32()
+        )
+    if tipo == FLOAT:
+        return pyarrow.array(coluna, type=pyarrow.float64())
+    return pyarrow.array(coluna, type=pyarrow.int64())
+
+
+def tabela_arrow(colunas, extra=None):
+    """As colunas (com os tipos do schema) numa pyarrow.Table, com o `extra` nos metadados."""
+    import pyarrow
+
+    tabela = pyarrow.table(
+        {nome: _array_arrow(colunas[nome], colunas.tipos.get(nome) or STR) for nome in colunas.nomes}
+    )
+    return tabela.replace_schema_metadata({"sispos": json.dumps(extra or {}, ensure_ascii=False)})
+
+
+def grava(destino, colunas, formato="colunar", extra=None):
+    """Grava as colunas no formato dado (ver formato_disponivel); destino: caminho ou arquivo binrio aberto."""
+    if formato == "colunar":
+        grava_arquivo(destino, colunas, extra)
+    elif formato == "parquet":
+        import pyarrow.parquet
+
+        pyarrow.parquet.write_table(tabela_arrow(colunas, extra), destino)
+    elif formato == "feather":
+        import pyarrow.feather
+
+        pyarrow.feather.write_feather(tabela_arrow(colunas, extra), destino)
+    else:
+        raise Exception(f"Formato de exportao desconhecido: {formato}")
@@ -3,16 +3,153 @@
 import os
 import re
 import locale
+import mmap
+import threading
+import time
+from collections import namedtuple
 
-def findfile(_searchdirectory, idname, regexp):
+
+class LinhasMapeadas:
+    """Arquivo de entrada mapeado em memria (mmap), decodificado linha a linha sob demanda.
+
+    Nada  lido antes de algum iterar, e s a linha da vez existe decodificada:
+    exportaes de vrios anos ocupam pouca memria. Pode ser iterado vrias vezes.
+    """
+
+    def __init__(self, caminho, encoding="windows-1252"):
+        self.caminho = caminho
+        self.encoding = encoding
+        self.tamanho = os.path.getsize(caminho)
+
+    def __bool__(self):
+        # Como os bytes do arquivo inteiro: vazio  falso
+        return self.tamanho > 0
+
+    def __iter__(self):
+        if not self.tamanho:
+            return
+        with open(self.caminho, 'rb') as ff, mmap.mmap(ff.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for linha in iter(mm.readline, b''):
+                yield linha.decode(self.encoding)
+
+    def __bytes__(self):
+        with open(self.caminho, 'rb') as ff:
+            return ff.read()
+
+
+# Arquivo de entrada conhecido pelo ndice; periodo = (mes, ano com 2 dgitos) ou None
+Entrada = namedtuple("Entrada", "nome caminho tamanho mtime periodo")
+
+# MMAA no nome do arquivo (HTIPO0GXX1012.TXT, hhreal_0113.txt), ou MM-AAAA (hhreal_01-2013.txt)
+_periodo_re = re.compile(r"(?<![0-9])(0[1-9]|1[0-2])(?:[-_.]?20)?([0-9]{2})(?![0-9])")
+
+def detecta_periodo(nome):
+    """(mes, ano com 2 dgitos) do perodo no nome do arquivo, ou None."""
+    achados = _periodo_re.findall(os.path.splitext(nome)[0])
+    if not achados:
+        return None
+    mes, ano = achados[-1]
+    return int(mes), int(ano)
+
+class IndiceDeEntradas:
+    """Catlogo dos arquivos de uma pasta (nome, tamanho, mtime, perodo detectado).
+
+    A pasta s  varrida de novo quando muda (mtime da pasta), e as entradas que
+    no mudaram so reaproveitadas: achar vrios arquivos, para vrias anlises,
+    custa uma varredura s. Um arquivo regravado com o mesmo nome no muda o mtime
+    da pasta, ento os arquivos achados por procura() so conferidos um a um.
+    """
+
+    def __init__(self, pasta):
+        self.pasta = pasta
+        self.entradas = {}
+        self.varreduras = 0
+        self._mtime = None
+        self._lock = threading.Lock()
+
+    def atualiza(self):
+        with self._lock:
+            try:
+                mtime = os.stat(self.pasta).st_mtime_ns
+            except FileNotFoundError:
+                self.entradas, self._mtime = {}, None
+                return
+            if mtime == self._mtime:
+                return
+
+            novas = {}
+            with os.scandir(self.pasta) as it:
+                for de in it:
+                    if not de.is_file():
+                        continue
+                    st = de.stat()
+                    e = self.entradas.get(de.name)
+                    if e is None or e.tamanho != st.st_size or e.mtime != st.st_mtime:
+                        e = Entrada(de.name, de.path, st.st_size, st.st_mtime, detecta_periodo(de.name))
+                    novas[de.name] = e
+
+            self.entradas = novas
+            self.varreduras += 1
+            # Mtime de pasta tem resoluo grossa em alguns sistemas de arquivo: se a pasta
+            # acabou de mudar, no confia nele e varre de novo na prxima vez.
+            self._mtime = mtime if time.time() - mtime / 1e9 > 2 else None
+
+    def procura(self, regexp, periodo=None):
+        """Entradas cujo nome casa com `regexp`: as do `periodo` primeiro, depois as mais novas."""
+        self.atualiza()
+        compre = re.compile(regexp, re.IGNORECASE)
+        achados = self._confere([e for e in self.entradas.values() if compre.search(e.nome)])
+        achados.sort(key=lambda e: (periodo is not None and e.periodo != periodo, -e.mtime, e.nome))
+        return achados
+
+    def _confere(self, achados):
+        # Tamanho e mtime atuais de cada achado (so poucos); os que sumiram saem
+        conferidos = []
+        with self._lock:
+            for e in achados:
+                try:
+                    st = os.stat(e.caminho)
+                except FileNotFoundError:
+                    self.entradas.pop(e.nome, None)
+                    continue
+                if e.tamanho != st.st_size or e.mtime != st.st_mtime:
+                    e = self.entradas[e.nome] = e._replace(tamanho=st.st_size, mtime=st.st_mtime)
+                conferidos.append(e)
+        return conferidos
+
+    def escolhe(self, regexp, periodo):
+        """O arquivo mais novo do perodo que casa com `regexp`, ou None."""
+        achados = self.procura(regexp, periodo)
+        if achados and achados[0].periodo == periodo:
+            return achados[0]
+        return None
+
+_indices = {}
+_indices_lock = threading.Lock()
+
+def indice(pasta):
+    """O IndiceDeEntradas da pasta (um por pasta, por processo)."""
+    with _indices_lock:
+        chave = os.path.abspath(pasta)
+        if chave not in _indices:
+            _indices[chave] = IndiceDeEntradas(chave)
+        return _indices[chave]
+
+def findfile(_searchdirectory, idname, regexp, periodo=None):
     searchdirectory = _searchdirectory
     retval = ""
     print("Procurando por %s dentro de \"%s\"..." % (idname.upper(), searchdirectory))
-    flist = os.listdir(searchdirectory)
-    flist.sort()
-    compre = re.compile(regexp, re.IGNORECASE)
-    arqs = [os.path.join(searchdirectory,a) for a in flist if os.path.isfile(os.path.join(searchdirectory,a))]
-    matches = filter(lambda x: compre.search(os.path.basename(x)), arqs)
+    achados = indice(searchdirectory).procura(regexp, periodo)
+
+    # O mais recente do perodo vem sugerido: basta confirmar
+    if achados and periodo is not None and achados[0].periodo == periodo:
+        sugerido = achados.pop(0)
+        question = f' O arquivo {idname.upper()}  o {sugerido.nome} (o mais recente de {periodo[0]:02}/{periodo[1]:02})? [S/n]:'
+        print(question, end=' ')
+        if input().upper() != "N":
+            return sugerido.caminho
+
+    matches = [e.caminho for e in achados]
 
     for fname in matches:
         #question = " O arquivo {idname.upper()}"
@@ -27,15 +164,29 @@ def findfile(_searchdirectory, idname, regexp):
 
     return retval
 
-def findfilel(searchdirectory, idname, regexp):
+def _le(fpath, encoding=None):
+    # Sem encoding, o arquivo inteiro em bytes; com, as linhas sob demanda
+    if encoding:
+        return LinhasMapeadas(fpath, encoding)
+    with open(fpath, 'rb') as ff:
+        return ff.read()
+
+def loadfile(searchdirectory, idname, fpath, encoding=None):
+    """Reads a file given beforehand (non-interactive mode), without asking anything."""
+    if not os.path.isabs(fpath) and not os.path.isfile(fpath):
+        fpath = os.path.join(searchdirectory, fpath)
+    if not os.path.isfile(fpath):
+        raise FileNotFoundError(fpath)
+
+    print("Usando %s --> \"%s\"" % (idname.upper(), fpath))
+    return [fpath, _le(fpath, encoding)]
+
+def findfilel(searchdirectory, idname, regexp, encoding=None, periodo=None):
     retval = ['', '']
-    ffrv = findfile(searchdirectory, idname, regexp)
+    ffrv = findfile(searchdirectory, idname, regexp, periodo)
     if ffrv:
-        ff = open(ffrv, 'rb')
-        fd = ff.read()
-        ff.close()
         retval[0] = ffrv
-        retval[1] = fd
+        retval[1] = _le(ffrv, encoding)
         
 
     return retval
@@ -1,12 +1,16 @@
 # -*- coding: windows-1252 -*-
 import re, subprocess
-import os, tempfile, shutil
-import subprocess
+import os
+import contextvars
 import datetime
+import tempfile
 from collections import namedtuple
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 
-# Executable path of the program that connects to the Database
-sqlrunner_path = os.path.join(os.getcwd(), "tools", "SingleSQLExecutor.exe")
+from sisposbase import perfil, sqlcache
+from sisposbase.columnar import colunas_de_registros
+from sisposbase.sqlbackend import SQLExecutionError, get_backend, itera_sqlexecutor_output
 
 # Exectuable path of the program that lists periods in ControleProducao system
 listaperiodosconsole_path = os.path.join(
@@ -24,67 +28,179 @@ def lesplit(regex, prompt="", _input=""):
             a = input(prompt + " --> ")
 
     rec = re.compile(regex)
-    return [a] + list(rec.match(a).groups())
+    m = rec.match(a)
+    if m is None:
+        raise Exception(f"Valor invlido para {prompt}: {a}")
+    return [a] + list(m.groups())
 
 
-def le_int(prompt):
-    a = lesplit("([0-9]+)", prompt)
+def le_int(prompt, _input=""):
+    a = lesplit("([0-9]+)", prompt, _input)
     a[1] = int(a[1])
     return a[1]
 
 
-def getsqldata(sqlcode: str):
-    # Create TMPDIR
-    tmpdir = tempfile.mkdtemp()
+# Quando uma consulta falha: False (padro) mostra o erro e sai do programa,
+# True levanta SQLExecutionError para quem chamou tratar (ver levanta_erros_sql)
+_levanta_erros = contextvars.ContextVar("sispos_levanta_erros_sql", default=False)
+
+
+@contextmanager
+def levanta_erros_sql(ativo=True):
+    """Dentro do with, uma consulta que falha levanta SQLExecutionError em vez de sair
+    do programa (ex.: modo no interativo, em que a falha tem que chegar ao status
+    de sada; relatrios do Sispre --run, que seguem com o lote)."""
+    token = _levanta_erros.set(ativo)
+    try:
+        yield
+    finally:
+        _levanta_erros.reset(token)
+
+
+def _records(rss, resultsetno, result_sets):
+    # result_sets is kept referenced here so the backend (temp files, connection)
+    # stays alive while this result set is being consumed.
+
+    # First line is always the header.
+    header = next(rss, None)
+    if header is None:
+        return
+    headerfields = [field.strip() for field in header]
+
+    # Build a namedtuple custom type based on this.
+    ResultSet = namedtuple(f"result{resultsetno:02}", headerfields)
+
+    yield ResultSet(*header)
+    for resulttuple in rss:
+        yield ResultSet(*resulttuple)
+
+
+def _itera_resultsets(sqlcode: str, periodo=None, cache=True):
+    # Gera, para cada result set, um iterador das linhas cruas (listas de strings, cabealho primeiro)
+    try:
+        # Executa no backend configurado (executvel, pool ODBC ou SQLite local);
+        # o cache  separado por banco
+        backend = get_backend()
+        banco = backend.identidade()
+
+        # Resultado j est no cache?
+        cached = sqlcache.abre(sqlcode, periodo, banco) if cache else None
+        if cached is not None:
+            result_sets = itera_sqlexecutor_output(cached)
+        elif not cache:
+            result_sets = backend.itera(sqlcode)
+        else:
+            result_sets = sqlcache.grava_enquanto_le(
+                sqlcode, periodo, backend.itera(sqlcode), banco
+            )
+
+        # Tempo e linhas da consulta vo para o perfil da anlise que est rodando
+        perfil_atual = perfil.atual()
+        if perfil_atual is not None:
+            origem = "cache" if cached is not None else "banco"
+            result_sets = perfil_atual.mede_consulta(sqlcode, origem, result_sets)
+
+        yield from result_sets
+
+    except SQLExecutionError as e:
+        if _levanta_erros.get():
+            raise
+
+        # Bail if failed
+        print("Erro: No foi possvel executar o Relatrio SQL\n")
+        print(str(e))
+        exit(0)
 
-    # Write sqlcode to TMPDIR
-    sqlfp = os.path.join(tmpdir, "sqlcode.sql")
-    with open(sqlfp, "wb") as sqlf:
-        # encode sql code to "windows-1252" encoding, to properly handle accents.
-        sqlcode_encoded = sqlcode.encode("windows-1252")
-        sqlf.write(sqlcode_encoded)
 
-    # Create output file
-    outf = os.path.join(tmpdir, "out.txt")
+def iter_sqldata(sqlcode: str, periodo=None, cache=True):
+    """Como getsqldata(), mas gera um iterador de registros para cada result set.
 
-    # Run it!
-    process = subprocess.run([sqlrunner_path, sqlfp, outf], capture_output=True)
+    As linhas so lidas do backend  medida que so consumidas; cada result set
+    deve ser consumido antes de pedir o prximo. O resultado s vai para o cache
+    se o iterador for consumido at o fim (para s o primeiro result set, ver
+    iter_sqldata_primeiro).
 
-    # Bail if failed
-    if process.returncode != 0:
-        print("Erro: No foi possvel executar o Relatrio SQL\n")
-        errmsg = process.stdout.decode()
-        print(errmsg)
-        exit(0)
+    periodo: ID do perodo a que a consulta se refere, usado pelo cache para
+    decidir a validade do resultado (perodos fechados no expiram).
+    cache: False sempre busca no banco e no grava no cache (ex.: conferir o que mudou).
+    """
+    result_sets = _itera_resultsets(sqlcode, periodo, cache)
+    for resultsetno, rss in enumerate(result_sets):
+        yield _records(rss, resultsetno, result_sets)
 
-    # Read data
-    with open(outf, "rb") as data:
-        _ed = data.read().decode("windows-1252")
 
-    # Delete tempdir
-    shutil.rmtree(tmpdir)
+def iter_sqldata_primeiro(sqlcode: str, periodo=None, cache=True):
+    """Registros do primeiro result set, como next(iter_sqldata(...)), mas lendo os
+    outros at o fim depois do ltimo registro, para a consulta ir para o cache."""
+    result_sets = iter_sqldata(sqlcode, periodo, cache)
+    yield from next(result_sets, ())
+    for _ in result_sets:
+        pass
 
-    # Get all queries.
-    result_sets = _ed.strip().split("\r\n\r\n")
 
-    retval = []
-    for resultset, resultsetno in zip(result_sets, range(len(result_sets))):
-        rss = [x.strip().split("|")[:-1] for x in resultset.split("\r\n")]
+def getsqldata(sqlcode: str, periodo=None, cache=True):
+    return [list(query) for query in iter_sqldata(sqlcode, periodo, cache)]
 
-        # First line is always the header, ignore the last field which is always blank.
-        headerfields = [field.strip() for field in rss[0]]
 
-        # Build a namedtuple custom type based on this.
-        ResultSet = namedtuple(f"result{resultsetno:02}", headerfields)
+def getsqldata_colunas(sqlcode: str, schemas, periodo=None):
+    """Executa a consulta e devolve cada result set como colunas tipadas
+    (ver sisposbase.columnar), sem montar um registro por linha.
 
-        query_retval = []
-        for resulttuple in rss:
-            record = ResultSet(*resulttuple)
-            query_retval.append(record)
+    schemas: um schema para cada result set desejado, na ordem em que vm.
+    """
+    retval = []
+    for rss, schema in zip(_itera_resultsets(sqlcode, periodo), schemas):
+        retval.append(colunas_de_registros(rss, schema, cabecalho=True))
+    return retval
 
-        retval.append(query_retval)
 
-    return retval
+def grava_sqldata(sqlcode: str, caminho: str, periodo=None) -> int:
+    """Executa a consulta e grava o resultado em `caminho`, no formato de texto
+    do SingleSQLExecutor.exe, sem carregar tudo em memria. Devolve o nmero de linhas.
+
+    O arquivo s  substitudo quando a consulta termina: se ela falhar, o anterior fica.
+    """
+    linhas = 0
+    fd, tmppath = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(caminho)), suffix=".tmp")
+    try:
+        with open(fd, "w", encoding="windows-1252", errors="replace", newline="") as out:
+            for query in iter_sqldata(sqlcode, periodo):
+                if linhas:
+                    out.write("\r\n")
+                for record in query:
+                    out.write("|".join(record) + "|\r\n")
+                    linhas += 1
+        os.replace(tmppath, caminho)
+    finally:
+        if os.path.exists(tmppath):
+            os.remove(tmppath)
+    return linhas
+
+
+# Quantidade mxima de consultas simultneas em getsqldata_many()
+max_sql_paralelo = int(os.environ.get("SISPOS_SQL_PARALELO", "4"))
+
+
+def getsqldata_many(sqlcodes, periodo=None, max_workers=None, cache=True):
+    """Executa consultas independentes em paralelo, devolvendo os resultados
+    (no formato de getsqldata) na mesma ordem de sqlcodes."""
+    sqlcodes = list(sqlcodes)
+    if not sqlcodes:
+        return []
+
+    workers = min(len(sqlcodes), max_workers or max_sql_paralelo)
+
+    # Cada consulta roda no contexto de quem chamou (ex.: a etapa do perfil da anlise)
+    contextos = [contextvars.copy_context() for _ in sqlcodes]
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(
+            executor.map(
+                lambda contexto, sqlcode: contexto.run(getsqldata, sqlcode, periodo, cache),
+                contextos,
+                sqlcodes,
+            )
+        )
 
 
 def sql_substitute_variables(data, vd, d="@@"):
@@ -94,13 +210,15 @@ def sql_substitute_variables(data, vd, d="@@"):
     return rv
 
 
-def get_periodo_data():
-    svar = {}
+def periodo_fechado(status: str) -> bool:
+    # Perodos fechados trazem a data de fechamento no lugar da situao.
+    return bool(re.search(r"[0-9]{1,2}/[0-9]{1,2}/[0-9]{2,4}", status))
 
-    # Run and display ListaPeriodosConsole.exe
+
+def lista_periodos():
+    """Roda o ListaPeriodosConsole.exe e devolve (texto da sada, {id: (mes, ano, status, dtini, dtfim)})."""
     pg_output = subprocess.check_output(listaperiodosconsole_path)
     pgou = pg_output.decode("cp850")
-    print(pg_output.decode("cp850"))
 
     # Extract all periodos from the output
     pt = r"ID=([0-9]+)\W+ \[([0-9]+)\/([0-9]+)\] \[(.*)\] de ([0-9\/]*) at ([0-9\/]*)"
@@ -111,16 +229,45 @@ def get_periodo_data():
         perid, mes, ano, status, dtini, dtfim = entry
         dbd[int(perid)] = (mes, ano, status, dtini, dtfim)
 
+        # Informa ao cache quais perodos j foram fechados
+        sqlcache.marca_periodo(perid, periodo_fechado(status))
+
+    return pgou, dbd
+
+
+def get_periodo_data(periodoid=None, catalogo=None):
+    """Pergunta qual perodo usar, a no ser que `periodoid` j tenha sido dado.
+
+    periodoid: o ID ou um seletor do catlogo ("ultimo-aberto", "ultimo-fechado"...)
+    catalogo: sisposbase.catalogo.CatalogoDePeriodos (padro: o catlogo do processo)
+    """
+    if catalogo is None:
+        from sisposbase.catalogo import catalogo_padrao
+
+        catalogo = catalogo_padrao()
+
+    svar = {}
+
+    if periodoid:
+        periodoid = catalogo.seleciona(periodoid)
+    else:
+        # Mostra a lista para o usurio escolher
+        print(catalogo.texto())
+        print("")
+
     # print("---\nEntre com os seguintes parametros:\n---")
 
-    svar["PERIODO"] = le_int("ID DO PERIODO DE APROPRIACAO")
+    svar["PERIODO"] = le_int(
+        "ID DO PERIODO DE APROPRIACAO", str(periodoid) if periodoid else ""
+    )
 
     # error out if incorrect periodnumber
-    if not svar["PERIODO"] in dbd.keys():
+    periodo = catalogo.periodo(svar["PERIODO"])
+    if periodo is None:
         raise Exception("Periodo Invalido, escolha um ID vlido de periodo")
 
     # from periodo de apropriacao infer other needed variables
-    mes, ano, status, dtini, dtfim = dbd[svar["PERIODO"]]
+    mes, ano, status, dtini, dtfim = periodo
 
     # update mes and ano to XX format
     mes = "{:02}".format(int(mes))
@@ -207,7 +354,7 @@ def get_periodo_additional_data(
     
     """
 
-    data = getsqldata(sqlcode)
+    data = getsqldata(sqlcode, periodo=periodoid)
 
     # Working Days in the Period
     dias_uteis = int(data[1][1][0])
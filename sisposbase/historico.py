@@ -0,0 +1,171 @@
+# -*- coding: windows-1252 -*-
+"""
+Histrico local dos perodos fechados (cache/historico).
+
+Para cada perodo fechado guardamos, em arquivos colunares compactos
+(columnar.grava_arquivo), o resultado das consultas de SERIES:
+
+    cache/historico/<banco>/<periodo>/<serie>.col
+
+<banco>  sqlcache.pasta_do_banco(): cada banco (produo, outro DSN, um
+SQLite de testes) tem o seu histrico, nunca misturado.
+
+Um perodo fechado no muda mais, ento anlises de vrios perodos (ex.:
+Tendencias, 24 meses de IOMO) leem daqui em vez de consultar o banco de novo,
+sem converter texto: as colunas j voltam tipadas, com as horas em ponto fixo
+(sisposbase.horas).
+
+Quem grava:
+  - IomoCapac, com o resultado das suas trs consultas;
+  - Sispre --run, com as sadas dos relatrios que so sries (hhreal.sql, He_TOTAL.sql);
+  - Tendencias, com o que precisou buscar no banco.
+
+Perodos abertos nunca so gravados. Segue o cache de consultas: SISPOS_CACHE=0
+no grava nada em disco e --refresh ignora o que j est gravado (grava de novo).
+"""
+import os
+import tempfile
+import threading
+import time
+import zlib
+from collections import namedtuple
+
+from sisposbase import sqlcache
+from sisposbase.columnar import DECIMAL, STR, colunas_de_registros, grava_arquivo, le_arquivo
+from sisposbase.sqlbackend import itera_sqlexecutor_output
+
+HISTORICOPATH = os.path.join(os.getcwd(), "cache", "historico")
+
+# Uma srie: nome, arquivo SQL (em datafiles/) e o schema do primeiro result set
+Serie = namedtuple("Serie", "nome sql schema")
+
+# dataFechamento || sigla || horas
+_horas_por_depto = ((None, None), ("depto", STR), ("horas", DECIMAL))
+
+SERIES = {
+    s.nome: s
+    for s in (
+        Serie("iomo_hdisp", "iomo_horasdisponiveis.sql", _horas_por_depto),
+        Serie("iomo_hefet", "iomo_horasefetivas.sql", _horas_por_depto),
+        Serie("iomo_htot", "iomo_horastotais.sql", _horas_por_depto),
+        # Periodo || projeto || OS antiga || OS reduzida || funcao || depto || atividade || fa || horas
+        Serie(
+            "hhreal",
+            os.path.join("sispre_sql", "hhreal.sql"),
+            (
+                (None, None),
+                ("os", STR),
+                (None, None),
+                ("reduzida", STR),
+                ("cargo", STR),
+                ("depto", STR),
+                ("atividade", STR),
+                ("fa", STR),
+                ("horas", DECIMAL),
+            ),
+        ),
+        # total de horas extras
+        Serie("he_total", os.path.join("sispre_sql", "He_TOTAL.sql"), (("horas", DECIMAL),)),
+    )
+}
+
+
+def serie_do_sql(sqlfile):
+    """A srie cujo SQL  `sqlfile` (ex.: "sispre_sql/He_TOTAL.sql"), ou None."""
+    alvo = os.path.normcase(os.path.normpath(sqlfile))
+    for serie in SERIES.values():
+        if os.path.normcase(os.path.normpath(serie.sql)) == alvo:
+            return serie
+    return None
+
+
+class HistoricoDePeriodos:
+    def __init__(self, caminho=HISTORICOPATH, persistente=None):
+        self.caminho = caminho
+        self.persistente = sqlcache.ativo if persistente is None else persistente
+
+        self._lock = threading.Lock()
+        # Entradas gravadas nesta execuo (valem mesmo com --refresh)
+        self._renovados = set()
+
+    def _pasta(self):
+        return os.path.join(self.caminho, sqlcache.pasta_do_banco())
+
+    def _arquivo(self, periodoid, serie):
+        return os.path.join(self._pasta(), str(int(periodoid)), f"{serie}.col")
+
+    def carrega(self, periodoid, serie):
+        """Colunas da srie no perodo, ou None se no estiverem no histrico."""
+        if not self.persistente:
+            return None
+        chave = (int(periodoid), serie)
+        if sqlcache.refresh and chave not in self._renovados:
+            return None
+        try:
+            return le_arquivo(self._arquivo(periodoid, serie))
+        except (OSError, ValueError, KeyError, zlib.error):
+            # Arquivo incompleto ou de outra verso: busca de novo
+            return None
+
+    def tem(self, periodoid, serie) -> bool:
+        return self.persistente and os.path.isfile(self._arquivo(periodoid, serie))
+
+    def grava(self, periodoid, serie, colunas, origem="sql") -> bool:
+        """Guarda as colunas da srie, se o perodo estiver fechado. Diz se gravou."""
+        if not self.persistente or not sqlcache.periodo_esta_fechado(periodoid):
+            return False
+
+        caminho = self._arquivo(periodoid, serie)
+        pasta = os.path.dirname(caminho)
+        os.makedirs(pasta, exist_ok=True)
+        fd, tmppath = tempfile.mkstemp(dir=pasta, suffix=".tmp")
+        os.close(fd)
+        try:
+            grava_arquivo(tmppath, colunas, {"periodo": int(periodoid), "origem": origem, "criado": time.time()})
+            os.replace(tmppath, caminho)
+        finally:
+            if os.path.exists(tmppath):
+                os.remove(tmppath)
+
+        with self._lock:
+            self._renovados.add((int(periodoid), serie))
+        return True
+
+    def grava_registros(self, periodoid, serie, registros, origem="sql") -> bool:
+        """Como grava(), a partir do result set de getsqldata() (cabealho primeiro)."""
+        if not self.persistente or not sqlcache.periodo_esta_fechado(periodoid):
+            return False
+        colunas = colunas_de_registros(registros, SERIES[serie].schema)
+        return self.grava(periodoid, serie, colunas, origem)
+
+    def importa(self, periodoid, serie, caminho) -> bool:
+        """Guarda a sada de um relatrio do Sispre (formato do SingleSQLExecutor.exe)."""
+        if not self.persistente or not sqlcache.periodo_esta_fechado(periodoid):
+            return False
+        with open(caminho, "r", encoding="windows-1252", newline="\r\n") as f:
+            registros = next(itera_sqlexecutor_output(f), ())
+            return self.grava_registros(periodoid, serie, registros, origem="sispre")
+
+    def periodos(self, serie=None) -> list:
+        """IDs dos perodos no histrico (que tm a srie, se dada)."""
+        pasta = self._pasta()
+        if not self.persistente or not os.path.isdir(pasta):
+            return []
+        return sorted(
+            int(p)
+            for p in os.listdir(pasta)
+            if p.isdigit() and (serie is None or self.tem(p, serie))
+        )
+
+
+_padrao = None
+_padrao_lock = threading.Lock()
+
+
+def historico_padrao() -> HistoricoDePeriodos:
+    """O histrico do processo (cache/historico do diretrio atual)."""
+    global _padrao
+    with _padrao_lock:
+        if _padrao is None:
+            _padrao = HistoricoDePeriodos()
+        return _padrao
@@ -0,0 +1,101 @@
+# -*- coding: windows-1252 -*-
+"""
+Horas em ponto fixo: inteiros em milionsimos de hora.
+
+ o mesmo ponto fixo das colunas DECIMAL de sisposbase.columnar (o SQL Server
+devolve qtdHoraMin/60.0 com 6 casas), ento os valores lidos com le_colunas()
+j esto nesta escala e as somas so de inteiros, exatas, sem Decimal:
+
+    total = horas.soma(cols["tothora"])      # tambm numpy.ndarray/array.array
+    horas.formata(total)                     # "1234.57", como Decimal.quantize(Decimal(".01"))
+
+A converso para texto (e para Decimal/float) s acontece na hora de escrever
+o relatrio. Todos os arredondamentos so "half even", como os do Decimal.
+"""
+from decimal import Decimal
+
+from sisposbase.columnar import DECIMAL, DECIMAL_ESCALA, converte_coluna, numpy
+
+# 1 hora
+ESCALA = 10**DECIMAL_ESCALA
+
+
+def de_texto(valor: str) -> int:
+    """ "1,500000" ou "1.5" -> 1500000. Vazio  zero; mais de DECIMAL_ESCALA casas  arredondado ("half even")."""
+    return int(converte_coluna((valor,), DECIMAL)[0])
+
+
+def de_decimal(valor) -> int:
+    """Decimal (ou int) em horas -> ponto fixo."""
+    return de_texto(str(valor))
+
+
+def para_decimal(valor) -> Decimal:
+    """Ponto fixo -> Decimal com DECIMAL_ESCALA casas (ex.: Decimal("4.000000"))."""
+    return Decimal(int(valor)).scaleb(-DECIMAL_ESCALA)
+
+
+def para_float(valor) -> float:
+    return int(valor) / ESCALA
+
+
+def soma(valores) -> int:
+    """Soma de horas em ponto fixo (lista, array.array ou numpy.ndarray)."""
+    if hasattr(valores, "sum"):
+        return int(valores.sum())
+    return sum(valores)
+
+
+def soma_por(codigos, valores, n) -> list:
+    """Soma dos valores de cada cdigo (0 a n-1): [soma do cdigo 0, soma do cdigo 1, ...].
+
+    Os cdigos normalmente vm de columnar.fatoriza(); com o NumPy  uma passada s, em C.
+    """
+    if numpy is not None:
+        somas = numpy.zeros(n, dtype="i8")
+        numpy.add.at(somas, numpy.asarray(codigos, dtype="i8"), numpy.asarray(valores, dtype="i8"))
+        return somas.tolist()
+
+    somas = [0] * n
+    for codigo, valor in zip(codigos, valores):
+        somas[codigo] += valor
+    return somas
+
+
+def _arredonda_inteiro(numerador: int, denominador: int) -> int:
+    # numerador/denominador arredondado para inteiro, "half even"
+    q, r = divmod(abs(numerador), abs(denominador))
+    if 2 * r > abs(denominador) or (2 * r == abs(denominador) and q % 2):
+        q += 1
+    return -q if (numerador < 0) != (denominador < 0) else q
+
+
+def _unidades(valor, casas):
+    if not 0 <= casas <= DECIMAL_ESCALA:
+        raise Exception(f"Casas decimais invlidas: {casas} (de 0 a {DECIMAL_ESCALA})")
+    return _arredonda_inteiro(int(valor), 10 ** (DECIMAL_ESCALA - casas))
+
+
+def arredonda(valor, casas=2) -> int:
+    """Arredonda para `casas` casas decimais, continua em ponto fixo."""
+    return _unidades(valor, casas) * 10 ** (DECIMAL_ESCALA - casas)
+
+
+def formata(valor, casas=2) -> str:
+    """Texto com `casas` casas decimais, igual a str(Decimal.quantize()) e a format(Decimal, ".2f").
+
+    Como no Decimal, um negativo que arredonda para zero mantm o sinal ("-0.00").
+    """
+    unidades = _unidades(valor, casas)
+    sinal = "-" if int(valor) < 0 else ""
+    if not casas:
+        return f"{sinal}{abs(unidades)}"
+    inteiro, fracao = divmod(abs(unidades), 10**casas)
+    return f"{sinal}{inteiro}.{fracao:0{casas}d}"
+
+
+def percentual(parte, total) -> int:
+    """round(parte / total * 100, 0) em Decimal, como inteiro (ex.: ndices do IOMO)."""
+    if not int(total):
+        raise ZeroDivisionError(f"Percentual de {formata(parte)} sobre total zero")
+    return _arredonda_inteiro(int(parte) * 100, int(total))
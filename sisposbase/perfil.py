@@ -0,0 +1,287 @@
+# -*- coding: windows-1252 -*-
+"""
+Tempos de uma execuo de anlise: etapas, consultas SQL e, opcionalmente,
+cProfile e tracemalloc.
+
+Cada BaseSISPOS tem um Perfil (self.perfil). As etapas so marcadas na anlise:
+
+    with self.etapa("html"):
+        ...
+
+ou, para um mtodo inteiro:
+
+    @etapa("categorias")
+    def classifica(self, ...):
+        ...
+
+Etapas podem ser aninhadas (o nome fica "process/html"). Toda consulta feita
+por getsqldata()/iter_sqldata() durante uma etapa  registrada nela, com o
+tempo de espera pelo banco, o tempo at a ltima linha e a quantidade de
+linhas (inclusive as de getsqldata_many(), em outras threads).
+
+Ao final de run() tudo vai para um JSON ao lado dos arquivos gerados
+(<Analise>_perfil_<data>.json). Com options["perfil"]:
+  "cpu"      liga o cProfile em run() (grava tambm o .prof, para o pstats/snakeviz)
+  "memoria"  liga o tracemalloc e registra o pico de memria de cada etapa
+  "tudo"     os dois
+O tracemalloc  do processo inteiro: com vrias anlises ao mesmo tempo (modo
+servio, threads) os picos de uma incluem as outras.
+"""
+import contextvars
+import datetime
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# (perfil, registro da etapa atual) de quem est rodando, veja Perfil.etapa()
+_atual = contextvars.ContextVar("sispos_perfil", default=(None, None))
+
+# Quantas funes do cProfile vo para o JSON
+max_funcoes_cprofile = 40
+
+CAPTURAS = {
+    "": (False, False),
+    "cpu": (True, False),
+    "memoria": (False, True),
+    "tudo": (True, True),
+}
+
+
+def capturas(texto):
+    """(cpu, memoria) de options["perfil"]: "", "cpu", "memoria", "tudo" ou "cpu,memoria"."""
+    cpu = memoria = False
+    for parte in str(texto or "").lower().replace(" ", "").split(","):
+        if parte not in CAPTURAS:
+            raise Exception(f'Perfil invlido "{parte}": use um de {", ".join(c for c in CAPTURAS if c)}')
+        c, m = CAPTURAS[parte]
+        cpu, memoria = cpu or c, memoria or m
+    return cpu, memoria
+
+
+def atual():
+    """O Perfil da anlise que est rodando nesta thread/contexto, ou None."""
+    return _atual.get()[0]
+
+
+def etapa(nome=None):
+    """Decorador de mtodos de BaseSISPOS: o mtodo inteiro  uma etapa (nome padro: o do mtodo).
+
+    Num gerador s a criao  medida, use `with self.etapa()` onde ele  consumido.
+    """
+
+    def decorador(metodo):
+        @functools.wraps(metodo)
+        def medido(self, *args, **kwargs):
+            with self.etapa(nome or metodo.__name__):
+                return metodo(self, *args, **kwargs)
+
+        return medido
+
+    return decorador
+
+
+def _resumo_sql(sqlcode: str) -> str:
+    # Primeira linha com contedo (normalmente o comentrio com o nome do relatrio)
+    for linha in sqlcode.splitlines():
+        if linha.strip():
+            return linha.strip()[:80]
+    return ""
+
+
+class Perfil:
+    def __init__(self, nome, cpu=False, memoria=False):
+        self.nome = nome
+        self.cpu = cpu
+        self.memoria = memoria
+
+        self.criado = datetime.datetime.now()
+        self._t0 = time.perf_counter()
+
+        self.etapas = []
+        self.consultas = []
+        self._lock = threading.Lock()
+
+        self._cprofile = None
+        self._cprofile_erro = ""
+        self._tracemalloc_nosso = False
+
+    def _agora(self) -> float:
+        return time.perf_counter() - self._t0
+
+    # ------------------------------------------------------------------
+    # Etapas
+    # ------------------------------------------------------------------
+
+    @contextmanager
+    def etapa(self, nome):
+        perfil, pai = _atual.get()
+        if perfil is not self:
+            pai = None
+
+        registro = {
+            "etapa": f'{pai["etapa"]}/{nome}' if pai else nome,
+            "inicio": round(self._agora(), 6),
+            "segundos": 0.0,
+        }
+        with self._lock:
+            self.etapas.append(registro)
+
+        tracemalloc = self._tracemalloc()
+        if tracemalloc is not None:
+            # O pico at aqui  do pai; zera para medir o desta etapa
+            if pai is not None:
+                pai["pico_memoria"] = max(pai.get("pico_memoria", 0), tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+
+        token = _atual.set((self, registro))
+        inicio = time.perf_counter()
+        try:
+            yield registro
+        finally:
+            registro["segundos"] = round(time.perf_counter() - inicio, 6)
+            _atual.reset(token)
+
+            if tracemalloc is not None:
+                registro["pico_memoria"] = max(
+                    registro.get("pico_memoria", 0), tracemalloc.get_traced_memory()[1]
+                )
+                if pai is not None:
+                    pai["pico_memoria"] = max(pai.get("pico_memoria", 0), registro["pico_memoria"])
+
+    # ------------------------------------------------------------------
+    # Consultas SQL (chamado por get_sql_data)
+    # ------------------------------------------------------------------
+
+    def mede_consulta(self, sqlcode, origem, result_sets):
+        """Repassa os result sets de uma consulta, registrando tempos e linhas.
+
+        espera: tempo at o primeiro result set (o banco executando a consulta);
+        segundos: at a ltima linha ser lida (inclui o tempo de quem consome as linhas).
+        """
+        perfil, pai = _atual.get()
+        registro = {
+            "etapa": pai["etapa"] if perfil is self else None,
+            "sql": _resumo_sql(sqlcode),
+            "origem": origem,
+            "espera": 0.0,
+            "segundos": 0.0,
+            "resultsets": 0,
+            "linhas": 0,
+        }
+        with self._lock:
+            self.consultas.append(registro)
+        return self._repassa(result_sets, registro)
+
+    def _repassa(self, result_sets, registro):
+        inicio = time.perf_counter()
+        try:
+            for rs in result_sets:
+                if not registro["resultsets"]:
+                    registro["espera"] = round(time.perf_counter() - inicio, 6)
+                registro["resultsets"] += 1
+                yield self._conta_linhas(rs, registro, inicio)
+        finally:
+            registro["segundos"] = round(time.perf_counter() - inicio, 6)
+
+    @staticmethod
+    def _conta_linhas(rs, registro, inicio):
+        cabecalho = True
+        for linha in rs:
+            if cabecalho:
+                cabecalho = False
+            else:
+                registro["linhas"] += 1
+            yield linha
+        # Quem s l o primeiro result set no chega ao fim de _repassa()
+        registro["segundos"] = round(time.perf_counter() - inicio, 6)
+
+    # ------------------------------------------------------------------
+    # cProfile / tracemalloc
+    # ------------------------------------------------------------------
+
+    def _tracemalloc(self):
+        if not self.memoria:
+            return None
+        import tracemalloc
+
+        return tracemalloc if tracemalloc.is_tracing() else None
+
+    def inicia_captura(self):
+        if self.memoria:
+            import tracemalloc
+
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._tracemalloc_nosso = True
+
+        if self.cpu:
+            import cProfile
+
+            self._cprofile = cProfile.Profile()
+            try:
+                self._cprofile.enable()
+            except ValueError as e:
+                # S um profiler por vez (outra anlise j est com o cProfile ligado)
+                self._cprofile = None
+                self._cprofile_erro = str(e)
+
+    def termina_captura(self):
+        if self._cprofile is not None:
+            self._cprofile.disable()
+
+        if self._tracemalloc_nosso:
+            import tracemalloc
+
+            tracemalloc.stop()
+            self._tracemalloc_nosso = False
+
+    def _funcoes_cprofile(self):
+        import pstats
+
+        stats = pstats.Stats(self._cprofile)
+        funcoes = []
+        for (arquivo, linha, funcao), (_, chamadas, total, acumulado, _) in stats.stats.items():
+            funcoes.append(
+                {
+                    "funcao": f"{os.path.basename(arquivo)}:{linha}({funcao})",
+                    "chamadas": chamadas,
+                    "total": round(total, 6),
+                    "acumulado": round(acumulado, 6),
+                }
+            )
+        funcoes.sort(key=lambda f: f["acumulado"], reverse=True)
+        return funcoes[:max_funcoes_cprofile]
+
+    # ------------------------------------------------------------------
+    # JSON
+    # ------------------------------------------------------------------
+
+    def dados(self) -> dict:
+        with self._lock:
+            dados = {
+                "analise": self.nome,
+                "criado": self.criado.isoformat(timespec="seconds"),
+                "segundos": round(self._agora(), 6),
+                "etapas": [dict(e) for e in self.etapas],
+                "consultas": [dict(c) for c in self.consultas],
+            }
+        if self.cpu:
+            if self._cprofile is not None:
+                dados["cprofile"] = self._funcoes_cprofile()
+            else:
+                dados["cprofile_erro"] = self._cprofile_erro
+        return dados
+
+    def grava(self, pasta) -> str:
+        """Grava o JSON (e o .prof do cProfile, se ligado) em `pasta`, devolve o caminho do JSON."""
+        base = os.path.join(pasta, "%s_perfil_%s" % (self.nome, self.criado.strftime("%Y%m%d-%H%M%S")))
+        if self._cprofile is not None:
+            self._cprofile.dump_stats(base + ".prof")
+
+        caminho = base + ".json"
+        with open(caminho, "w", encoding="utf-8") as f:
+            json.dump(self.dados(), f, ensure_ascii=False, indent=1)
+        return caminho
@@ -0,0 +1,118 @@
+# -*- coding: windows-1252 -*-
+"""
+Tabela de regras de classificao (ex.: cargo + depto -> categoria).
+
+As regras so dados, avaliadas em ordem: vale a primeira cuja(s) condio(es)
+forem todas verdadeiras. Cada condio testa um campo de uma destas formas:
+
+  CONTEM  o campo contm algum dos textos        (cargo.find("SUP") >= 0)
+  IGUAL   o campo  igual a algum dos textos     (depto in ("IQ", "IQI"))
+  PARTE   o campo  parte de algum dos textos    (depto in ("IPC/T") - sem vrgula
+          no  tupla,  teste de substring; inclusive o texto vazio)
+
+Na compilao, IGUAL e PARTE viram um dicionrio valor -> condies e os
+textos CONTEM de cada campo viram uma nica regex. O resultado  memorizado
+por combinao de valores, j que um ms tem milhares de linhas e s algumas
+centenas de combinaes distintas.
+"""
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+CONTEM = "contem"
+IGUAL = "igual"
+PARTE = "parte"
+
+# condicoes: sequncia de (campo, tipo, textos)
+# motiv: texto do motivo, pode usar os campos: "Setor Ignorado: {depto}"
+Regra = namedtuple("Regra", "nome categ motiv condicoes")
+
+
+class TabelaDeRegras:
+    def __init__(self, campos, regras, padrao):
+        """
+        campos: nomes dos campos, na ordem em que so passados para classifica()
+        regras: sequncia de Regra, em ordem de prioridade
+        padrao: Regra usada quando nenhuma outra se aplica
+        """
+        self.campos = tuple(campos)
+        self.regras = tuple(regras)
+        self.padrao = padrao
+
+        # Para cada regra, os ids das condies que precisam ser verdadeiras
+        self._necessarias = []
+
+        # Por campo: valor exato -> ids de condies satisfeitas
+        self._exatos = {c: {} for c in self.campos}
+        # Por campo: texto CONTEM -> ids de condies
+        self._textos = {c: {} for c in self.campos}
+
+        ncond = 0
+        for regra in self.regras:
+            ids = []
+            for campo, tipo, textos in regra.condicoes:
+                if campo not in self._exatos:
+                    raise Exception("Regra %r usa o campo desconhecido %r" % (regra.nome, campo))
+                if isinstance(textos, str):
+                    textos = (textos,)
+
+                if tipo == IGUAL:
+                    valores = textos
+                elif tipo == PARTE:
+                    # Todas as substrings (inclusive a vazia) so "parte" do texto
+                    valores = {t[i:j] for t in textos for i in range(len(t) + 1) for j in range(i, len(t) + 1)}
+                elif tipo == CONTEM:
+                    valores = ()
+                    for t in textos:
+                        self._textos[campo].setdefault(t, set()).add(ncond)
+                else:
+                    raise Exception("Tipo de condio desconhecido: %r" % (tipo,))
+
+                for v in valores:
+                    self._exatos[campo].setdefault(v, set()).add(ncond)
+
+                ids.append(ncond)
+                ncond += 1
+            self._necessarias.append(frozenset(ids))
+
+        # Uma regex por campo com todos os textos CONTEM. Os mais longos vm primeiro,
+        # ento em cada posio a regex acha o maior texto; os textos que so prefixo
+        # dele tambm esto ali e so somados na mo (_prefixos).
+        self._regex = {}
+        self._prefixos = {}
+        for campo, textos in self._textos.items():
+            if not textos:
+                continue
+            ordem = sorted(textos, key=len, reverse=True)
+            self._regex[campo] = re.compile("(?=(%s))" % "|".join(re.escape(t) for t in ordem))
+            self._prefixos[campo] = {
+                t: set().union(*(textos[p] for p in textos if t.startswith(p))) for t in textos
+            }
+
+        self.avalia = lru_cache(maxsize=None)(self._avalia)
+        self.classifica = lru_cache(maxsize=None)(self._classifica)
+
+    def _satisfeitas(self, valores) -> set:
+        satisfeitas = set()
+        for campo, valor in zip(self.campos, valores):
+            satisfeitas |= self._exatos[campo].get(valor, set())
+
+            regex = self._regex.get(campo)
+            if regex is not None:
+                prefixos = self._prefixos[campo]
+                for t in set(regex.findall(valor)):
+                    satisfeitas |= prefixos[t]
+        return satisfeitas
+
+    def _avalia(self, *valores) -> Regra:
+        """Devolve a primeira regra que se aplica aos valores (ou a regra padro)."""
+        satisfeitas = self._satisfeitas(valores)
+        for regra, necessarias in zip(self.regras, self._necessarias):
+            if necessarias <= satisfeitas:
+                return regra
+        return self.padrao
+
+    def _classifica(self, *valores):
+        """Devolve (categoria, motivo) para os valores."""
+        regra = self.avalia(*valores)
+        return regra.categ, regra.motiv.format(**dict(zip(self.campos, valores)))
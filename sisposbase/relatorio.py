@@ -0,0 +1,72 @@
+# -*- coding: windows-1252 -*-
+"""
+Escrita de relatrios (HTML, CSV) com modelos compilados uma vez.
+
+Em vez de um write() por clula, cada linha do relatrio sai de um Modelo e
+cada grupo (ex.: uma OS)  juntado num texto s e escrito de uma vez, em
+arquivos com buffer grande (TAMANHO_BUFFER). Vrias sadas do mesmo
+relatrio (HTML, verso para impresso, CSV) so montadas na mesma passada
+pelos dados:
+
+    linha = Modelo('<tr><td>{os}</td><td>{horas:.2f}</td></tr>')
+
+    rel = Relatorio(html=o1, csv=o2)
+    for grupo in arvore:
+        partes = rel.grupo()                 # {"html": [], "csv": []}
+        for l in grupo.linhas:
+            partes["html"].append(linha(l[0], l[5]))
+        partes["csv"].append(...)
+        rel.escreve(partes)                  # um join e um write por sada
+"""
+import string
+
+# Buffer dos arquivos de sada dos relatrios (ver BaseSISPOS.getoutputfile)
+TAMANHO_BUFFER = 1 << 20
+
+
+class Modelo:
+    """Texto com campos {nome} (e formatao, {horas:.2f}), compilado uma vez numa f-string.
+
+    Chamado com os valores dos campos na ordem em que aparecem pela primeira vez
+    no texto, ou por nome: Modelo("{a}-{b}")(1, 2) == Modelo("{a}-{b}")(b=2, a=1).
+    """
+
+    def __init__(self, texto):
+        self.texto = texto
+
+        campos = []
+        for _, nome, _, _ in string.Formatter().parse(texto):
+            if nome is None:
+                continue
+            if not nome.isidentifier():
+                raise Exception(f'Campo invlido "{{{nome}}}" no modelo: use s nomes')
+            if nome not in campos:
+                campos.append(nome)
+        self.campos = tuple(campos)
+
+        # O texto vira o corpo de uma funo: o Python interpreta o modelo uma vez s
+        codigo = "lambda %s: f%r" % (", ".join(self.campos), texto)
+        self._renderiza = eval(codigo, {})
+
+    def __call__(self, *args, **kwargs):
+        return self._renderiza(*args, **kwargs)
+
+    def __repr__(self):
+        return f"Modelo({self.texto!r})"
+
+
+class Relatorio:
+    """As sadas de um relatrio (nome -> arquivo), escritas juntas um grupo de cada vez."""
+
+    def __init__(self, **saidas):
+        self.saidas = saidas
+
+    def grupo(self) -> dict:
+        """Listas vazias para as partes de cada sada (nome -> lista de textos)."""
+        return {nome: [] for nome in self.saidas}
+
+    def escreve(self, partes: dict):
+        """Escreve as partes de um grupo: um texto s por sada."""
+        for nome, textos in partes.items():
+            if textos:
+                self.saidas[nome].write("".join(textos))
@@ -0,0 +1,343 @@
+# -*- coding: windows-1252 -*-
+"""
+Modo servio: um servidor HTTP local (s 127.0.0.1) que fica no ar durante o
+fechamento do ms, para vrios analistas rodarem anlises ao mesmo tempo sem
+pagar a inicializao e as consultas de referncia a cada vez.
+
+Ficam em memria (CacheQuente): o catlogo de perodos (sisposbase.catalogo,
+lista de perodos e dias teis e feriados de cada um) e as tabelas de
+referncia (empregados, departamentos, mquinas). Perodos fechados nunca
+expiram; o resto expira como no cache de consultas (SISPOS_CACHE_TTL).
+
+  python sispos.py --servico [--porta 8765]
+
+Endpoints (respostas em JSON, menos /arquivos):
+
+  GET  /analises                      anlises disponveis
+  GET  /periodos                      perodos de apropriao
+  GET  /periodos/<id>                 dias teis e feriados do perodo
+  GET  /tabelas/<nome>                tabela de referncia
+  POST /analises/<nome>               roda a anlise em modo no interativo, corpo:
+                                      {"periodo": 123, "respostas": {"MES": "01", ...}}
+  GET  /arquivos/<execucao>/<arquivo> arquivo gerado por uma execuo
+  POST /cache/limpa                   descarta o cache em memria
+
+Cada execuo roda numa thread do servidor, com a sua prpria pasta de sada
+em outputs/servico; o que a anlise imprime volta no campo "log".
+"""
+import datetime
+import io
+import json
+import mimetypes
+import os
+import sys
+import threading
+import time
+import traceback
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlsplit
+
+from sisposbase import sqlcache
+from sisposbase.catalogo import catalogo_padrao
+from sisposbase.get_sql_data import getsqldata, periodo_fechado
+from sisposbase.sispos import OUTPUTPATH
+from sisposbase.tarefas import ResultadoTarefa, monta_options
+
+PORTA = 8765
+
+# Tabelas de referncia disponveis em /tabelas/<nome>
+tabelas_de_referencia = {
+    "empregados": (
+        "select e.matricula, e.nome, f.codigo codfunc, f.nome profissao, "
+        "d.sigla depto, t.codigo tipo_mo, s.codigo situa "
+        "from Empregado e, Departamento d, Funcao f, TipoMaoObra t, Situacao s "
+        "where e.fkDepartamento = d.pkDepartamento and e.fkFuncao = f.pkFuncao and "
+        "e.fkTipoMaoObra = t.pkTipoMaoObra and e.fkSituacao = s.pkSituacao "
+        "order by e.matricula"
+    ),
+    "departamentos": "select d.pkDepartamento, d.sigla from Departamento d order by d.sigla",
+    "maquinas": "select m.pkMaquina, m.matricula, m.nome from Maquina m order by m.matricula",
+}
+
+
+class CacheQuente:
+    """Dados de referncia em memria, compartilhados por todas as execues do servio.
+
+    Passado s anlises em options["cachequente"] (ver BaseSISPOSSQL).
+    """
+
+    def __init__(self, catalogo=None, ttl_aberto=None):
+        self.catalogo = catalogo or catalogo_padrao()
+        self.ttl_aberto = sqlcache.ttl_aberto if ttl_aberto is None else ttl_aberto
+
+        # chave -> (criado, valor)
+        self._entradas = {}
+        # Um lock por chave: pedidos simultneos da mesma chave fazem uma consulta s
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def _pega(self, chave, ttl, funcao):
+        with self._lock:
+            lock = self._locks.setdefault(chave, threading.Lock())
+
+        with lock:
+            entrada = self._entradas.get(chave)
+            if entrada is not None and (ttl is None or time.time() - entrada[0] <= ttl):
+                return entrada[1]
+
+            valor = funcao()
+            self._entradas[chave] = (time.time(), valor)
+            return valor
+
+    def periodos(self):
+        """{id: (mes, ano, status, dtini, dtfim)}, ver CatalogoDePeriodos.periodos()."""
+        return self.catalogo.periodos()
+
+    def parametros(self, periodoid):
+        """(dias_uteis, dias_1, dias_2), ver CatalogoDePeriodos.parametros()."""
+        return self.catalogo.parametros(periodoid)
+
+    def tabela(self, nome):
+        """Registros da tabela de referncia `nome` (sem o cabealho)."""
+        sqlcode = tabelas_de_referencia[nome]
+        return self._pega(("tabela", nome), self.ttl_aberto, lambda: getsqldata(sqlcode)[0][1:])
+
+    def limpa(self):
+        with self._lock:
+            self._entradas.clear()
+        self.catalogo.expira_abertos()
+
+
+class _SaidaPorThread:
+    """sys.stdout do modo servio: o que cada execuo imprime vai para o log dela.
+
+    redirect_stdout() troca o sys.stdout do processo inteiro, no serve com
+    vrias anlises rodando ao mesmo tempo em threads.
+    """
+
+    def __init__(self, padrao):
+        self.padrao = padrao
+        self._local = threading.local()
+
+    def destino(self):
+        return getattr(self._local, "destino", None) or self.padrao
+
+    def redireciona(self, destino):
+        self._local.destino = destino
+
+    def write(self, s):
+        return self.destino().write(s)
+
+    def flush(self):
+        self.destino().flush()
+
+    def __getattr__(self, nome):
+        return getattr(self.destino(), nome)
+
+
+_instala_lock = threading.Lock()
+
+
+def _saida_por_thread() -> _SaidaPorThread:
+    with _instala_lock:
+        if not isinstance(sys.stdout, _SaidaPorThread):
+            sys.stdout = _SaidaPorThread(sys.stdout)
+        return sys.stdout
+
+
+class Servico:
+    def __init__(self, menu, options=None, pastasaida=None):
+        """
+        menu: nome -> analysis.Analise (o mesmo de SisposRunner.menu)
+        options: opes comuns a todas as execues (ex.: {"run": True})
+        """
+        self.menu = menu
+        self.options = dict(options or {})
+        self.cache = CacheQuente()
+        self.pastasaida = pastasaida or os.path.join(OUTPUTPATH, "servico")
+        os.makedirs(self.pastasaida, exist_ok=True)
+
+        self._execucoes = 0
+        self._lock = threading.Lock()
+
+    def analises(self):
+        return [{"nome": a.nome, "descricao": a.doc} for a in self.menu.values()]
+
+    def periodos(self):
+        dbd = self.cache.periodos()
+        return [
+            {
+                "id": perid,
+                "mes": int(mes),
+                "ano": int(ano),
+                "situacao": status,
+                "fechado": periodo_fechado(status),
+                "inicio": dtini,
+                "fim": dtfim,
+            }
+            for perid, (mes, ano, status, dtini, dtfim) in sorted(dbd.items())
+        ]
+
+    def parametros(self, periodoid):
+        if self.cache.catalogo.periodo(periodoid) is None:
+            raise KeyError(f"Perodo {periodoid}")
+
+        dias_uteis, dias_1, dias_2 = self.cache.parametros(periodoid)
+        return {
+            "id": periodoid,
+            "dias_uteis": dias_uteis,
+            "feriados": [
+                {"dia": f.dia.strftime("%d/%m/%Y"), "descricao": f.descricao, "tipohora": f.tipohora}
+                for f in sorted(dias_1 + dias_2)
+            ],
+        }
+
+    def tabela(self, nome):
+        return [r._asdict() for r in self.cache.tabela(nome)]
+
+    def executa(self, nome, dados):
+        """Roda a anlise `nome` (modo no interativo) e devolve o resultado e os arquivos gerados."""
+        analise = self.menu[nome]
+
+        with self._lock:
+            self._execucoes += 1
+            execucao = datetime.datetime.now().strftime(f"%Y%m%d-%H%M%S_{self._execucoes:04}_{nome}")
+
+        options = monta_options(dados, dict(self.options, cachequente=self.cache))
+        options["outputpath"] = pasta = os.path.join(self.pastasaida, execucao)
+
+        log = io.StringIO()
+        erro = ""
+        inicio = time.perf_counter()
+
+        saida = _saida_por_thread()
+        saida.redireciona(log)
+        try:
+            analise.carrega()(options=options).run()
+        except SystemExit as e:
+            erro = f"A anlise terminou antes do fim (exit {e.code}), veja o log"
+        except Exception as e:
+            erro = f"{e.__class__.__name__}: {e}"
+            traceback.print_exc(file=log)
+        finally:
+            saida.redireciona(None)
+
+        r = ResultadoTarefa(
+            nome, options["answers"].get("#PERIODO"), not erro, time.perf_counter() - inicio, pasta, erro
+        )
+
+        arquivos = []
+        for raiz, _, nomes in os.walk(pasta):
+            for n in sorted(nomes):
+                relativo = os.path.relpath(os.path.join(raiz, n), pasta).replace(os.sep, "/")
+                arquivos.append(f"/arquivos/{execucao}/{relativo}")
+
+        retval = r._asdict()
+        retval.update(execucao=execucao, arquivos=arquivos, log=log.getvalue())
+        return retval
+
+    def arquivo(self, caminho):
+        """Caminho no disco de um arquivo gerado, sem sair de self.pastasaida."""
+        base = os.path.realpath(self.pastasaida)
+        fpath = os.path.realpath(os.path.join(base, *caminho.split("/")))
+        if os.path.commonpath([base, fpath]) != base or not os.path.isfile(fpath):
+            raise KeyError(caminho)
+        return fpath
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = "SISPOS"
+
+    def do_GET(self):
+        self._atende("GET")
+
+    def do_POST(self):
+        self._atende("POST")
+
+    def _atende(self, metodo):
+        servico = self.server.servico
+        partes = [unquote(p) for p in urlsplit(self.path).path.split("/") if p]
+
+        try:
+            if metodo == "GET" and partes == ["analises"]:
+                return self._json(servico.analises())
+            if metodo == "GET" and partes == ["periodos"]:
+                return self._json(servico.periodos())
+            if metodo == "GET" and len(partes) == 2 and partes[0] == "periodos":
+                if not partes[1].isdigit():
+                    return self._json({"erro": f"ID de perodo invlido: {partes[1]}"}, 400)
+                return self._json(servico.parametros(int(partes[1])))
+            if metodo == "GET" and len(partes) == 2 and partes[0] == "tabelas":
+                return self._json(servico.tabela(partes[1]))
+            if metodo == "GET" and len(partes) > 2 and partes[0] == "arquivos":
+                return self._arquivo(servico.arquivo("/".join(partes[1:])))
+            if metodo == "POST" and len(partes) == 2 and partes[0] == "analises":
+                dados = self._corpo()
+                if not isinstance(dados, dict):
+                    return self._json({"erro": "O corpo deve ser um objeto JSON"}, 400)
+                return self._json(servico.executa(partes[1], dados))
+            if metodo == "POST" and partes == ["cache", "limpa"]:
+                servico.cache.limpa()
+                return self._json({"ok": True})
+        except KeyError as e:
+            return self._json({"erro": f"No encontrado: {e.args[0]}"}, 404)
+        except ValueError as e:
+            return self._json({"erro": str(e)}, 400)
+        except SystemExit:
+            # getsqldata() sai do programa quando a consulta falha, o motivo fica no console
+            return self._json({"erro": "Falha ao executar a consulta SQL"}, 500)
+        except Exception as e:
+            traceback.print_exc()
+            return self._json({"erro": f"{e.__class__.__name__}: {e}"}, 500)
+
+        return self._json({"erro": f"Caminho invlido: {metodo} {self.path}"}, 404)
+
+    def _corpo(self):
+        tamanho = int(self.headers.get("Content-Length") or 0)
+        if not tamanho:
+            return {}
+        return json.loads(self.rfile.read(tamanho).decode("utf-8"))
+
+    def _json(self, dados, status=200):
+        corpo = json.dumps(dados, ensure_ascii=False, default=str).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(corpo)))
+        self.end_headers()
+        self.wfile.write(corpo)
+
+    def _arquivo(self, fpath):
+        with open(fpath, "rb") as f:
+            corpo = f.read()
+        tipo = mimetypes.guess_type(fpath)[0] or "application/octet-stream"
+        self.send_response(200)
+        self.send_header("Content-Type", tipo)
+        self.send_header("Content-Length", str(len(corpo)))
+        self.end_headers()
+        self.wfile.write(corpo)
+
+
+def serve(menu, porta=PORTA, options=None):
+    """Sobe o servio em 127.0.0.1:`porta` e atende at Ctrl+C."""
+    servico = Servico(menu, options)
+
+    # J busca a lista de perodos, o primeiro pedido no espera por ela
+    try:
+        servico.cache.periodos()
+    except Exception as e:
+        print(f"Aviso: no foi possvel listar os perodos agora ({e})")
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", porta), _Handler)
+    httpd.daemon_threads = True
+    httpd.servico = servico
+
+    print(f"SISPOS em modo servio: http://127.0.0.1:{porta}/ (Ctrl+C para sair)")
+    print(f"Arquivos gerados em: {servico.pastasaida}")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        print("\nSaindo do modo servio...")
+    finally:
+        httpd.server_close()
+        if isinstance(sys.stdout, _SaidaPorThread):
+            sys.stdout = sys.stdout.padrao
@@ -4,8 +4,11 @@ import datetime
 import os
 import re
 import json
-from .filefinder import findfile, findfilel
-from sisposbase.get_sql_data import get_periodo_data, get_periodo_additional_data
+from .filefinder import findfile, findfilel, indice, loadfile
+from sisposbase import exportacao
+from sisposbase.catalogo import catalogo_padrao
+from sisposbase.get_sql_data import get_periodo_data, levanta_erros_sql
+from sisposbase.perfil import Perfil, capturas
 
 BASEPATH = os.getcwd()
 
@@ -20,6 +23,10 @@ create_if_nonexistent = (INPUTPATH, OUTPUTPATH)
 [os.mkdir(x) for x in create_if_nonexistent if not os.path.exists(x)]
 
 
+class FaltaResposta(Exception):
+    """Modo no interativo: falta a resposta de uma pergunta ou o caminho de um arquivo."""
+
+
 class BaseSISPOS:
     # FILL THIS IN
     findfiles = []
@@ -28,12 +35,11 @@ class BaseSISPOS:
     outputpath = OUTPUTPATH
     datafilepath = DATAFILEPATH
 
-    inputfiles = {}
+    # Encoding dos arquivos de entrada para l-los linha a linha sob demanda
+    # (filefinder.LinhasMapeadas); None entrega o arquivo inteiro em bytes.
+    inputencoding = None
 
-    outputfiles = {}
-    outputfileno = 0
-
-    txtlog = []
+    # inputfiles, outputfiles e txtlog so criados em __init__, um por instncia.
     canrun = False
 
     def getdatafile(self, filename, encoding="windows-1252", inside=""):
@@ -48,7 +54,40 @@ class BaseSISPOS:
     def dynfindfiles(self):
         pass  # self.findfiles.append ( (xx,xx) )...
 
-    def __init__(self):
+    # Override me to create the data the analysis accumulates (never as class attributes!)
+    def initstate(self):
+        pass  # self.jdata = {}...
+
+    def __init__(self, options=None):
+        # Opes de linha de comando (ex.: {"run": True, "jobs": 4})
+        self.options = dict(options or {})
+
+        # Modo no interativo: as respostas (perguntas e arquivos) vm de options["answers"]
+        # e nada  perguntado; se faltar alguma,  erro.
+        self.batch = bool(self.options.get("batch"))
+        self.answers = dict(self.options.get("answers") or {})
+
+        # Pasta de sada prpria (ex.: uma por tarefa, em SisposRunner.run_many)
+        self.outputbase = self.options.get("outputpath") or OUTPUTPATH
+        os.makedirs(self.outputbase, exist_ok=True)
+        self.outputpath = self.outputbase
+
+        # Todo o estado  da instncia: vrias anlises (ou a mesma, vrias vezes)
+        # podem rodar no mesmo processo, inclusive ao mesmo tempo em threads.
+        self.inputfiles = {}
+        self.outputfiles = {}
+        self.outputfileno = 0
+        self.txtlog = []
+
+        # Cpia da lista da classe, dynfindfiles() acrescenta nela
+        self.findfiles = list(self.findfiles)
+
+        self.initstate()
+
+        # Tempos das etapas e das consultas, gravados ao lado dos arquivos gerados (ver sisposbase.perfil)
+        cpu, memoria = capturas(self.options.get("perfil"))
+        self.perfil = Perfil(self.__class__.__name__, cpu, memoria)
+
         print("-----------------------------")
         print(f"Modulo {self.__class__.__name__}")
         print("-----------------------------")
@@ -58,38 +97,59 @@ class BaseSISPOS:
         self.dynfindfiles()
 
         if self.findfiles:
-            # Arquivos
-            files = [_f for _f in self.findfiles if not _f[0][0] == "#"]
-            print("Precisamos de %d arquivo(s)...\n" % len(files))
-            for entry in files:
-                fname, freg = entry
-                outfname, outdata = findfilel(self.inputpath, fname, freg)
-                if outfname and outdata:
-                    if fname[0] == "!":
-                        self.inputfiles[fname] = outfname
-                    else:
-                        self.inputfiles[fname] = outdata
-                print("")
+            # No modo no interativo uma consulta que falha  um erro (status != 0), no uma sada normal
+            with self.etapa("perguntas"), levanta_erros_sql(self.batch):
+                # Perguntas
+                questions = [_q for _q in self.findfiles if _q[0][0] == "#"]
+                print("Precisamos fazer %d pergunta(s)...\n" % (len(questions)))
+                for entry in questions:
+                    fname, fquestionprompt = entry
+
+                    if callable(fquestionprompt):
+                        # Instead of asking the question, call the method to fill the data.
+                        self.inputfiles[fname] = fquestionprompt(self)
 
-            # Perguntas
-            questions = [_q for _q in self.findfiles if _q[0][0] == "#"]
-            print("Precisamos fazer %d pergunta(s)...\n" % (len(questions)))
-            for entry in questions:
-                fname, fquestionprompt = entry
-
-                if callable(fquestionprompt):
-                    # Instead of asking the question, call the method to fill the data.
-                    self.inputfiles[fname] = fquestionprompt(self)
-
-                else:
-                    # Ask question
-                    outdata = input(fquestionprompt + " ? ")
-                    if outdata:
-                        self.inputfiles[fname] = outdata
-                    elif fname[1] == "#":
-                        print("Pergunta opcional, deixada em branco [ok].")
-                        self.inputfiles[fname] = ""
-                print("")
+                    else:
+                        # Ask question
+                        if self.batch and fname[1] == "#" and self.resposta(fname) is None:
+                            outdata = ""
+                        else:
+                            outdata = self.ask(fname, fquestionprompt)
+                        if outdata:
+                            self.inputfiles[fname] = outdata
+                        elif fname[1] == "#":
+                            print("Pergunta opcional, deixada em branco [ok].")
+                            self.inputfiles[fname] = ""
+                    print("")
+
+            with self.etapa("arquivos"):
+                # Arquivos (depois das perguntas: com o ms e o ano j sabemos qual arquivo procurar)
+                periodo = self.periodo_pedido()
+                files = [_f for _f in self.findfiles if not _f[0][0] == "#"]
+                print("Precisamos de %d arquivo(s)...\n" % len(files))
+                for entry in files:
+                    fname, freg = entry
+                    fpath = self.resposta(fname)
+                    if fpath is None and self.batch and periodo is not None:
+                        # O arquivo mais recente do perodo em inputs/
+                        achado = indice(self.inputpath).escolhe(freg, periodo)
+                        fpath = achado.caminho if achado else None
+                    if fpath is not None:
+                        outfname, outdata = loadfile(self.inputpath, fname, fpath, self.inputencoding)
+                    elif self.batch:
+                        raise FaltaResposta(
+                            f'Modo no interativo: falta o caminho do arquivo "{fname.lstrip("#!")}"'
+                        )
+                    else:
+                        outfname, outdata = findfilel(
+                            self.inputpath, fname, freg, self.inputencoding, periodo
+                        )
+                    if outfname and outdata:
+                        if fname[0] == "!":
+                            self.inputfiles[fname] = outfname
+                        else:
+                            self.inputfiles[fname] = outdata
+                    print("")
 
             # Garantir que temos tudo que precisamos
             try:
@@ -102,26 +162,80 @@ class BaseSISPOS:
         else:
             print("Sem arquivos de entrada")
 
+    def etapa(self, nome):
+        """Marca uma etapa da anlise: with self.etapa("html"): ... (ver sisposbase.perfil)."""
+        return self.perfil.etapa(nome)
+
+    def grava_perfil(self):
+        """Grava os tempos desta execuo ao lado dos arquivos gerados."""
+        caminho = self.perfil.grava(self.outputpath)
+        print(f"\nTempos desta execuo: {os.path.basename(caminho)}")
+        return caminho
+
+    def periodo_pedido(self):
+        """(mes, ano com 2 dgitos) das respostas #MES e #ANO, ou None se ainda no houver."""
+        try:
+            return int(self.inputfiles["#MES"]), int(str(self.inputfiles["#ANO"])[-2:])
+        except (KeyError, ValueError):
+            return None
+
+    def resposta(self, key):
+        """Resposta dada de antemo (linha de comando ou arquivo de tarefas), ou None."""
+        for k in (key, key.lstrip("#!")):
+            if k in self.answers:
+                return str(self.answers[k])
+        return None
+
+    def ask(self, key, prompt, sep=" ? "):
+        """Pergunta ao usurio, a no ser que a resposta de `key` j tenha sido dada."""
+        answer = self.resposta(key)
+        if answer is not None:
+            print(f"{prompt}{sep}{answer}")
+            return answer
+
+        if self.batch:
+            raise FaltaResposta(
+                f'Modo no interativo: falta a resposta de "{key.lstrip("#!")}" ({prompt})'
+            )
+
+        return input(prompt + sep)
+
     def run(self):
         if self.canrun:
             print("Calculando...\n")
-            retval = self.process(self.inputfiles)
+            self.perfil.inicia_captura()
+            try:
+                with self.etapa("process"), levanta_erros_sql(self.batch):
+                    retval = self.process(self.inputfiles)
+            finally:
+                self.perfil.termina_captura()
 
             # Fecha todos os arquivos que foram gerados e reporta em tela.
-            self.closeall_and_report_files()
-            input(
-                "\n---- Fim do processamento, pressione ENTER para finalizar o programa ----"
-            )
+            with self.etapa("fechamento"):
+                self.closeall_and_report_files()
+            self.grava_perfil()
+            if not self.batch:
+                input(
+                    "\n---- Fim do processamento, pressione ENTER para finalizar o programa ----"
+                )
             return retval
         else:
             print(
                 "ERRO: O modulo nao pode ser executado pois faltam arquivos de entrada!"
             )
-            input("--pressione enter--")
+            if not self.batch:
+                input("--pressione enter--")
             exit(1)
 
     def getoutputfile(
-        self, append="", ext="txt", fmode="w", inside="", override_name="", encoding="windows-1252"
+        self,
+        append="",
+        ext="txt",
+        fmode="w",
+        inside="",
+        override_name="",
+        encoding="windows-1252",
+        buffering=-1,
     ):
         fname = "%s_%s_%d.%s" % (
             self.__class__.__name__,
@@ -136,25 +250,53 @@ class BaseSISPOS:
             override_name if override_name else fname,
         )
 
-        # open file
-        ofile = open(fpath, fmode, encoding=encoding)
+        # open file (buffering: ex. relatorio.TAMANHO_BUFFER para relatrios grandes)
+        ofile = open(fpath, fmode, buffering, encoding=encoding)
 
         # insert the reference into a dictionary as well (for closing everything later)
         self.outputfiles[self.outputfileno] = ofile
 
         return ofile
 
-    def getoutputfolder(self, append=""):
-        if self.outputpath != OUTPUTPATH:
+    def exporta(self, append, colunas, **extra):
+        """Grava dados agregados da anlise num arquivo colunar tipado, se pedido (--exporta).
+
+        colunas: sisposbase.columnar.Colunas (ex.: colunas_de_valores()); o formato e os
+        tipos esto em sisposbase.exportacao. Devolve o arquivo gerado, ou None.
+        """
+        pedido = self.options.get("exporta")
+        if not pedido:
+            return None
+
+        formato = exportacao.formato_disponivel(pedido)
+
+        # Quem gerou e de que perodo, junto com os dados
+        extra = {"analise": self.__class__.__name__, **extra}
+        for chave in ("#PERIODOID", "#MES", "#ANO"):
+            if chave in self.inputfiles:
+                extra.setdefault(chave.lstrip("#").lower(), self.inputfiles[chave])
+
+        ofile = self.getoutputfile(
+            append=append, ext=exportacao.EXTENSOES[formato], fmode="wb", encoding=None
+        )
+        exportacao.grava(ofile, colunas, formato, extra)
+        return ofile
+
+    def getoutputfolder(self, append="", reutiliza=False):
+        if self.outputpath != self.outputbase:
             raise Exception("A funo getoutputfolder() s deve ser chamada UMA vez")
 
-        nowstr = datetime.datetime.now().strftime("%S")
+        if reutiliza:
+            # Pasta fixa, reaproveitada entre execues
+            newpath = f"{self.__class__.__name__.lower()}_{append}"
+        else:
+            nowstr = datetime.datetime.now().strftime("%S")
+            newpath = f"{self.__class__.__name__.lower()}_{append}__{nowstr}"
 
-        newpath = f"{self.__class__.__name__.lower()}_{append}__{nowstr}"
-        newpath_out = os.path.join(OUTPUTPATH, newpath)
+        newpath_out = os.path.join(self.outputbase, newpath)
 
         # Cria
-        os.mkdir(newpath_out)
+        os.makedirs(newpath_out, exist_ok=reutiliza)
 
         # Substitui o outputpath para o novo
         self.outputpath = newpath_out
@@ -189,7 +331,17 @@ class BaseSISPOS:
 
 class BaseSISPOSSQL(BaseSISPOS):
     def pega_periodo_and_get_data(self):
-        periodoid, mes, ano, fechadoem, dtini, dtfim = periododata = get_periodo_data()
+        periodoid = self.resposta("#PERIODO")
+        if periodoid is None and self.batch:
+            raise FaltaResposta('Modo no interativo: falta o ID do perodo ("PERIODO")')
+
+        # Perodos e parmetros vm do catlogo local (no modo servio, o do servico.CacheQuente)
+        cache = self.options.get("cachequente")
+        catalogo = cache.catalogo if cache else catalogo_padrao()
+
+        periodoid, mes, ano, fechadoem, dtini, dtfim = periododata = get_periodo_data(
+            periodoid, catalogo
+        )
 
         f = self.inputfiles
 
@@ -200,7 +352,7 @@ class BaseSISPOSSQL(BaseSISPOS):
         self.inputfiles["#DTFIM"] = dtfim
 
         # Com o perodo escolhido, pega parametros adicionais.
-        dias_uteis, dias_1, dias_2 = get_periodo_additional_data(periodoid)
+        dias_uteis, dias_1, dias_2 = catalogo.parametros(periodoid)
 
         # Print chosen Period
         print(f"\nPERODO SELECIONADO --> {f['#MES']}/{f['#ANO']}")
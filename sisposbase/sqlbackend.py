@@ -0,0 +1,351 @@
+# -*- coding: windows-1252 -*-
+"""
+Camada de execuo de SQL usada por getsqldata().
+
+Cada backend recebe o cdigo SQL j com as variveis substitudas e devolve
+uma lista de "result sets". Cada result set  uma lista de linhas (listas de
+strings), sendo a primeira linha sempre o cabealho, exatamente como o
+SingleSQLExecutor.exe grava no arquivo de sada.
+
+Backends disponveis:
+  - ExecutableBackend: um processo do SingleSQLExecutor.exe por consulta (padro).
+  - ODBCBackend: pool de conexes persistentes via pyodbc.
+  - SQLiteBackend: banco SQLite local, para testes sem acesso ao servidor.
+
+O backend  escolhido pelas variveis de ambiente:
+  SISPOS_SQL_BACKEND = exe | odbc | sqlite
+  SISPOS_ODBC        = string de conexo ODBC
+  SISPOS_SQLITE      = caminho do arquivo .sqlite
+"""
+import datetime
+import os
+import queue
+import re
+import shutil
+import sqlite3
+import subprocess
+import tempfile
+import threading
+import uuid
+from contextlib import contextmanager
+from decimal import Decimal
+
+try:
+    # pyodbc  opcional, sem ele usamos o executvel.
+    import pyodbc
+except ImportError:
+    pyodbc = None
+
+# Executable path of the program that connects to the Database
+sqlrunner_path = os.path.join(os.getcwd(), "tools", "SingleSQLExecutor.exe")
+
+
+class SQLExecutionError(Exception):
+    pass
+
+
+class SQLBackend:
+    def itera(self, sqlcode: str):
+        """Gera um iterador de linhas para cada result set,  medida que chegam."""
+        # OVERRIDE THIS FUNCTION
+        raise NotImplementedError
+
+    def executa(self, sqlcode: str) -> list:
+        return [list(rs) for rs in self.itera(sqlcode)]
+
+    def fecha(self):
+        pass
+
+    def identidade(self) -> str:
+        """De onde vm os resultados (classe e banco), para o cache no misturar bancos diferentes.
+
+        Sem saber qual  o banco, vale s para esta instncia: nada  reaproveitado entre execues.
+        """
+        if not hasattr(self, "_identidade"):
+            self._identidade = f"{self.__class__.__name__}:{uuid.uuid4().hex}"
+        return self._identidade
+
+
+def itera_sqlexecutor_output(linhas):
+    """Separa as linhas do texto gerado pelo SingleSQLExecutor.exe em result sets.
+
+    Os result sets so separados por uma linha em branco. Cada result set 
+    entregue como um gerador; se no for consumido at o fim, o restante 
+    descartado antes de passar ao prximo.
+    """
+    linhas = iter(linhas)
+
+    # Pula linhas em branco no incio do arquivo
+    primeira = next((x for x in linhas if x.strip()), None)
+
+    while primeira is not None:
+        proxima = []
+
+        def resultset(primeira=primeira, proxima=proxima):
+            # Ignore the last field of each line, which is always blank.
+            yield primeira.strip().split("|")[:-1]
+            for linha in linhas:
+                if not linha.strip():
+                    # Fim deste result set, procura o incio do prximo
+                    proxima.append(next((x for x in linhas if x.strip()), None))
+                    return
+                yield linha.strip().split("|")[:-1]
+            proxima.append(None)
+
+        rs = resultset()
+        yield rs
+
+        # Consome o que sobrou deste result set
+        for _ in rs:
+            pass
+
+        primeira = proxima[0]
+
+
+def parse_sqlexecutor_output(_ed: str) -> list:
+    """Separa o texto gerado pelo SingleSQLExecutor.exe em result sets."""
+    return [list(rs) for rs in itera_sqlexecutor_output(_ed.split("\r\n"))]
+
+
+class ExecutableBackend(SQLBackend):
+    """Executa cada consulta em um processo do SingleSQLExecutor.exe."""
+
+    def __init__(self, caminho=sqlrunner_path):
+        self.caminho = caminho
+
+    def identidade(self) -> str:
+        # O banco  o configurado para o executvel
+        return f"ExecutableBackend:{os.path.normcase(os.path.abspath(self.caminho))}"
+
+    def itera(self, sqlcode: str):
+        # Create TMPDIR
+        tmpdir = tempfile.mkdtemp()
+
+        try:
+            # Write sqlcode to TMPDIR
+            sqlfp = os.path.join(tmpdir, "sqlcode.sql")
+            with open(sqlfp, "wb") as sqlf:
+                # encode sql code to "windows-1252" encoding, to properly handle accents.
+                sqlf.write(sqlcode.encode("windows-1252"))
+
+            # Create output file
+            outf = os.path.join(tmpdir, "out.txt")
+
+            # Run it!
+            process = subprocess.run([self.caminho, sqlfp, outf], capture_output=True)
+
+            # Bail if failed
+            if process.returncode != 0:
+                raise SQLExecutionError(process.stdout.decode())
+
+            # Read data, line by line
+            with open(outf, "r", encoding="windows-1252", newline="\r\n") as data:
+                yield from itera_sqlexecutor_output(data)
+
+        finally:
+            # Delete tempdir
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+def formata_valor(valor) -> str:
+    """Converte um valor vindo do driver para o texto que o SingleSQLExecutor.exe gravaria."""
+    if valor is None:
+        return ""
+    if isinstance(valor, (Decimal, float)):
+        # O executvel usa vrgula como separador decimal.
+        return str(valor).replace(".", ",")
+    if isinstance(valor, datetime.datetime):
+        return valor.strftime("%d/%m/%Y %H:%M:%S")
+    if isinstance(valor, datetime.date):
+        return valor.strftime("%d/%m/%Y")
+    return str(valor)
+
+
+def sem_senha(connstr: str) -> str:
+    """A string de conexo sem a senha (PWD=...), para identificar o banco sem guard-la."""
+    return re.sub(r"(?i)\b(pwd|password)\s*=\s*(\{[^}]*\}|[^;]*);?", "", connstr).strip(" ;")
+
+
+def separa_comandos(sqlcode: str) -> list:
+    """Quebra um script em comandos completos (para drivers que no aceitam lotes)."""
+    comandos = []
+    atual = ""
+    for pedaco in sqlcode.split(";"):
+        atual += pedaco + ";"
+        if sqlite3.complete_statement(atual):
+            if atual.strip(" \t\r\n;"):
+                comandos.append(atual)
+            atual = ""
+    if atual.strip(" \t\r\n;"):
+        comandos.append(atual)
+    return comandos
+
+
+class PooledDBAPIBackend(SQLBackend):
+    """Pool de conexes DB-API reaproveitadas entre as consultas."""
+
+    def __init__(self, connect, tamanho=4, lote=True):
+        # connect() deve devolver uma nova conexo DB-API.
+        self.connect = connect
+        self.tamanho = tamanho
+
+        # lote=False: executa comando por comando, para drivers sem nextset().
+        self.lote = lote
+
+        self._livres = queue.LifoQueue()
+        self._vagas = threading.BoundedSemaphore(tamanho)
+
+    @contextmanager
+    def conexao(self):
+        self._vagas.acquire()
+        try:
+            try:
+                conn = self._livres.get_nowait()
+            except queue.Empty:
+                conn = self.connect()
+
+            try:
+                yield conn
+            except BaseException:
+                # Conexo em estado desconhecido, descarte.
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+                raise
+            else:
+                self._livres.put(conn)
+        finally:
+            self._vagas.release()
+
+    @staticmethod
+    def _linhas(cursor, tamanho_lote=1000):
+        yield [c[0] for c in cursor.description]
+        while True:
+            rows = cursor.fetchmany(tamanho_lote)
+            if not rows:
+                break
+            for row in rows:
+                yield [formata_valor(v) for v in row]
+
+    def itera(self, sqlcode: str):
+        try:
+            with self.conexao() as conn:
+                cursor = conn.cursor()
+                try:
+                    if self.lote:
+                        cursor.execute(sqlcode)
+                        while True:
+                            # Comandos sem resultado (DECLARE, SET, ...) no geram result set.
+                            if cursor.description:
+                                rs = self._linhas(cursor)
+                                yield rs
+                                for _ in rs:
+                                    pass
+                            if not cursor.nextset():
+                                break
+                    else:
+                        for comando in separa_comandos(sqlcode):
+                            cursor.execute(comando)
+                            if cursor.description:
+                                rs = self._linhas(cursor)
+                                yield rs
+                                for _ in rs:
+                                    pass
+                finally:
+                    cursor.close()
+        except SQLExecutionError:
+            raise
+        except Exception as e:
+            raise SQLExecutionError(str(e)) from e
+
+    def fecha(self):
+        while True:
+            try:
+                self._livres.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+class ODBCBackend(PooledDBAPIBackend):
+    """Conexes persistentes ao SQL Server via pyodbc."""
+
+    def __init__(self, connstr, tamanho=4):
+        if pyodbc is None:
+            raise SQLExecutionError("O mdulo pyodbc no est instalado")
+
+        self.connstr = connstr
+
+        def connect():
+            conn = pyodbc.connect(connstr, autocommit=True)
+            # Evita result sets vazios de contagem de linhas entre os SELECTs.
+            conn.execute("SET NOCOUNT ON")
+            return conn
+
+        super().__init__(connect, tamanho=tamanho, lote=True)
+
+    def identidade(self) -> str:
+        return f"ODBCBackend:{sem_senha(self.connstr)}"
+
+
+class SQLiteBackend(PooledDBAPIBackend):
+    """Banco SQLite local que substitui o servidor em testes offline."""
+
+    def __init__(self, caminho=":memory:", tamanho=4):
+        if caminho == ":memory:":
+            # Todas as conexes precisam enxergar o mesmo banco em memria
+            # (nome nico: outro banco em memria nunca tem a mesma identidade).
+            caminho = f"file:sispos_{uuid.uuid4().hex}?mode=memory&cache=shared"
+        elif not caminho.startswith("file:"):
+            caminho = os.path.abspath(caminho)
+        self.caminho = caminho
+
+        def connect():
+            return sqlite3.connect(caminho, uri=caminho.startswith("file:"), check_same_thread=False)
+
+        super().__init__(connect, tamanho=tamanho, lote=False)
+
+        # Mantm o banco em memria vivo enquanto o backend existir.
+        self._ancora = connect()
+
+    def identidade(self) -> str:
+        return f"SQLiteBackend:{os.path.normcase(self.caminho)}"
+
+    def fecha(self):
+        super().fecha()
+        self._ancora.close()
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def backend_padrao() -> SQLBackend:
+    escolha = os.environ.get("SISPOS_SQL_BACKEND", "").strip().lower()
+    connstr = os.environ.get("SISPOS_ODBC", "")
+
+    if escolha == "sqlite":
+        return SQLiteBackend(os.environ.get("SISPOS_SQLITE", ":memory:"))
+
+    if escolha in ("odbc", "") and connstr:
+        if pyodbc is not None:
+            return ODBCBackend(connstr)
+        print("Aviso: pyodbc no est disponvel, usando o SingleSQLExecutor.exe")
+
+    return ExecutableBackend()
+
+
+def get_backend() -> SQLBackend:
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = backend_padrao()
+        return _backend
+
+
+def set_backend(backend: SQLBackend):
+    global _backend
+    with _backend_lock:
+        if _backend is not None and _backend is not backend:
+            _backend.fecha()
+        _backend = backend
@@ -0,0 +1,160 @@
+# -*- coding: windows-1252 -*-
+"""
+Cache em disco dos resultados de getsqldata().
+
+A chave  o hash do SQL final (j com as variveis substitudas) e do banco
+que o executa (SQLBackend.identidade(): o executvel, a string de conexo
+ODBC ou o arquivo SQLite), assim uma execuo contra outro banco (ex.:
+SISPOS_SQL_BACKEND=sqlite) nunca aproveita nem estraga o cache da produo.
+O ID do perodo (#PERIODOID)  gravado junto como etiqueta: resultados de
+perodos fechados nunca expiram, os de perodos abertos (ou sem perodo)
+expiram depois de SISPOS_CACHE_TTL segundos.
+
+Gravar no cache  s um atalho: se no der (ex.: no Windows, outra execuo
+est lendo a mesma entrada), o resultado  entregue do mesmo jeito.
+
+Os resultados so gravados no mesmo formato de texto do SingleSQLExecutor.exe,
+assim a leitura do cache usa o mesmo caminho de leitura do executvel.
+
+  SISPOS_CACHE=0        desliga o cache
+  SISPOS_CACHE_TTL=600  validade (segundos) para perodos abertos
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+from sisposbase.sqlbackend import get_backend
+
+CACHEPATH = os.path.join(os.getcwd(), "cache", "sql")
+
+# Liga/desliga o cache
+ativo = os.environ.get("SISPOS_CACHE", "1") != "0"
+
+# Validade dos resultados de perodos abertos, em segundos.
+ttl_aberto = int(os.environ.get("SISPOS_CACHE_TTL", "600"))
+
+# --refresh: ignora o que est no cache, mas grava os novos resultados.
+refresh = False
+
+# Situao dos perodos conhecidos: {periodoid: fechado?}
+_fechados = {}
+_lock = threading.Lock()
+
+
+def marca_periodo(periodoid, fechado: bool):
+    with _lock:
+        _fechados[int(periodoid)] = bool(fechado)
+
+
+def periodo_esta_fechado(periodoid) -> bool:
+    if periodoid is None:
+        return False
+    with _lock:
+        return _fechados.get(int(periodoid), False)
+
+
+def banco_atual() -> str:
+    """Identidade do backend em uso (ver SQLBackend.identidade())."""
+    return get_backend().identidade()
+
+
+def pasta_do_banco(banco=None) -> str:
+    """Nome curto e estvel do banco, para separar caches em disco (ex.: cache/historico)."""
+    return hashlib.sha256((banco or banco_atual()).encode("utf-8")).hexdigest()[:16]
+
+
+def chave(sqlcode: str, banco=None) -> str:
+    """Hash do SQL e do banco que o executa (padro: o backend em uso)."""
+    banco = banco or banco_atual()
+    return hashlib.sha256(f"{banco}\n{sqlcode}".encode("utf-8")).hexdigest()
+
+
+def _caminhos(sqlcode: str, banco: str):
+    k = chave(sqlcode, banco)
+    return os.path.join(CACHEPATH, k + ".txt"), os.path.join(CACHEPATH, k + ".json")
+
+
+def esta_valido(criado: float, periodoid=None) -> bool:
+    """Diz se um resultado gerado em `criado` (timestamp) ainda vale."""
+    if periodo_esta_fechado(periodoid):
+        return True
+    return (time.time() - criado) <= ttl_aberto
+
+
+def abre(sqlcode: str, periodoid=None, banco=None):
+    """Devolve um iterador das linhas em cache, ou None se no houver entrada vlida."""
+    if not ativo or refresh:
+        return None
+
+    banco = banco or banco_atual()
+    txtpath, metapath = _caminhos(sqlcode, banco)
+    try:
+        with open(metapath, "r", encoding="utf-8") as fm:
+            meta = json.load(fm)
+        if meta["banco"] != banco or not esta_valido(meta["criado"], periodoid):
+            return None
+        # Aberto j aqui: se o .txt sumiu, a consulta vai ao banco
+        data = open(txtpath, "r", encoding="windows-1252", newline="\r\n")
+    except (OSError, ValueError, KeyError):
+        return None
+    return _le_linhas(data)
+
+
+def _le_linhas(data):
+    with data:
+        yield from data
+
+
+def grava_enquanto_le(sqlcode: str, periodoid, result_sets, banco=None):
+    """Repassa os result sets do backend e grava uma cpia no cache.
+
+    A entrada s  publicada se todos os result sets forem lidos at o fim.
+    """
+    if not ativo:
+        yield from result_sets
+        return
+
+    banco = banco or banco_atual()
+    os.makedirs(CACHEPATH, exist_ok=True)
+    txtpath, metapath = _caminhos(sqlcode, banco)
+    fd, tmppath = tempfile.mkstemp(dir=CACHEPATH, suffix=".tmp")
+
+    completo = False
+    try:
+        with open(fd, "w", encoding="windows-1252", errors="replace", newline="") as ft:
+            for resultsetno, rs in enumerate(result_sets):
+                if resultsetno:
+                    ft.write("\r\n")
+
+                copia = _copia_linhas(rs, ft)
+                yield copia
+
+                # Garante que o resto deste result set tambm v para o cache
+                for _ in copia:
+                    pass
+            completo = True
+
+        if completo:
+            try:
+                os.replace(tmppath, txtpath)
+                meta = {"periodo": periodoid, "criado": time.time(), "banco": banco}
+                with open(metapath, "w", encoding="utf-8") as fm:
+                    json.dump(meta, fm)
+            except OSError:
+                # Ex.: outra execuo est lendo esta entrada (Windows). Fica sem cache desta vez.
+                pass
+    finally:
+        try:
+            if os.path.exists(tmppath):
+                os.remove(tmppath)
+        except OSError:
+            pass
+
+
+def _copia_linhas(rs, ft):
+    for linha in rs:
+        ft.write("|".join(linha) + "|\r\n")
+        yield linha
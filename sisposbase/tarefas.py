@@ -0,0 +1,99 @@
+# -*- coding: windows-1252 -*-
+"""
+Arquivo de tarefas do modo no interativo (JSON ou TOML).
+
+Uma anlise:
+
+    {"analise": "Criticas", "periodo": 123}
+
+Vrias anlises, com os valores comuns no topo (TOML):
+
+    periodo = 123
+
+    [[analises]]
+    analise = "Criticas"
+
+    [[analises]]
+    analise = "Sispre"
+    lote = "mensal"
+    run = true
+
+    [[analises]]
+    analise = "HHReal"
+    respostas = { MES = "01", ANO = "2013", HHREAL = "inputs/hhreal_0113.txt" }
+
+Chaves de cada tarefa:
+  analise    nome da anlise
+  periodo    ID do perodo de apropriao, ou "ultimo-aberto", "ultimo-fechado"...
+  periodo_inicial
+             Tendencias: o primeiro perodo (os de "periodo" at ele)
+  lote       nome do lote do Sispre
+  respostas  pergunta ou arquivo -> resposta (ex.: MES, ANO, HHREAL)
+  run, jobs, incremental, perfil, exporta
+             as mesmas opes da linha de comando (exporta: "parquet", "feather",
+             "colunar" ou "auto")
+
+As anlises do arquivo rodam em paralelo, veja SisposRunner.run_tarefas().
+"""
+import json
+from collections import namedtuple
+
+try:
+    # tomllib s existe a partir do Python 3.11
+    import tomllib
+except ImportError:
+    tomllib = None
+
+Tarefa = namedtuple("Tarefa", "analise options")
+
+# Resultado de uma tarefa executada por SisposRunner.run_tarefas()
+ResultadoTarefa = namedtuple("ResultadoTarefa", "analise periodo ok segundos pasta erro")
+
+# Opes que passam direto da tarefa para BaseSISPOS.options
+_opcoes = ("run", "jobs", "refresh", "incremental", "perfil", "exporta")
+
+
+def monta_options(dados: dict, base=None, batch=True) -> dict:
+    """Junta as opes de uma tarefa (ou da linha de comando) sobre as opes `base`."""
+    options = dict(base or {})
+
+    answers = dict(options.get("answers") or {})
+    answers.update(dados.get("respostas") or {})
+    if dados.get("periodo") is not None:
+        answers["#PERIODO"] = dados["periodo"]
+    if dados.get("periodo_inicial") is not None:
+        answers["#PERIODOINI"] = dados["periodo_inicial"]
+    if dados.get("lote"):
+        answers["#SCRIPTNAME"] = dados["lote"]
+
+    for k in _opcoes:
+        if dados.get(k) is not None:
+            options[k] = dados[k]
+
+    options["answers"] = answers
+    options["batch"] = batch or bool(options.get("batch"))
+    return options
+
+
+def le_tarefas(caminho: str, base=None) -> list:
+    """L o arquivo de tarefas e devolve uma lista de Tarefa, sempre em modo no interativo."""
+    with open(caminho, "rb") as fh:
+        conteudo = fh.read().decode("utf-8")
+
+    if caminho.lower().endswith(".toml"):
+        if tomllib is None:
+            raise Exception("Arquivos de tarefas em TOML precisam do Python 3.11 ou mais novo")
+        dados = tomllib.loads(conteudo)
+    else:
+        dados = json.loads(conteudo)
+
+    comuns = {k: v for k, v in dados.items() if k != "analises"}
+    base = monta_options(comuns, base)
+
+    tarefas = []
+    for item in dados.get("analises") or [comuns]:
+        if not item.get("analise"):
+            raise Exception(f"Tarefa sem o nome da anlise em {caminho}")
+        tarefas.append(Tarefa(item["analise"], monta_options(item, base)))
+
+    return tarefas
@@ -0,0 +1,114 @@
+"""Críticas no modo incremental (--incremental) contra o SQLiteBackend."""
+import glob
+import hashlib
+import os
+import sqlite3
+
+import pytest
+
+from analysis import Criticas_HH_e_HM as criticas
+from sisposbase import sqlbackend, sqlcache
+from sisposbase.sqlbackend import SQLiteBackend
+
+
+def funcoes_tsql(conn):
+    # As funções do T-SQL usadas no sql_resumo
+    conn.create_function("concat", -1, lambda *a: "".join("" if v is None else str(v) for v in a))
+    conn.create_function("hashbytes", 2, lambda alg, texto: hashlib.sha256(texto.encode()).digest())
+    conn.create_function("checksum", 1, lambda b: int.from_bytes(b[:4], "big", signed=True))
+    return conn
+
+
+class CriticasSQLite(criticas.Criticas):
+    # Sem perguntas: o período vem pronto em inputfiles
+    findfiles = ()
+
+    def sql_crimeshh(self, matriculas=None):
+        return (
+            "select matricula, turno, data Data, htipo, horas CRIMES_HH_Horas, minutos CRIMES_HH_Minut\n"
+            f"from hh where 1 = 1 {criticas.filtro_matriculas('matricula', matriculas)}\n"
+            "order by data, turno, matricula;"
+        )
+
+    def sql_crimeshm(self, matriculas=None):
+        return (
+            "select matricula matricula_maquina, turno, data Data, htipo, horas CRIMES_HM_Horas, minutos CRIMES_HM_Minut\n"
+            f"from hm where 1 = 1 {criticas.filtro_matriculas('matricula', matriculas)}\n"
+            "order by data, turno, matricula;"
+        )
+
+
+@pytest.fixture
+def banco(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(sqlcache, "CACHEPATH", str(tmp_path / "cache"))
+    monkeypatch.setattr(criticas, "CRITICASPATH", str(tmp_path / "criticas"))
+
+    backend = SQLiteBackend(str(tmp_path / "sispre.sqlite"))
+    connect = backend.connect
+    backend.connect = lambda: funcoes_tsql(connect())
+    monkeypatch.setattr(sqlbackend, "_backend", backend)
+
+    conn = sqlite3.connect(backend.caminho)
+    for tabela in ("hh", "hm"):
+        conn.execute(f"create table {tabela} (matricula int, turno int, data text, htipo int, horas text, minutos int)")
+    yield conn
+    conn.close()
+    backend.fecha()
+
+
+def lanca(conn, tabela, linhas):
+    conn.execute(f"delete from {tabela}")
+    conn.executemany(f"insert into {tabela} values (?, ?, ?, ?, ?, ?)", linhas)
+    conn.commit()
+
+
+def executa(pasta, consultas):
+    analise = CriticasSQLite(options={"batch": True, "incremental": True, "outputpath": str(pasta)})
+    analise.inputfiles.update({"#PERIODOID": 7, "#MES": "01", "#ANO": "2013", "#DIAS1": [], "#DIAS2": []})
+
+    sql_crimeshh = analise.sql_crimeshh
+
+    def registra(matriculas=None):
+        consultas.append(matriculas)
+        return sql_crimeshh(matriculas)
+
+    analise.sql_crimeshh = registra
+    analise.process(analise.inputfiles)
+    analise.closeall_and_report_files()
+
+    (delta,) = glob.glob(os.path.join(str(pasta), "*-delta_*.txt"))
+    with open(delta, encoding="windows-1252") as fd:
+        return fd.read()
+
+
+def test_horas_trocadas_entre_dias(banco, tmp_path):
+    # Turno 1, htipo 0: tem que ter 8h (480 min) no dia
+    lanca(banco, "hh", [
+        (100, 1, "02/01/13", 0, "8", 480),
+        (100, 1, "03/01/13", 0, "7", 420),  # erro
+        (200, 1, "02/01/13", 0, "7", 420),  # erro, não muda
+    ])
+    lanca(banco, "hm", [(5, 1, "02/01/13", 0, "8", 480)])
+
+    consultas = []
+    delta = executa(tmp_path / "1", consultas)
+    assert "HH - NOVOS (2)" in delta
+    assert consultas[-1] is None  # sem execução anterior: o período inteiro
+
+    # Mesmas linhas, mesmos minutos no total: só as horas trocaram de dia
+    lanca(banco, "hh", [
+        (100, 1, "02/01/13", 0, "7", 420),  # erro novo
+        (100, 1, "03/01/13", 0, "8", 480),  # corrigido
+        (200, 1, "02/01/13", 0, "7", 420),
+    ])
+
+    delta = executa(tmp_path / "2", consultas)
+    corrigidos, novos = delta.split("HH - CORRIGIDOS (1)")[1].split("HH - NOVOS (1)")
+    assert "[100] [3/1/2013]" in corrigidos
+    assert "[100] [2/1/2013]" in novos.split("HM - CORRIGIDOS")[0]
+    assert "[200]" not in delta
+
+    # Só a matrícula alterada foi buscada de novo; HM não mudou
+    assert consultas[-1] == ["100"]
+    assert "HM - CORRIGIDOS (0)" in delta and "HM - NOVOS (0)" in delta
@@ -0,0 +1,122 @@
+"""Exportação dos dados agregados das análises em arquivos colunares tipados (--exporta)."""
+import glob
+import json
+import os
+
+import pytest
+
+from sisposbase import columnar, exportacao, horas
+
+
+def roda_hhreal(pasta, exporta):
+    from analysis.hhreal import HHReal
+    from benchmarks.gerador import gera
+
+    caminho = gera(str(pasta), "hhreal", 2)
+    analise = HHReal(options={"batch": True, "outputpath": str(pasta / (exporta or "sem")), "exporta": exporta,
+                              "answers": {"MES": "01", "ANO": "2013", "HHREAL": caminho}})
+    analise.run()
+    return analise
+
+
+def arvore(linhas):
+    # [(os, ..., horas)] -> {os: {...: horas}}
+    retval = {}
+    for *chaves, valor in linhas:
+        d = retval
+        for chave in chaves[:-1]:
+            d = d.setdefault(chave, {})
+        d[chaves[-1]] = valor
+    return retval
+
+
+def test_hhreal_exporta_colunar(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    analise = roda_hhreal(tmp_path, "colunar")
+
+    (jdata,) = glob.glob(os.path.join(analise.outputpath, "HHReal_jdata_01-2013_*.col"))
+    (jdata2,) = glob.glob(os.path.join(analise.outputpath, "HHReal_jdata2_01-2013_*.col"))
+
+    cols = columnar.le_arquivo(jdata)
+    assert cols.tipos == {"os": "str", "categoria": "str", "tipo": "str", "horas": "decimal"}
+    assert cols.extra == {"analise": "HHReal", "mes": "01", "ano": "2013"}
+    assert arvore(cols.linhas()) == analise.jdata
+
+    assert arvore(columnar.le_arquivo(jdata2).linhas()) == analise.jdata2
+
+
+@pytest.mark.parametrize("formato", ["parquet", "feather"])
+def test_hhreal_exporta_arrow(tmp_path, monkeypatch, formato):
+    pyarrow = pytest.importorskip("pyarrow")
+    import pyarrow.feather
+    import pyarrow.parquet
+
+    monkeypatch.chdir(tmp_path)
+    analise = roda_hhreal(tmp_path, formato)
+
+    (caminho,) = glob.glob(os.path.join(analise.outputpath, f"HHReal_jdata_01-2013_*.{formato}"))
+    le = pyarrow.parquet.read_table if formato == "parquet" else pyarrow.feather.read_table
+    tabela = le(caminho)
+
+    assert tabela.schema.field("horas").type == pyarrow.decimal128(18, 6)
+    assert json.loads(tabela.schema.metadata[b"sispos"])["analise"] == "HHReal"
+
+    linhas = zip(*(tabela.column(n).to_pylist() for n in ("os", "categoria", "tipo", "horas")))
+    assert arvore(linhas) == {
+        os_: {cat: {t: horas.para_decimal(v) for t, v in tipos.items()} for cat, tipos in cats.items()}
+        for os_, cats in analise.jdata.items()
+    }
+
+
+def test_sem_exporta_nada_muda(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    analise = roda_hhreal(tmp_path, None)
+    assert not [n for n in os.listdir(analise.outputpath) if "jdata" in n]
+
+
+def test_formato_sem_pyarrow(monkeypatch):
+    monkeypatch.setattr(exportacao, "tem_pyarrow", lambda: False)
+    assert exportacao.formato_disponivel("auto") == "colunar"
+    assert exportacao.formato_disponivel("parquet") == "colunar"
+    assert exportacao.formato_disponivel("colunar") == "colunar"
+    with pytest.raises(Exception):
+        exportacao.formato_disponivel("xlsx")
+
+
+def test_colunas_de_valores_datas_e_vazias(tmp_path):
+    schema = (("data", columnar.DATA_DDMMAA), ("n", columnar.INT), ("f", columnar.FLOAT), ("s", columnar.STR))
+    cols = columnar.colunas_de_valores([(734869, 1, 0.5, "a"), (734870, -2, float("nan"), "b")], schema)
+
+    caminho = str(tmp_path / "x.col")
+    with open(caminho, "wb") as f:
+        exportacao.grava(f, cols, "colunar", {"periodo": 7})
+    lidas = columnar.le_arquivo(caminho)
+    assert lidas.tipos == cols.tipos
+    assert list(lidas.linhas("data", "n", "s")) == [(734869, 1, "a"), (734870, -2, "b")]
+
+    vazias = columnar.colunas_de_valores([], schema)
+    assert len(vazias) == 0 and vazias.nomes == ["data", "n", "f", "s"]
+
+
+def test_criticas_achados():
+    from analysis.Criticas_HH_e_HM import Criticas, achados_schema, julgalinhas, limites_hh
+
+    crimes = [
+        ("matricula", "turno", "Data", "htipo", "horas", "minutos"),
+        ("100", "1", "02/01/13", "0", "8", "480"),  # ok
+        ("100", "1", "03/01/13", "0", "7", "420"),  # turno 1 tem que ter 8h
+        ("200", "4", "02/01/13", "0", "21", "1260"),  # turno 4 só com htipo 3
+        ("300", "1", "05/01/13", "0", "8", "480"),  # sábado
+    ]
+    analise = Criticas.__new__(Criticas)
+    achados = []
+    criticas = analise.criticas_por_matricula({"#DIAS1": [], "#DIAS2": []}, crimes, limites_hh, julgalinhas, achados)
+
+    assert sum(len(b) for b in criticas.values()) == len(achados) == 3
+    cols = columnar.colunas_de_valores([("HH", *a) for a in achados], achados_schema)
+    assert list(cols.linhas("matricula", "turno", "minutos", "verificacao")) == [
+        (100, 1, 420, "lancamento"),
+        (200, 4, 1260, "lancamento"),
+        (300, 1, 480, "lancamento"),
+    ]
+    assert columnar.data_de_ordinal(cols["data"][0]).strftime("%d/%m/%Y") == "03/01/2013"
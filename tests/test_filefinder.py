@@ -0,0 +1,25 @@
+"""Índice dos arquivos de entrada (sisposbase.filefinder.IndiceDeEntradas)."""
+import os
+import time
+
+from sisposbase.filefinder import IndiceDeEntradas
+
+
+def test_arquivo_regravado_com_o_mesmo_nome(tmp_path):
+    antigo = time.time() - 3600
+    for nome, segundos in (("hhreal_0113.txt", 100), ("hhreal_01-2013.txt", 200)):
+        (tmp_path / nome).write_text("x")
+        os.utime(tmp_path / nome, (antigo + segundos, antigo + segundos))
+    os.utime(tmp_path, (antigo, antigo))
+
+    indice = IndiceDeEntradas(str(tmp_path))
+    assert indice.escolhe("hhreal", (1, 13)).nome == "hhreal_01-2013.txt"
+
+    # Exportado de novo por cima, com o mesmo nome: a pasta não muda, o arquivo sim
+    (tmp_path / "hhreal_0113.txt").write_text("exportado de novo")
+    os.utime(tmp_path, (antigo, antigo))
+
+    escolhido = indice.escolhe("hhreal", (1, 13))
+    assert indice.varreduras == 1
+    assert escolhido.nome == "hhreal_0113.txt"
+    assert escolhido.tamanho == len("exportado de novo")
@@ -0,0 +1,182 @@
+"""Histórico colunar dos períodos fechados e as tendências de vários períodos."""
+import os
+import random
+from decimal import Decimal
+
+import pytest
+
+from sisposbase import columnar, historico, horas, sqlcache
+from sisposbase.columnar import DATA_DDMMAAAA, DECIMAL, FLOAT, INT, STR
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Períodos do catálogo falso: 1 e 2 fechados, 3 aberto
+PERIODOS = {
+    1: ("11", "2012", "10/12/2012", "26/10/2012", "25/11/2012"),
+    2: ("12", "2012", "10/01/2013", "26/11/2012", "25/12/2012"),
+    3: ("1", "2013", "ABERTO", "26/12/2012", "25/01/2013"),
+}
+
+DEPTOS = ["IPU", "IPU/C", "IPS/S", "IPC/M", "IPC/JP", "IQ", "IQ-LAB", "XYZ", "IE"]
+CARGOS = ["SOLDADOR", "CALDEIREIRO", "APONT. PRODUCAO", "ENGENHEIRO", "TEC. IND. MECANICA"]
+
+
+class CatalogoFalso:
+    def periodos(self):
+        return dict(PERIODOS)
+
+    def periodo(self, perid):
+        return PERIODOS.get(int(perid))
+
+    def seleciona(self, texto):
+        return int(texto)
+
+    def texto(self):
+        return ""
+
+
+class CacheQuenteFalso:
+    catalogo = CatalogoFalso()
+
+
+def horas_texto(rnd):
+    return "%d,%06d" % (rnd.randint(0, 3000), rnd.choice([0, 500000, 5000, rnd.randint(0, 999999)]))
+
+
+def resultado(sql, periodo):
+    """O result set que o banco devolveria para a consulta da série (determinístico)."""
+    rnd = random.Random(f"{periodo}{sql[:40]}")
+    if "HorasEfetivas" in sql or "HorasDisponiveis" in sql or "HorasTotais" in sql:
+        return [("dataFechamento", "sigla", "horas")] + [("2013-01-10", d, horas_texto(rnd)) for d in DEPTOS]
+    if "HHREAL" in sql:
+        linhas = [("Periodo", "PROJETO", "OS_ANTIGA", "OS_REDUZIDA", "Funcao", "Depto", "Atividade", "FA", "H")]
+        for k in range(200):
+            linhas.append((str(periodo), f"24000005{k % 7}", "", f"{k % 7}-0", rnd.choice(CARGOS),
+                           rnd.choice(DEPTOS), "18", "FA", horas_texto(rnd)))
+        return linhas
+    if "SUM_71TOT_HE" in sql:
+        return [("SUM_71TOT_HE",), (horas_texto(rnd),)]
+    raise AssertionError(sql)
+
+
+@pytest.fixture
+def ambiente(tmp_path, monkeypatch):
+    from sisposbase.sispos import BaseSISPOS
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(BaseSISPOS, "datafilepath", os.path.join(RAIZ, "datafiles"))
+    monkeypatch.setattr(sqlcache, "_fechados", {1: True, 2: True, 3: False})
+    monkeypatch.setattr(historico, "_padrao", historico.HistoricoDePeriodos(str(tmp_path / "hist"), persistente=True))
+
+    consultas = []
+
+    def getsqldata_many(sqlcodes, periodo=None):
+        consultas.extend((periodo, sql) for sql in sqlcodes)
+        return [[resultado(sql, periodo)] for sql in sqlcodes]
+
+    import analysis.tendencias
+
+    monkeypatch.setattr(analysis.tendencias, "getsqldata_many", getsqldata_many)
+    return tmp_path, consultas
+
+
+def roda_tendencias(pasta, exporta=None):
+    from analysis.tendencias import Tendencias
+
+    analise = Tendencias(options={"batch": True, "outputpath": str(pasta), "cachequente": CacheQuenteFalso(),
+                                  "exporta": exporta, "answers": {"PERIODOINI": "1", "PERIODO": "3"}})
+    return analise, analise.run()
+
+
+def test_arquivo_colunar_ida_e_volta(tmp_path):
+    linhas = ["a|1|2,5|01/02/2013|0,5|", "b|2|1,25|02/02/2013|1,000001|", "a|-3|0|03/02/2013||"]
+    schema = (("nome", STR), ("n", INT), ("f", FLOAT), ("data", DATA_DDMMAAAA), ("horas", DECIMAL))
+    cols = columnar.le_colunas(linhas, schema, cabecalho=False)
+
+    caminho = str(tmp_path / "x.col")
+    columnar.grava_arquivo(caminho, cols, {"periodo": 7})
+    lidas = columnar.le_arquivo(caminho)
+
+    assert lidas.nomes == cols.nomes
+    assert lidas.tipos == cols.tipos
+    assert list(lidas.linhas()) == list(cols.linhas())
+    assert lidas.extra == {"periodo": 7}
+
+
+def test_fatoriza_e_concatena():
+    a = columnar.le_colunas(["x|1,5|", "y|2|", "x|1|"], (("k", STR), ("h", DECIMAL)), cabecalho=False)
+    b = columnar.le_colunas(["y|3|"], (("k", STR), ("h", DECIMAL)), cabecalho=False)
+
+    cols = columnar.concatena([a, b], indice="p")
+    assert list(cols.linhas("p", "k")) == [(0, "x"), (0, "y"), (0, "x"), (1, "y")]
+
+    codigos, distintos = columnar.fatoriza(cols["p"], cols["k"])
+    assert sorted(distintos) == [(0, "x"), (0, "y"), (1, "y")]
+    assert [distintos[c] for c in list(codigos)] == [(0, "x"), (0, "y"), (0, "x"), (1, "y")]
+
+
+def test_tendencias_e_historico(ambiente):
+    pasta, consultas = ambiente
+    from analysis.hhreal import HHReal
+    from analysis.iomo_capacidadeinstalada import SETORES
+
+    analise, linhas = roda_tendencias(pasta / "a")
+    assert [l["periodo"] for l in linhas] == [1, 2, 3]
+    assert len(consultas) == 3 * len(historico.SERIES)
+
+    # Os mesmos números em Decimal, direto dos result sets
+    setores = {s for grupo in SETORES.values() for s in grupo}
+    sqls = {}
+    for periodo, sql in consultas:
+        sqls.setdefault(periodo, []).append(sql)
+
+    for l in linhas:
+        totais, hh, he = {}, {}, Decimal("0")
+        for sql in sqls[l["periodo"]]:
+            rs = resultado(sql, l["periodo"])
+            for r in rs[1:]:
+                valor = Decimal(r[-1].replace(",", "."))
+                if len(r) == 3 and r[1] in setores:
+                    chave = "hefet" if "HorasEfetivas" in sql else "hdisp" if "HorasDisponiveis" in sql else "htot"
+                    totais[chave] = totais.get(chave, Decimal("0")) + valor
+                elif len(r) == 9:
+                    cat = HHReal.catrules.classifica(r[4], r[5])[0]
+                    hh[cat] = hh.get(cat, Decimal("0")) + valor
+                elif len(r) == 1:
+                    he += valor
+
+        for chave in ("hefet", "hdisp", "htot"):
+            assert horas.para_decimal(l[chave]) == totais[chave]
+        assert str(l["iomo"]) == str(round(totais["hefet"] / totais["hdisp"] * Decimal("100"), 0))
+        assert str(l["capac"]) == str(round(totais["hefet"] / totais["htot"] * Decimal("100"), 0))
+        assert horas.para_decimal(l["he"]) == he
+        assert {c: horas.para_decimal(v) for c, v in l["hh"].items() if v} == hh
+
+    # Só os períodos fechados ficam no histórico
+    assert historico.historico_padrao().periodos() == [1, 2]
+
+    # Segunda vez: os fechados vêm do histórico, só o aberto vai ao banco
+    consultas.clear()
+    analise2, linhas2 = roda_tendencias(pasta / "b", exporta="colunar")
+    assert {periodo for periodo, _ in consultas} == {3}
+    assert linhas2 == linhas
+
+    # Exportação (--exporta): as mesmas linhas, tipadas
+    (periodos,) = [f.name for f in analise2.outputfiles.values() if "-periodos_" in f.name]
+    cols = columnar.le_arquivo(periodos)
+    assert list(cols.linhas("periodo", "hefet", "he")) == [(l["periodo"], l["hefet"], l["he"]) for l in linhas]
+    assert cols.extra["analise"] == "Tendencias"
+
+
+def test_importa_saida_do_sispre(ambiente, tmp_path):
+    rs = resultado("SUM_71TOT_HE", 2)
+    caminho = str(tmp_path / "HE_TOTAL_122012.txt")
+    with open(caminho, "w", encoding="windows-1252", newline="") as f:
+        f.write("".join("|".join(r) + "|\r\n" for r in rs))
+
+    h = historico.historico_padrao()
+    assert historico.serie_do_sql(os.path.join("sispre_sql", "He_TOTAL.sql")).nome == "he_total"
+    assert not h.importa(3, "he_total", caminho)  # período aberto
+    assert h.importa(2, "he_total", caminho)
+    assert list(h.carrega(2, "he_total").linhas()) == [(horas.de_texto(rs[1][0]),)]
+
@@ -0,0 +1,134 @@
+"""Horas em ponto fixo (sisposbase.horas): mesmos resultados que as contas em Decimal."""
+import random
+from array import array
+from decimal import Decimal
+
+import pytest
+
+from sisposbase import horas
+
+# Metades exatas (onde o "half even" decide), zero, negativos e valores grandes
+BORDAS = [0, 1, -1, 4999, 5000, 5001, 15000, 25000, -5000, -15000, -25000, 994999, 995000, 1005000,
+          10**12 + 5000, -(10**12) - 5000, 123456789, 500000, 1500000, 2500000, -500000]
+
+
+def aleatorios(n=2000, semente=1301):
+    rnd = random.Random(semente)
+    return [rnd.randint(-(10**10), 10**10) for _ in range(n)] + [rnd.randint(-10**4, 10**4) for _ in range(n)]
+
+
+@pytest.mark.parametrize("casas", range(7))
+def test_formata_igual_decimal_quantize(casas):
+    exp = Decimal(1).scaleb(-casas)
+    for v in BORDAS + aleatorios():
+        d = horas.para_decimal(v)
+        assert horas.formata(v, casas) == str(d.quantize(exp))
+        assert horas.formata(v, casas) == format(d, f".{casas}f")
+        assert horas.arredonda(v, casas) == horas.de_decimal(d.quantize(exp))
+
+
+def test_formata_padrao_duas_casas():
+    assert horas.formata(1234567) == "1.23"
+    assert horas.formata(5000) == "0.00"
+    assert horas.formata(15000) == "0.02"
+    assert horas.formata(-1000) == "-0.00"
+    assert horas.formata(4000000, casas=6) == "4.000000"
+    with pytest.raises(Exception):
+        horas.formata(1, casas=7)
+
+
+def test_de_texto():
+    assert horas.de_texto("1,500000") == 1500000
+    assert horas.de_texto("8.5") == 8500000
+    assert horas.de_texto("-0,000001") == -1
+    assert horas.de_texto("") == 0
+    # Mais casas que o ponto fixo: arredonda "half even", como o resto do módulo
+    assert horas.de_texto("8,3333333") == 8333333
+    assert horas.de_texto("0,0000005") == 0
+    assert horas.de_texto("0,0000015") == 2
+    assert horas.de_texto("-0,0000015") == -2
+
+
+def test_somas_iguais_decimal():
+    valores = aleatorios()
+    textos = ["{:.6f}".format(v / 10**6).replace(".", ",") for v in valores]
+
+    esperado = sum((Decimal(t.replace(",", ".")) for t in textos), Decimal("0"))
+    fixos = [horas.de_texto(t) for t in textos]
+
+    for total in (horas.soma(fixos), horas.soma(array("q", fixos))):
+        assert horas.para_decimal(total) == esperado
+        assert horas.formata(total) == str(esperado.quantize(Decimal(".01")))
+        assert horas.para_float(total) == float(esperado)
+
+
+def test_percentual_igual_decimal():
+    rnd = random.Random(7)
+    pares = [(rnd.randint(0, 10**11), rnd.randint(1, 10**11)) for _ in range(5000)]
+    # Percentuais terminados em ,5 exatos
+    pares += [(5, 1000), (15, 1000), (25, 1000), (875, 1000), (1, 8), (3, 8), (5, 8)]
+    for parte, total in pares:
+        esperado = round((horas.para_decimal(parte) / horas.para_decimal(total)) * Decimal("100"), 0)
+        assert str(horas.percentual(parte, total)) == str(esperado)
+
+    with pytest.raises(ZeroDivisionError):
+        horas.percentual(1, 0)
+
+
+def test_hhreal_totais_iguais_decimal(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    from analysis.hhreal import HHReal
+    from benchmarks.gerador import gera
+
+    caminho = gera(str(tmp_path), "hhreal", 3)
+    analise = HHReal(options={"batch": True, "outputpath": str(tmp_path / "saida"),
+                              "answers": {"MES": "01", "ANO": "2013", "HHREAL": caminho}})
+    jdata, jdata2 = analise.run(), analise.jdata2
+
+    # As mesmas somas, em Decimal, direto do arquivo
+    esperado, esperado2 = {}, {}
+    with open(caminho, encoding="windows-1252") as f:
+        next(f)
+        for linha in f:
+            _, _, os_, reduzida, descricao, depto, atividade, fa, tothora, *_ = linha.split("|")
+            codped = "{} ({})".format(os_, reduzida)
+            valor = Decimal(tothora.replace(",", "."))
+            cat, _ = analise.judgecat(descricao, depto)
+            for htype in analise.judgewts(fa, atividade):
+                cats = esperado.setdefault(codped, {}).setdefault(cat, {})
+                cats[htype] = cats.get(htype, Decimal("0")) + valor
+            ativs = esperado2.setdefault(codped, {})
+            ativs[atividade] = ativs.get(atividade, Decimal("0")) + valor
+
+    def quantizado(arvore):
+        if isinstance(arvore, dict):
+            return {k: quantizado(v) for k, v in arvore.items()}
+        if isinstance(arvore, Decimal):
+            return str(arvore.quantize(Decimal(".01")))
+        return horas.formata(arvore)
+
+    assert quantizado(jdata) == quantizado(esperado)
+    assert quantizado(jdata2) == quantizado(esperado2)
+
+
+def test_hm_por_os_linha_com_horas_do_arquivo(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    from analysis.hm_por_os import HM_POR_OS
+
+    caminho = tmp_path / "hm_por_os.txt"
+    caminho.write_bytes(
+        "periodo|anomes|os|reduzida|matr_maquina|nome_maquina|atividade|fa|tothora|\r\n"
+        "7|1301|2400000509|4108-4|5114301|FRESADORA VERTICAL HELLER|18|FA|9.0|\r\n"
+        "7|1301|2400000509|4108-4|5114301|FRESADORA VERTICAL HELLER|18|FA|4,000000|\r\n"
+        "7|1301|2400000509|4108-4|5114301|FRESADORA VERTICAL HELLER|18|FA|8,3333333|\r\n".encode("windows-1252")
+    )
+    analise = HM_POR_OS(options={"batch": True, "outputpath": str(tmp_path / "saida"),
+                                 "answers": {"MES": "01", "ANO": "2013", "HM_POR_OS": str(caminho)}})
+    analise.run()
+
+    # Na linha, as horas como vieram no arquivo (como o str(Decimal) de antes); os totais somam em ponto fixo
+    (html,) = (tmp_path / "saida").glob("HM_POR_OS_01-2013_*.html")
+    texto = html.read_text(encoding="windows-1252")
+    for celula in ("9.0", "4.000000", "8.3333333"):
+        assert f'<td align="center">{celula}</td>' in texto
+    assert sum(analise.jdata2["2400000509 (4108-4)"].values()) == horas.de_texto("21,333333")
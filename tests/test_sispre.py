@@ -0,0 +1,62 @@
+"""Sispre --run: relatórios do lote executados no próprio processo."""
+import json
+import sqlite3
+
+import pytest
+
+from analysis.sispre import Sispre
+from sisposbase import sqlbackend, sqlcache
+from sisposbase.sqlbackend import SQLiteBackend
+
+LOTE = [("a.sql", "a.txt", "select x from t;")]
+
+
+class SispreSemPerguntas(Sispre):
+    findfiles = ()
+
+
+@pytest.fixture
+def banco(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(sqlcache, "ativo", False)
+
+    backend = SQLiteBackend(str(tmp_path / "sispre.sqlite"))
+    monkeypatch.setattr(sqlbackend, "_backend", backend)
+
+    conn = sqlite3.connect(backend.caminho)
+    conn.execute("create table t (x text)")
+    conn.execute("insert into t values ('SOLDADOR')")
+    conn.commit()
+    yield conn
+    conn.close()
+    backend.fecha()
+
+
+def executa_lote(pasta):
+    analise = SispreSemPerguntas(options={"batch": True, "run": True, "outputpath": str(pasta)})
+    analise.inputfiles["#PERIODOID"] = 7
+    analise.executa_lote(LOTE, str(pasta / "out"))
+
+
+def test_relatorio_com_erro_roda_de_novo(banco, tmp_path, capsys, monkeypatch):
+    executa_lote(tmp_path)
+    saida = tmp_path / "out" / "a.txt"
+    assert saida.read_bytes() == b"x|\r\nSOLDADOR|\r\n"
+
+    # Executado de novo (--refresh) e a consulta falha: o erro do banco aparece e o arquivo anterior fica
+    banco.execute("drop table t")
+    banco.commit()
+    capsys.readouterr()
+    monkeypatch.setattr(sqlcache, "refresh", True)
+    executa_lote(tmp_path)
+    monkeypatch.setattr(sqlcache, "refresh", False)
+    out = capsys.readouterr().out
+    assert "[err] a.sql: no such table: t" in out
+    assert saida.read_bytes() == b"x|\r\nSOLDADOR|\r\n"
+    assert sorted(p.name for p in (tmp_path / "out").iterdir()) == ["_manifesto.json", "a.txt"]
+    assert "a.txt" not in json.loads((tmp_path / "out" / "_manifesto.json").read_text(encoding="utf-8"))
+
+    # Não é pulado como "já está atualizado" na próxima execução
+    executa_lote(tmp_path)
+    out = capsys.readouterr().out
+    assert "[pul]" not in out and "[err] a.sql" in out
@@ -0,0 +1,87 @@
+"""getsqldata() e iter_sqldata() contra o SQLiteBackend, e o pool de conexões."""
+import sqlite3
+
+import pytest
+
+from sisposbase import get_sql_data, sqlbackend, sqlcache
+from sisposbase.sqlbackend import PooledDBAPIBackend, SQLExecutionError, SQLiteBackend
+
+SQL = (
+    "-- dois result sets, como os relatórios do Sispre\n"
+    "select 7 as matricula, 'SOLDADOR' as cargo, 1.5 as horas\n"
+    "union all select 8, 'CALDEIREIRO', 0.25;\n"
+    "select count(*) as total from (select 1 union all select 2);\n"
+)
+
+
+@pytest.fixture
+def sqlite(tmp_path, monkeypatch):
+    monkeypatch.setattr(sqlcache, "CACHEPATH", str(tmp_path / "cache"))
+    backend = SQLiteBackend()
+    monkeypatch.setattr(sqlbackend, "_backend", backend)
+    yield backend
+    backend.fecha()
+
+
+def test_getsqldata_sqlite(sqlite):
+    rs1, rs2 = get_sql_data.getsqldata(SQL)
+
+    # Cabeçalho primeiro, valores em texto com vírgula decimal (como o SingleSQLExecutor.exe)
+    assert rs1 == [("matricula", "cargo", "horas"), ("7", "SOLDADOR", "1,5"), ("8", "CALDEIREIRO", "0,25")]
+    assert rs1[1].cargo == "SOLDADOR"
+    assert rs2 == [("total",), ("2",)]
+
+
+def test_iter_sqldata_sqlite(sqlite):
+    resultados = get_sql_data.iter_sqldata(SQL, cache=False)
+
+    primeiro = next(resultados)
+    assert next(primeiro) == ("matricula", "cargo", "horas")
+    assert [r.horas for r in primeiro] == ["1,5", "0,25"]
+
+    assert list(next(resultados)) == [("total",), ("2",)]
+    assert next(resultados, None) is None
+
+
+def test_pool_descarta_conexao_com_erro():
+    conexoes = []
+
+    def connect():
+        conexoes.append(sqlite3.connect(":memory:", check_same_thread=False))
+        return conexoes[-1]
+
+    backend = PooledDBAPIBackend(connect, tamanho=2, lote=False)
+
+    # Conexão devolvida ao pool e reaproveitada
+    assert backend.executa("select 1 as x;") == [[["x"], ["1"]]]
+    assert backend.executa("select 2 as x;") == [[["x"], ["2"]]]
+    assert len(conexoes) == 1
+
+    # Depois de um erro a conexão é descartada e a próxima consulta abre outra
+    with pytest.raises(SQLExecutionError):
+        backend.executa("select * from tabela_que_nao_existe;")
+    with pytest.raises(sqlite3.ProgrammingError):
+        conexoes[0].execute("select 1")
+
+    assert backend.executa("select 3 as x;") == [[["x"], ["3"]]]
+    assert len(conexoes) == 2
+    backend.fecha()
+
+
+def test_falha_no_modo_nao_interativo(sqlite, tmp_path):
+    from sisposbase.sispos import BaseSISPOSSQL
+
+    class Consulta(BaseSISPOSSQL):
+        findfiles = (("#NADA", lambda self: "-"),)
+
+        def process(self, f):
+            return get_sql_data.getsqldata("select * from tabela_que_nao_existe;")
+
+    # --batch: o erro chega a quem rodou a análise (status de saída != 0)
+    with pytest.raises(SQLExecutionError, match="tabela_que_nao_existe"):
+        Consulta(options={"batch": True, "outputpath": str(tmp_path)}).run()
+
+    # Interativo: mostra o erro e sai, como sempre
+    with pytest.raises(SystemExit) as saida:
+        Consulta(options={"outputpath": str(tmp_path)}).run()
+    assert saida.value.code == 0
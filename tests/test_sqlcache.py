@@ -0,0 +1,122 @@
+"""Cache de consultas (sisposbase.sqlcache): separado por banco e só um atalho, nunca um erro."""
+import os
+import sqlite3
+
+import pytest
+
+from sisposbase import get_sql_data, historico, sqlbackend, sqlcache
+from sisposbase.catalogo import CatalogoDePeriodos
+from sisposbase.columnar import STR, le_colunas
+from sisposbase.sqlbackend import SQLiteBackend, sem_senha
+
+SQL = "select x from t;"
+
+
+def banco(pasta, nome, valor):
+    caminho = str(pasta / f"{nome}.sqlite")
+    with sqlite3.connect(caminho) as conn:
+        conn.execute("create table t (x text)")
+        conn.execute("insert into t values (?)", (valor,))
+    conn.close()
+    return SQLiteBackend(caminho)
+
+
+@pytest.fixture
+def bancos(tmp_path, monkeypatch):
+    monkeypatch.setattr(sqlcache, "CACHEPATH", str(tmp_path / "cache"))
+    monkeypatch.setattr(sqlcache, "ativo", True)
+    monkeypatch.setattr(sqlcache, "refresh", False)
+    # Período 1 fechado: o resultado nunca expira
+    monkeypatch.setattr(sqlcache, "_fechados", {1: True})
+
+    a, b = banco(tmp_path, "a", "BANCO A"), banco(tmp_path, "b", "BANCO B")
+    monkeypatch.setattr(sqlbackend, "_backend", a)
+    yield a, b
+    a.fecha()
+    b.fecha()
+
+
+def usa(backend, monkeypatch):
+    monkeypatch.setattr(sqlbackend, "_backend", backend)
+
+
+def valor():
+    return get_sql_data.getsqldata(SQL, periodo=1)[0][1].x
+
+
+def test_cache_separado_por_banco(bancos, monkeypatch):
+    a, b = bancos
+    assert valor() == "BANCO A"
+
+    # Outro banco: não aproveita a entrada do primeiro
+    usa(b, monkeypatch)
+    assert valor() == "BANCO B"
+
+    # Cada um continua com a sua entrada (o banco A não é consultado de novo)
+    usa(a, monkeypatch)
+    monkeypatch.setattr(a, "itera", None)
+    assert valor() == "BANCO A"
+
+    assert sqlcache.chave(SQL, a.identidade()) != sqlcache.chave(SQL, b.identidade())
+    assert SQLiteBackend().identidade() != SQLiteBackend().identidade()
+
+
+def test_catalogo_e_historico_separados_por_banco(bancos, monkeypatch, tmp_path):
+    a, b = bancos
+
+    catalogo = CatalogoDePeriodos(str(tmp_path / "periodos.json"), persistente=True)
+    catalogo._dados["periodos"]["1"] = {"mes": "1", "ano": "2013", "status": "10/02/2013",
+                                        "dtini": "26/12/2012", "dtfim": "25/01/2013", "fechado": True}
+    catalogo._grava()
+
+    h = historico.HistoricoDePeriodos(str(tmp_path / "hist"), persistente=True)
+    assert h.grava(1, "he_total", le_colunas(["1,5|"], (("horas", STR),), cabecalho=False))
+    assert h.periodos() == [1]
+
+    usa(b, monkeypatch)
+    assert CatalogoDePeriodos(str(tmp_path / "periodos.json"), persistente=True)._dados["periodos"] == {}
+    assert h.carrega(1, "he_total") is None
+    assert h.periodos() == []
+
+    usa(a, monkeypatch)
+    assert "1" in CatalogoDePeriodos(str(tmp_path / "periodos.json"), persistente=True)._dados["periodos"]
+    assert list(h.carrega(1, "he_total").linhas()) == [("1,5",)]
+
+
+def test_entrada_sem_txt_vai_ao_banco(bancos):
+    assert valor() == "BANCO A"
+
+    # O .json ainda está lá, o .txt sumiu (ex.: apagado por outra execução)
+    txtpath, _ = sqlcache._caminhos(SQL, sqlcache.banco_atual())
+    os.remove(txtpath)
+
+    assert sqlcache.abre(SQL, 1) is None
+    assert valor() == "BANCO A"
+    assert os.path.isfile(txtpath)
+
+
+def test_falha_ao_publicar_nao_interrompe(bancos, monkeypatch):
+    def replace(origem, destino):
+        raise PermissionError(13, "O arquivo já está sendo usado por outro processo", destino)
+
+    monkeypatch.setattr(sqlcache.os, "replace", replace)
+    assert valor() == "BANCO A"
+    assert sqlcache.abre(SQL, 1) is None
+    assert [n for n in os.listdir(sqlcache.CACHEPATH) if n.endswith(".tmp")] == []
+
+
+def test_identidade_odbc_sem_senha():
+    assert sem_senha("DRIVER={SQL Server};SERVER=srv;DATABASE=cp;UID=sispos;PWD=s3cr3t") == (
+        "DRIVER={SQL Server};SERVER=srv;DATABASE=cp;UID=sispos"
+    )
+    assert sem_senha("DSN=producao;Password={a;b};UID=x") == "DSN=producao;UID=x"
+
+
+def test_primeiro_result_set_vai_para_o_cache(bancos):
+    sql = "select x from t; select 2 as y;"
+    assert [r.x for r in get_sql_data.iter_sqldata_primeiro(sql, periodo=1)] == ["x", "BANCO A"]
+
+    # O segundo result set também foi lido, a entrada está completa no cache
+    cached = sqlcache.abre(sql, 1)
+    assert cached is not None
+    cached.close()
@@ -0,0 +1,64 @@
+"""Inicialização do sispos.py: orçamento de tempo e registro preguiçoso das análises."""
+import os
+import subprocess
+import sys
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# "python sispos.py Criticas" até a primeira pergunta (medido em ~0,1s).
+ORCAMENTO_SEGUNDOS = 1.0
+
+
+def python(args, cwd):
+    # Roda num diretório temporário: o sisposbase cria inputs/ e outputs/ no diretório atual.
+    env = dict(os.environ, PYTHONPATH=RAIZ, PYTHONIOENCODING="utf-8")
+    return subprocess.run(
+        [sys.executable] + args,
+        cwd=cwd,
+        env=env,
+        stdin=subprocess.DEVNULL,
+        capture_output=True,
+        timeout=60,
+    )
+
+
+def test_startup_budget(tmp_path):
+    # Sem período e em modo não interativo a análise para na primeira pergunta,
+    # então só a inicialização é medida (importações, menu e criação da análise).
+    tempos = []
+    for _ in range(3):
+        inicio = time.perf_counter()
+        r = python([os.path.join(RAIZ, "sispos.py"), "Criticas", "--batch"], tmp_path)
+        tempos.append(time.perf_counter() - inicio)
+
+        assert r.returncode == 1
+        assert "PERIODO" in r.stdout.decode("utf-8")
+
+    assert min(tempos) < ORCAMENTO_SEGUNDOS
+
+
+def test_only_chosen_analysis_is_imported(tmp_path):
+    codigo = (
+        "import sys, sispos\n"
+        "sispos.SisposRunner().chooseanalysis('Criticas')\n"
+        "print(' '.join(sorted(m for m in sys.modules if m.startswith('analysis.'))))\n"
+    )
+    r = python(["-c", codigo], tmp_path)
+
+    assert r.returncode == 0, r.stderr.decode("utf-8")
+    assert r.stdout.decode("utf-8").split() == ["analysis.Criticas_HH_e_HM"]
+
+
+def test_registry_matches_classes(tmp_path):
+    codigo = (
+        "from analysis import registro\n"
+        "for a in registro:\n"
+        "    if a.disponivel():\n"
+        "        c = a.carrega()\n"
+        "        assert c.__name__ == a.nome, a.nome\n"
+        "        assert c.__doc__ == a.doc, (a.nome, c.__doc__)\n"
+    )
+    r = python(["-c", codigo], tmp_path)
+
+    assert r.returncode == 0, r.stderr.decode("utf-8")
@@ -0,0 +1,79 @@
+"""Várias análises no mesmo processo, ao mesmo tempo em threads, sem misturar o estado."""
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+AMOSTRAS = os.path.join(RAIZ, "sampledata")
+
+HHREAL_CABECALHO = "periodo|anomes|os|reduzida|descricao|depto|atividade|fa|tothora|\r\n"
+
+
+def hhreal_arquivo(pasta, nome, linhas):
+    caminho = os.path.join(pasta, nome)
+    with open(caminho, "w", encoding="windows-1252", newline="") as f:
+        f.write(HHREAL_CABECALHO)
+        for os_, descricao, depto, atividade, horas in linhas:
+            f.write(f"7|1301|{os_}|{os_[-4:]}-0|{descricao}|{depto}|{atividade}|FA|{horas}|\r\n")
+    return caminho
+
+
+def roda(classe, pasta, answers):
+    analise = classe(options={"batch": True, "answers": answers, "outputpath": pasta})
+    return analise, analise.run()
+
+
+def test_analyses_in_threads_are_isolated(tmp_path, monkeypatch):
+    # sisposbase.sispos cria inputs/ e outputs/ no diretório atual ao ser importado
+    monkeypatch.chdir(tmp_path)
+    from analysis.hhreal import HHReal
+    from analysis.htipo0gxx import HTipo0GXX
+
+    findfiles_hhreal = list(HHReal.findfiles)
+
+    hh = [
+        hhreal_arquivo(tmp_path, "hh_a.txt", [("2400000509", "SOLDADOR", "IPS/S", "00", "8,5")]),
+        hhreal_arquivo(
+            tmp_path,
+            "hh_b.txt",
+            [("2400000510", "ENGENHEIRO", "IE", "18", "3,0"), ("2400000510", "ENGENHEIRO", "IE", "80", "1,0")],
+        ),
+    ]
+    htipo = [
+        os.path.join(AMOSTRAS, "HTIPO0GXX1012.TXT"),
+        os.path.join(AMOSTRAS, "HTIPO0GXX1112.TXT"),
+    ]
+
+    def tarefa(i):
+        pasta = str(tmp_path / f"out{i:02}")
+        if i % 2:
+            classe, answers = HHReal, {"MES": "01", "ANO": "2013", "HHREAL": hh[i // 2 % 2]}
+        else:
+            classe, answers = HTipo0GXX, {"MES": "10", "ANO": "2012", "HTIPO0GXX": htipo[i // 2 % 2]}
+        return i, roda(classe, pasta, answers)
+
+    # Resultado esperado de cada entrada, uma análise de cada vez
+    esperado = {i: tarefa(i)[1][1] for i in range(4)}
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        resultados = list(pool.map(tarefa, range(4, 36)))
+
+    for i, (analise, jdata) in resultados:
+        assert jdata == esperado[i % 4]
+        assert jdata is analise.jdata
+        assert all(f.closed for f in analise.outputfiles.values())
+        # Os arquivos gerados e o JSON com os tempos da execução (sisposbase.perfil)
+        saida = os.listdir(analise.outputpath)
+        assert len(analise.outputfiles) + 1 == len(saida)
+        assert len([n for n in saida if n.endswith(".json") and "_perfil_" in n]) == 1
+
+    # Estado nunca é compartilhado entre as instâncias
+    jdatas = [id(a.jdata) for _, (a, _) in resultados]
+    assert len(set(jdatas)) == len(jdatas)
+
+    # dynfindfiles() não mexe mais na lista da classe
+    assert HHReal.findfiles == findfiles_hhreal
+    assert "HHREAL" in [f[0] for f in resultados[1][1][0].findfiles]
+
+    # HHReal acumula também jdata2
+    hhreal = resultados[1][1][0]
+    assert set(hhreal.jdata2) == {"2400000509 (0509-0)"}